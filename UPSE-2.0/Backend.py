@@ -1,11 +1,29 @@
-import re
 import json
+import asyncio
+import contextvars
+import functools
+import inspect
 import operator
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
 from typing import TypedDict, List, Annotated
-from pydantic import BaseModel, Field
 
-from langgraph.graph import StateGraph, START, END
-from model_setup import model  
+from model_setup import CHEAP_MODEL, STRONG_MODEL, get_model, run_async
+from eval_cache import cache
+from instrumentation import (
+    metrics, instrument_node, current_plan, record_llm_usage, record_parse_attempt,
+    record_parse_failure, record_parse_repair,
+)
+from parsing import extract_json, coerce_score
+from edits import number_sentences, apply_edits
+from token_budget import CHUNK_THRESHOLD_TOKENS, check_prompt, count_tokens, fit_feedback, split_sections
+from scheduler import scheduler
+from resilience import FALLBACK_MODEL, call_resilient
+from prescreen import extract_features, gate_failures, length_note
+from similar_index import minhash, similar_essays
 
 
 # Constants
@@ -14,6 +32,152 @@ PREMIUM_THRESHOLD = 9.0
 BASIC_ITERATIONS = 2
 PREMIUM_ITERATIONS = 4
 
+# Adaptive stopping: an iteration improves the essay only if it beats the best
+# score so far by at least min_improvement; the run stops once `patience`
+# iterations in a row have not. Plan -> (min_improvement, patience)
+PLAN_STOPPING = {
+    'free': (0.1, 1),
+    'basic': (0.1, 1),
+    'premium': (0.1, 2),
+}
+
+# Bump whenever an evaluator or summary prompt changes so cached responses
+# produced by the old prompt are no longer reused.
+PROMPT_VERSION = 'v4'
+
+# Nodes whose model output is streamed to the UI token by token
+STREAMED_NODES = ('final_evaluation', 'improve_essay')
+
+# Rubric name -> what that evaluator judges; also the key order of the combined reply
+RUBRICS = {
+    'language': "language quality (grammar, clarity, flow, tone, vocabulary)",
+    'analysis': "analytical depth (reasoning, evidence, critical thinking)",
+    'clarity': "clarity of thought (logical sequencing, transitions, readability)",
+}
+
+# Column of each rubric in a score_history row
+RUBRIC_INDEX = {rubric: index for index, rubric in enumerate(RUBRICS)}
+
+# Model every call in the running node uses; set for workflows compiled for
+# a specific model, otherwise the default model is used
+_workflow_model = contextvars.ContextVar('upse_workflow_model', default=None)
+
+# Follow-up requests allowed for a score missing from an evaluator reply
+FOLLOW_UP_ATTEMPTS = 2
+
+# How each plan evaluates an essay:
+#   'separate' - three rubric evaluators run in parallel (three LLM calls)
+#   'combined' - one call returns all three rubrics at once
+#   'incremental' - each paragraph is scored on all three rubrics and the
+#                   results are kept by content hash, so after a rewrite only
+#                   new or changed paragraphs go back to the model
+#   'chunked'  - the essay is split into sections that are scored on all
+#                three rubrics in parallel and merged, weighted by length
+PLAN_EVAL_MODES = {
+    'free': 'combined',
+    'basic': 'combined',
+    'premium': 'incremental',
+}
+
+# Modes that put the whole essay into one prompt; essays longer than
+# CHUNK_THRESHOLD_TOKENS are evaluated in 'chunked' mode instead
+WHOLE_ESSAY_MODES = ('separate', 'combined')
+# Words of the essay's opening given with each section as context
+SECTION_CONTEXT_WORDS = 80
+
+# How each plan improves an essay:
+#   'rewrite' - the model returns the whole essay again
+#   'edits'   - the model returns a short edit script applied locally (see
+#               edits.py), falling back to a full rewrite if it does not apply
+PLAN_IMPROVE_MODES = {
+    'free': 'rewrite',
+    'basic': 'edits',
+    'premium': 'edits',
+}
+
+# Model cascade: evaluators run on CHEAP_MODEL, and an iteration whose
+# average lands within CASCADE_MARGIN of the plan's threshold (where the
+# decision to stop or keep improving could go either way) is re-scored on
+# STRONG_MODEL. The rewrite model is chosen per plan.
+CASCADE_MARGIN = 0.5
+PLAN_REWRITE_MODELS = {
+    'free': CHEAP_MODEL,
+    'basic': CHEAP_MODEL,
+    'premium': STRONG_MODEL,
+}
+
+# Supersteps one iteration can take: the evaluators, paragraph aggregation
+# and cascade check (each twice when the iteration is escalated), then
+# final_evaluation, check_quality and improve_essay
+STEPS_PER_ITERATION = 9
+
+# Tag on the edit-script call so its JSON is not streamed to the UI as essay text
+EDIT_SCRIPT_TAG = 'edit_script'
+# Tag on hedged duplicate calls, whose tokens would repeat the primary call's
+HEDGE_TAG = 'hedge'
+
+
+def merge_scores(history, update):
+    """
+    Reducer for score_history, a matrix with one fixed-width row per
+    iteration and one column per rubric (RUBRICS order; None until reported).
+    An update {'iteration': i, 'scores': {rubric: score}} fills in row i; a
+    list replaces the whole history.
+    """
+    if isinstance(update, list):
+        return [list(row) for row in update]
+    history = [list(row) for row in history or []]
+    while len(history) <= update['iteration']:
+        history.append([None] * len(RUBRICS))
+    row = history[update['iteration']]
+    for rubric, score in update['scores'].items():
+        row[RUBRIC_INDEX[rubric]] = score
+    return history
+
+
+def score_update(state, **scores) -> dict:
+    """score_history update recording rubric scores for the state's current iteration."""
+    return {'iteration': state.get('iteration_count', 0), 'scores': scores}
+
+
+def current_scores(state, iteration: int = None) -> List[float]:
+    """Rubric scores reported so far for one iteration (default: the current one)."""
+    iteration = state.get('iteration_count', 0) if iteration is None else iteration
+    history = state.get('score_history') or []
+    if iteration >= len(history):
+        return []
+    return [score for score in history[iteration] if score is not None]
+
+
+def score_trajectory(state) -> dict:
+    """The run's score history in an exportable form: rubric columns, per-iteration rows and averages."""
+    history = state.get('score_history') or []
+    averages = []
+    for iteration in range(len(history)):
+        scores = current_scores(state, iteration)
+        averages.append(round(sum(scores) / len(scores), 4) if scores else None)
+    return {'dimensions': list(RUBRICS), 'scores': history, 'averages': averages}
+
+
+def result_summary(output) -> dict:
+    """The parts of a finished run's state that are reported to users (batch files, the HTTP API)."""
+    return {
+        'avg_score': output['avg_score'],
+        'language_feedback': output['language_feedback'],
+        'analysis_feedback': output['analysis_feedback'],
+        'clarity_feedback': output['clarity_feedback'],
+        'overall_feedback': output['overall_feedback'],
+        'final_essay': output['essay'],
+        'iteration_count': output['iteration_count'],
+        'score_trajectory': score_trajectory(output),
+        'stop_reason': output['stop_reason'],
+        'llm_calls_saved': output['llm_calls_saved'],
+        'escalations': output['escalations'],
+        'features': output['features'],
+        'prescreen_failures': output['prescreen_failures'],
+        'similar_essay': output['similar_essay'],
+    }
+
 
 # TypedDict for workflow state
 
@@ -23,7 +187,7 @@ class UPSEState(TypedDict):
     clarity_feedback: str
     overall_feedback: str
     analysis_feedback: str
-    individual_scores: Annotated[List[float], operator.add]
+    score_history: Annotated[List[List[float]], merge_scores]
     improved_essay: str
     max_iterations: int
     avg_score: float
@@ -31,124 +195,620 @@ class UPSEState(TypedDict):
     threshold_score: float
     plan: str
     needs_improvements: bool
+    eval_mode: str
+    improve_mode: str
+    node_timings: Annotated[List[dict], operator.add]
+    paragraph_results: dict
+    paragraphs_reused: int
+    section_results: List[dict]
+    min_improvement: float
+    patience: int
+    best_score: float
+    best_result: dict
+    stale_iterations: int
+    stop_reason: str
+    llm_calls_saved: float
+    eval_model: str
+    cascade_step: str
+    escalations: int
+    features: dict
+    prescreen_failures: List[str]
+    signature: List[int]
+    similar_essay: dict
+
+
+# Cache counters are exported alongside the node metrics
+metrics.describe('upse_cache_hits', 'gauge', "Evaluation cache hits since start")
+metrics.describe('upse_cache_misses', 'gauge', "Evaluation cache misses since start")
+metrics.describe('upse_cache_entries', 'gauge', "Entries in the evaluation cache")
+metrics.describe('upse_feedback_compressions_total', 'counter', "Prompts whose rubric feedback was compressed to fit the budget")
+metrics.describe('upse_feedback_tokens_saved_total', 'counter', "Estimated prompt tokens removed by feedback compression")
+metrics.describe('upse_edit_scripts_total', 'counter', "Edit-script improvements, by whether they applied or fell back")
+metrics.describe('upse_paragraph_evaluations_total', 'counter',
+                 "Paragraphs scored in incremental mode, by whether the result was reused")
+metrics.describe('upse_section_evaluations_total', 'counter', "Sections scored separately because the essay was too long for one call")
+metrics.describe('upse_prescreen_rejections_total', 'counter', "Essays answered by the local pre-screen without any model call")
+metrics.describe('upse_cascade_escalations_total', 'counter', "Iterations re-scored on the strong model because they were near the threshold")
+metrics.describe('upse_early_stops_total', 'counter', "Improvement loops stopped because scores stopped improving")
+metrics.describe('upse_llm_calls_saved_total', 'counter', "Estimated model calls saved by stopping improvement loops early")
+metrics.describe('upse_best_version_restores_total', 'counter', "Runs that returned an earlier, better-scoring version of the essay")
+metrics.describe('upse_similar_lookups', 'gauge', "Near-duplicate index lookups since start")
+metrics.describe('upse_similar_matches', 'gauge', "Submissions that reused a near-duplicate's evaluation")
+metrics.describe('upse_similar_entries', 'gauge', "Essays in the near-duplicate index")
+metrics.add_collector(lambda: {
+    ('upse_similar_lookups', ()): similar_essays.lookups,
+    ('upse_similar_matches', ()): similar_essays.matches,
+    ('upse_similar_entries', ()): similar_essays.stats()['entries'],
+})
+metrics.add_collector(lambda: {
+    ('upse_cache_hits', ()): cache.hits,
+    ('upse_cache_misses', ()): cache.misses,
+    ('upse_cache_entries', ()): cache.stats()['entries'],
+})
+
+
+def initial_state(essay: str, plan: str = 'free', threshold_score: float = None, max_iterations: int = None,
+                  min_improvement: float = None, patience: int = None) -> UPSEState:
+    """Build a fresh workflow state, using the plan's defaults for any setting not given."""
+    plan_defaults = {
+        'free': (5.0, 0),
+        'basic': (BASIC_THRESHOLD, BASIC_ITERATIONS),
+        'premium': (PREMIUM_THRESHOLD, PREMIUM_ITERATIONS),
+    }
+    default_threshold, default_iterations = plan_defaults[plan]
+    default_min_improvement, default_patience = PLAN_STOPPING[plan]
+    return {
+        'essay': essay.strip(),
+        'language_feedback': "",
+        'clarity_feedback': "",
+        'overall_feedback': "",
+        'analysis_feedback': "",
+        'score_history': [],
+        'improved_essay': "",
+        'max_iterations': default_iterations if max_iterations is None else max_iterations,
+        'avg_score': 0.0,
+        'iteration_count': 0,
+        'plan': plan,
+        'threshold_score': default_threshold if threshold_score is None else threshold_score,
+        'node_timings': [],
+        'paragraph_results': {},
+        'paragraphs_reused': 0,
+        'section_results': [],
+        'min_improvement': default_min_improvement if min_improvement is None else min_improvement,
+        'patience': default_patience if patience is None else patience,
+        'best_score': None,
+        'best_result': {},
+        'stale_iterations': 0,
+        'stop_reason': "",
+        'llm_calls_saved': 0.0,
+        'eval_model': "",
+        'cascade_step': "",
+        'escalations': 0,
+        'features': {},
+        'prescreen_failures': [],
+        'signature': [],
+        'similar_essay': {},
+    }
+
+
+def essay_prefix(essay: str) -> str:
+    """
+    Opening of every prompt about the whole essay. The essay comes first and
+    the per-prompt instructions after it, so providers that cache prompt
+    prefixes can reuse it across the evaluators, follow-ups and rewrite.
+    """
+    return f"Essay under review:\n<essay>\n{essay}\n</essay>\n\n"
+
+
+def budgeted_feedback(state: UPSEState) -> dict:
+    """The three rubric feedbacks, compressed to bullet lists once together they exceed the token budget."""
+    feedbacks = {rubric: state[f'{rubric}_feedback'] for rubric in RUBRICS}
+    fitted = fit_feedback(feedbacks)
+    if fitted != feedbacks:
+        saved = sum(count_tokens(text) for text in feedbacks.values()) - sum(count_tokens(text) for text in fitted.values())
+        metrics.inc('upse_feedback_compressions_total', plan=state.get('plan', 'free'))
+        metrics.inc('upse_feedback_tokens_saved_total', saved, plan=state.get('plan', 'free'))
+    return fitted
 
 
 def parse_json_response(raw_output: str):
     """
-    Extract and parse the first JSON object from the raw model output.
-    Raises ValueError if no valid JSON found.
+    Extract and parse the first JSON object from the raw model output,
+    tolerating surrounding prose, stray quotes and truncation.
+    Raises ValueError if no usable JSON found.
     """
-    match = re.search(r'\{.*\}', raw_output, re.DOTALL)
-    if not match:
-        raise ValueError(f"No JSON object found in model output: {raw_output}")
+    record_parse_attempt()
+    try:
+        data, repairs = extract_json(raw_output)
+    except ValueError:
+        record_parse_failure()
+        raise
+    for repair in repairs:
+        record_parse_repair(repair)
+    return data
+
+
+async def ask_model_reply(prompt: str, tags: List[str] = None):
+    """Send a prompt; returns (reply text, name of the model that answered it)."""
+    # Raises PromptTooLong rather than letting the provider truncate or reject it
+    prompt_tokens = check_prompt(prompt)
+
+    async def admit():
+        # Each call waits its turn under the upstream rate limits, higher plan
+        # tiers first; the wait is not part of the call's timeout or latency
+        await scheduler.acquire(current_plan(), prompt_tokens)
+
+    async def send(model, hedge):
+        call_tags = list(tags or []) + ([HEDGE_TAG] if hedge else [])
+        return await model.ainvoke(prompt, {'tags': call_tags} if call_tags else None)
+
+    # Timeouts, retries with backoff, and (with UPSE_HEDGING) a hedged duplicate past the p95 latency
+    response, model = await call_resilient(
+        send, get_model(_workflow_model.get()), get_model(FALLBACK_MODEL) if FALLBACK_MODEL else None, admit,
+        prompt_tokens,
+    )
+    record_llm_usage(response, model.model_name)
+    scheduler.charge((getattr(response, 'usage_metadata', None) or {}).get('output_tokens', 0))
+    return response.content, model.model_name
+
+
+async def ask_model(prompt: str, tags: List[str] = None) -> str:
+    reply, _ = await ask_model_reply(prompt, tags)
+    return reply
+
+
+async def complete_rubric(result, rubric: str, essay: str) -> dict:
+    """
+    Return {'feedback', 'score'} for one rubric from a (possibly partial) parsed reply.
+    A missing field is filled by a short follow-up asking for that field only,
+    rather than re-running the whole evaluator prompt.
+    """
+    result = result if isinstance(result, dict) else {}
+    feedback = str(result.get('feedback') or "").strip()
+    score = coerce_score(result.get('score'))
+
+    if not feedback:
+        record_parse_repair('follow_up_feedback')
+        feedback = (await ask_model(f"""{essay_prefix(essay)}You are a strict UPSE essay examiner.
+In 3-4 sentences, give feedback on the {RUBRICS[rubric]} of the essay above.
+
+Return ONLY the feedback as plain text.
+""")).strip()
+
+    for _ in range(FOLLOW_UP_ATTEMPTS):
+        if score is not None:
+            break
+        record_parse_repair('follow_up_score')
+        raw_output = await ask_model(f"""An examiner gave this feedback on an essay's {RUBRICS[rubric]}:
+{feedback}
+
+Based only on this feedback, give the score from 0.0 to 10.0.
+Respond ONLY with minified valid JSON:
+{{"score":0.0}}
+""")
+        try:
+            score = coerce_score(parse_json_response(raw_output).get('score'))
+        except (ValueError, AttributeError):
+            score = coerce_score(raw_output)
+    if score is None:
+        raise ValueError(f"Model did not return a {rubric} score after {FOLLOW_UP_ATTEMPTS} follow-ups")
+
+    return {'feedback': feedback, 'score': score}
+
+
+async def parse_rubric_reply(raw_output: str, rubric: str, essay: str) -> dict:
+    try:
+        result = parse_json_response(raw_output)
+    except ValueError:
+        # No JSON at all: keep the prose as feedback and ask for the score
+        result = {'feedback': raw_output.strip()}
+    return await complete_rubric(result, rubric, essay)
 
-    json_str = match.group(0)
 
+async def parse_combined_reply(raw_output: str, text: str) -> dict:
+    """Parse a {rubric: {'feedback', 'score'}} reply; rubrics missing from it are completed one field at a time."""
     try:
-        data = json.loads(json_str)
-        if isinstance(data, str):
-            data = json.loads(data)
-        return data
-    except json.JSONDecodeError as e:
-        raise ValueError(f"Invalid JSON in extracted string: {json_str}\nOriginal output: {raw_output}") from e
+        result = parse_json_response(raw_output)
+    except ValueError:
+        result = {}
+    completed = await asyncio.gather(*(
+        complete_rubric(result.get(rubric), rubric, text) for rubric in RUBRICS
+    ))
+    return dict(zip(RUBRICS, completed))
 
 
-def evaluate_language(state: UPSEState):
-    prompt = f"""You are a strict language quality evaluator.
+async def invoke_cached(kind: str, prompt: str, parse=None):
+    """
+    Invoke the model through the evaluation cache.
+    The key covers the prompt (and so the essay), prompt version, model and
+    temperature. parse, if given, is an async function applied to the reply;
+    only successfully parsed responses from the requested model are stored.
+    """
+    model = get_model(_workflow_model.get())
+    key = cache.make_key(kind, PROMPT_VERSION, model.model_name, model.temperature, prompt)
+    # SQLite work runs on a worker thread so it never stalls the event loop
+    cached = await asyncio.to_thread(cache.get, key)
+    if cached is not None:
+        return json.loads(cached)
+
+    result, answered_by = await ask_model_reply(prompt)
+    if parse is not None:
+        result = await parse(result)
+    # A fallback model's answer must not be served as the requested model's
+    if answered_by == model.model_name:
+        await asyncio.to_thread(cache.set, key, json.dumps(result))
+    return result
+
+
+async def evaluate_language(state: UPSEState):
+    prompt = f"""{essay_prefix(state['essay'])}You are a strict language quality evaluator.
 You have 20+ years experience checking UPSE exam essays.
 Analyze ONLY language quality: grammar, clarity, coherence, tone, vocabulary.
 
-Essay:
-{state['essay']}
-
 Instructions:
 1. Provide detailed feedback on grammar, clarity, flow, tone, vocabulary.
 2. Give one decimal place score (0.0-10.0).
 3. Respond ONLY with minified valid JSON:
 {{"feedback":"...","score":0.0}}
 """
-    raw_output = model.invoke(prompt).content
-    parsed = parse_json_response(raw_output)
+    parsed = await invoke_cached(
+        'evaluate_language', prompt, lambda raw: parse_rubric_reply(raw, 'language', state['essay'])
+    )
     return {
         'language_feedback': parsed['feedback'],
-        'individual_scores': [float(parsed['score'])]
+        'score_history': score_update(state, language=parsed['score'])
     }
 
 
-def evaluate_analysis(state: UPSEState):
-    prompt = f"""You are a strict evaluator of analytical depth for UPSE essays.
+async def evaluate_analysis(state: UPSEState):
+    prompt = f"""{essay_prefix(state['essay'])}You are a strict evaluator of analytical depth for UPSE essays.
 Assess ONLY analytical quality: reasoning, evidence, critical thinking, logical connections.
 
-Essay:
-{state['essay']}
-
 Instructions:
 1. Provide detailed analytical feedback.
 2. Score from 0 to 10 (integer).
 3. Respond ONLY with minified valid JSON:
 {{"feedback":"...","score":0.0}}
 """
-    raw_output = model.invoke(prompt).content
-    parsed = parse_json_response(raw_output)
+    parsed = await invoke_cached(
+        'evaluate_analysis', prompt, lambda raw: parse_rubric_reply(raw, 'analysis', state['essay'])
+    )
     return {
         'analysis_feedback': parsed['feedback'],
-        'individual_scores': [float(parsed['score'])]
+        'score_history': score_update(state, analysis=parsed['score'])
     }
 
 
-def evaluate_COT(state: UPSEState):
-    prompt = f"""You are a strict evaluator of clarity of thought for UPSE essays.
+async def evaluate_COT(state: UPSEState):
+    prompt = f"""{essay_prefix(state['essay'])}You are a strict evaluator of clarity of thought for UPSE essays.
 Assess ONLY logical flow, organization, and ease of understanding.
 
-Essay:
-{state['essay']}
-
 Instructions:
 1. Provide detailed feedback on logical sequencing, transitions, contradictions, readability.
 2. Score 0-10 integer.
 3. Respond ONLY with minified valid JSON:
 {{"feedback":"...","score":0.0}}
 """
-    raw_output = model.invoke(prompt).content
-    parsed = parse_json_response(raw_output)
+    parsed = await invoke_cached(
+        'evaluate_COT', prompt, lambda raw: parse_rubric_reply(raw, 'clarity', state['essay'])
+    )
     return {
         'clarity_feedback': parsed['feedback'],
-        'individual_scores': [float(parsed['score'])]
+        'score_history': score_update(state, clarity=parsed['score'])
+    }
+
+
+async def evaluate_combined(state: UPSEState):
+    prompt = f"""{essay_prefix(state['essay'])}You are a strict UPSE essay examiner with 20+ years experience.
+Evaluate the essay above on three separate rubrics:
+- language: grammar, clarity, flow, tone, vocabulary (score 0.0-10.0, one decimal)
+- analysis: reasoning, evidence, critical thinking, logical connections (score 0-10)
+- clarity: logical sequencing, transitions, contradictions, readability (score 0-10)
+
+Instructions:
+1. Give detailed feedback for each rubric, judging each one independently.
+2. Respond ONLY with minified valid JSON:
+{{"language":{{"feedback":"...","score":0.0}},"analysis":{{"feedback":"...","score":0.0}},"clarity":{{"feedback":"...","score":0.0}}}}
+"""
+    parsed = await invoke_cached(
+        'evaluate_combined', prompt, lambda raw: parse_combined_reply(raw, state['essay'])
+    )
+    return {
+        'language_feedback': parsed['language']['feedback'],
+        'analysis_feedback': parsed['analysis']['feedback'],
+        'clarity_feedback': parsed['clarity']['feedback'],
+        'score_history': score_update(state, **{rubric: parsed[rubric]['score'] for rubric in RUBRICS})
+    }
+
+
+def split_paragraphs(essay: str) -> List[str]:
+    return [paragraph.strip() for paragraph in re.split(r'\n\s*\n', essay) if paragraph.strip()]
+
+
+async def evaluate_paragraph(paragraph: str) -> dict:
+    prompt = f"""You are a strict UPSE essay examiner with 20+ years experience.
+Below is one paragraph of an essay. Evaluate it on three separate rubrics:
+- language: grammar, clarity, flow, tone, vocabulary (score 0.0-10.0, one decimal)
+- analysis: reasoning, evidence, critical thinking, logical connections (score 0-10)
+- clarity: logical sequencing, transitions, contradictions, readability (score 0-10)
+
+Paragraph:
+{paragraph}
+
+Instructions:
+1. Give brief feedback for each rubric, naming this paragraph's specific mistakes.
+2. Respond ONLY with minified valid JSON:
+{{"language":{{"feedback":"...","score":0.0}},"analysis":{{"feedback":"...","score":0.0}},"clarity":{{"feedback":"...","score":0.0}}}}
+"""
+    return await invoke_cached('evaluate_paragraph', prompt, lambda raw: parse_combined_reply(raw, paragraph))
+
+
+async def evaluate_paragraphs(state: UPSEState):
+    """
+    Score every paragraph, reusing the results of paragraphs whose text is
+    unchanged since an earlier iteration. Results are keyed by content hash
+    and model, so a cascade re-score never reuses the cheap model's results
+    and the next cheap iteration never reuses the strong model's.
+    """
+    previous = state.get('paragraph_results') or {}
+    paragraphs = split_paragraphs(state['essay'])
+    model_name = get_model(_workflow_model.get()).model_name
+    keys = [cache.make_key('paragraph', PROMPT_VERSION, model_name, paragraph) for paragraph in paragraphs]
+
+    pending = {key: paragraph for key, paragraph in zip(keys, paragraphs) if key not in previous}
+    evaluated = await asyncio.gather(*(evaluate_paragraph(paragraph) for paragraph in pending.values()))
+    fresh = dict(zip(pending, evaluated))
+
+    reused = len(set(keys)) - len(pending)
+    metrics.inc('upse_paragraph_evaluations_total', reused, source='reused', plan=state.get('plan', 'free'))
+    metrics.inc('upse_paragraph_evaluations_total', len(pending), source='model', plan=state.get('plan', 'free'))
+
+    # Only the current paragraphs are kept, in essay order; a paragraph that
+    # appears twice is stored once with the words of both copies
+    results = {}
+    for key, paragraph in zip(keys, paragraphs):
+        if key not in results:
+            result = previous[key] if key in previous else fresh[key]
+            results[key] = dict(result, words=0)
+        results[key]['words'] += len(paragraph.split())
+    return {'paragraph_results': results, 'paragraphs_reused': reused}
+
+
+def merge_parts(state: UPSEState, results: List[dict], label: str) -> dict:
+    """Essay-level rubric scores and feedback from per-part results: scores weighted by words, feedback listed per part."""
+    total_words = sum(result['words'] for result in results) or 1
+
+    scores, feedbacks = {}, {}
+    for rubric in RUBRICS:
+        scores[rubric] = sum(result[rubric]['score'] * result['words'] for result in results) / total_words
+        feedbacks[rubric] = "\n".join(
+            f"{label} {number}: {result[rubric]['feedback']}" for number, result in enumerate(results, start=1)
+        )
+    return {
+        'language_feedback': feedbacks['language'],
+        'analysis_feedback': feedbacks['analysis'],
+        'clarity_feedback': feedbacks['clarity'],
+        'score_history': score_update(state, **scores),
+    }
+
+
+def aggregate_paragraphs(state: UPSEState):
+    """Essay-level rubric scores: paragraph scores weighted by paragraph length, feedback listed per paragraph."""
+    return merge_parts(state, list(state['paragraph_results'].values()), "Paragraph")
+
+
+async def evaluate_section(section: str, number: int, total: int, opening: str) -> dict:
+    prompt = f"""Opening of the essay under review:
+<opening>
+{opening}
+</opening>
+
+You are a strict UPSE essay examiner with 20+ years experience.
+Below is section {number} of {total} of that essay. Evaluate this section, as part of the whole essay, on three separate rubrics:
+- language: grammar, clarity, flow, tone, vocabulary (score 0.0-10.0, one decimal)
+- analysis: reasoning, evidence, critical thinking, logical connections (score 0-10)
+- clarity: logical sequencing, transitions, contradictions, readability (score 0-10)
+
+Section {number} of {total}:
+<section>
+{section}
+</section>
+
+Instructions:
+1. Give feedback for each rubric, naming this section's specific mistakes.
+2. Respond ONLY with minified valid JSON:
+{{"language":{{"feedback":"...","score":0.0}},"analysis":{{"feedback":"...","score":0.0}},"clarity":{{"feedback":"...","score":0.0}}}}
+"""
+    return await invoke_cached('evaluate_section', prompt, lambda raw: parse_combined_reply(raw, section))
+
+
+async def evaluate_sections(state: UPSEState):
+    """
+    Map-reduce evaluation of a long essay: every section is scored in
+    parallel, each with the essay's opening as context, and the section
+    results are merged into essay-level scores and feedback.
+    """
+    sections = split_sections(state['essay'])
+    opening = " ".join(state['essay'].split()[:SECTION_CONTEXT_WORDS])
+    evaluated = await asyncio.gather(*(
+        evaluate_section(section, number, len(sections), opening)
+        for number, section in enumerate(sections, start=1)
+    ))
+    metrics.inc('upse_section_evaluations_total', len(sections), plan=state.get('plan', 'free'))
+
+    results = [dict(result, words=len(section.split())) for section, result in zip(sections, evaluated)]
+    return {'section_results': results, **merge_parts(state, results, "Section")}
+
+
+def eval_mode(state, mode: str = None) -> str:
+    """
+    How this run evaluates its essay: mode (a workflow's fixed mode), else
+    the state's or plan's mode, switched to 'chunked' for a long essay.
+    """
+    mode = mode or state.get('eval_mode') or PLAN_EVAL_MODES.get(state.get('plan', 'free'), 'separate')
+    if mode in WHOLE_ESSAY_MODES and count_tokens(state['essay']) > CHUNK_THRESHOLD_TOKENS:
+        return 'chunked'
+    return mode
+
+
+def similar_kind(state, model_name: str) -> str:
+    # Evaluations are only reused under the same prompts, evaluation mode and scoring model
+    return f"{PROMPT_VERSION}:{eval_mode(state)}:{model_name}"
+
+
+def find_similar(state, signature: list):
+    """
+    (stored evaluation, similarity) of a near-duplicate this run may reuse,
+    or None. Only scores from a model the run itself could have ended on are
+    reused: under the cascade a strong-model evaluation always qualifies, and
+    a cheap-model one only if it is far enough from the threshold that the
+    run would not have escalated it.
+    """
+    bound_model = _workflow_model.get()
+    if bound_model or not can_escalate(state):
+        models = [bound_model or CHEAP_MODEL]
+    else:
+        models = [STRONG_MODEL, CHEAP_MODEL]
+    for model in models:
+        match = similar_essays.lookup(signature, similar_kind(state, model))
+        if match is None:
+            continue
+        stored, score = match
+        stored = json.loads(stored)
+        if model != STRONG_MODEL and len(models) > 1:
+            avg_score = sum(stored[rubric]['score'] for rubric in RUBRICS) / len(RUBRICS)
+            if near_threshold(state, avg_score):
+                continue
+        return stored, score
+    return None
+
+
+async def prescreen(state: UPSEState):
+    """
+    Measure the essay locally and stop before any model call if it fails a
+    hard gate (empty, far too short, mostly duplicated). Features already in
+    the state (batch runs measure all essays at once) are reused.
+
+    An essay that passes is looked up in the near-duplicate index; if an
+    earlier submission is similar enough, its rubric feedback and scores
+    are reused and the evaluators are skipped.
+    """
+    features = state.get('features') or extract_features([state['essay']])[0]
+    failures = gate_failures(features)
+    if not failures:
+        signature = minhash(state['essay'])
+        update = {'features': features, 'prescreen_failures': [], 'signature': signature}
+        match = await asyncio.to_thread(find_similar, state, signature)
+        if match is None:
+            return update
+        stored, score = match
+        update.update({
+            'language_feedback': stored['language']['feedback'],
+            'analysis_feedback': stored['analysis']['feedback'],
+            'clarity_feedback': stored['clarity']['feedback'],
+            'score_history': score_update(state, **{rubric: stored[rubric]['score'] for rubric in RUBRICS}),
+            'similar_essay': {'similarity': score},
+        })
+        return update
+    metrics.inc('upse_prescreen_rejections_total', plan=state.get('plan', 'free'))
+    return {
+        'features': features,
+        'prescreen_failures': failures,
+        'overall_feedback': " ".join(failures),
+        'avg_score': 0.0,
+        'needs_improvements': False,
+        'stop_reason': 'prescreen',
+    }
+
+
+def plan_threshold(plan: str) -> float:
+    if plan == 'premium':
+        return PREMIUM_THRESHOLD
+    elif plan == 'basic':
+        return BASIC_THRESHOLD
+    return float('inf')
+
+
+def run_threshold(state) -> float:
+    """The run's quality threshold: the one set in the state, else the plan's."""
+    threshold = state.get('threshold_score')
+    return plan_threshold(state.get('plan', 'free')) if threshold is None else threshold
+
+
+def can_escalate(state) -> bool:
+    """Whether the cascade may still re-score this iteration on the strong model."""
+    return not state.get('eval_model') and CHEAP_MODEL != STRONG_MODEL and state.get('plan', 'free') != 'free'
+
+
+def near_threshold(state, avg_score: float) -> bool:
+    """Whether avg_score is close enough to the run's threshold for the cascade to re-score it."""
+    return abs(avg_score - run_threshold(state)) <= CASCADE_MARGIN
+
+
+def cascade_check(state: UPSEState):
+    """
+    Escalate this iteration to the strong model when the cheap model's
+    average is within CASCADE_MARGIN of the run's threshold; essays clearly
+    above or below it keep the cheap scores. Free runs never improve, so
+    their result does not hinge on the threshold and they never escalate.
+    """
+    if not can_escalate(state):
+        return {'cascade_step': 'accept'}
+    scores = current_scores(state)
+    avg_score = sum(scores) / len(scores) if scores else 0.0
+    if not near_threshold(state, avg_score):
+        return {'cascade_step': 'accept'}
+    metrics.inc('upse_cascade_escalations_total', plan=state.get('plan', 'free'))
+    return {'cascade_step': 'escalate', 'eval_model': STRONG_MODEL, 'escalations': state.get('escalations', 0) + 1}
+
+
+def remember_evaluation(state: UPSEState):
+    """Add the submitted essay's evaluation to the near-duplicate index, unless it was itself reused."""
+    history = state.get('score_history') or []
+    if state.get('iteration_count', 0) or state.get('similar_essay') or not state.get('signature') or not history:
+        return
+    if any(score is None for score in history[0]):
+        return
+    stored = {
+        rubric: {'feedback': state[f'{rubric}_feedback'], 'score': history[0][RUBRIC_INDEX[rubric]]}
+        for rubric in RUBRICS
     }
+    model_name = _workflow_model.get() or evaluator_model(state)
+    similar_essays.add(state['signature'], similar_kind(state, model_name), json.dumps(stored))
 
 
-def final_evaluation(state: UPSEState):
-    scores = state.get('individual_scores', [])
+async def final_evaluation(state: UPSEState):
+    # Only this iteration's scores; earlier iterations stay in score_history
+    scores = current_scores(state)
     avg_score = sum(scores) / len(scores) if scores else 0.0
+    feedback = budgeted_feedback(state)
 
     prompt = f"""You are a summarization expert.
 Based on the feedback below, produce a concise, integrated summary emphasizing major mistakes without sugarcoating.
 
 Language feedback:
-{state['language_feedback']}
+{feedback['language']}
 
 Analysis feedback:
-{state['analysis_feedback']}
+{feedback['analysis']}
 
 Clarity feedback:
-{state['clarity_feedback']}
+{feedback['clarity']}
 
 Instructions:
 1. Merge overlapping points, focus on mistakes.
-2. Mention if essay is too short to develop ideas.
-3. Keep summary 2-3 sentences.
-4. Return ONLY plain text, no JSON or commentary.
+2. Keep summary 2-3 sentences.
+3. Return ONLY plain text, no JSON or commentary.
 """
-    overall_feedback = model.invoke(prompt).content
+    overall_feedback = await invoke_cached('final_evaluation', prompt)
+    await asyncio.to_thread(remember_evaluation, state)
+    # Length is measured locally by prescreen rather than left to the model
+    note = length_note(state.get('features') or extract_features([state['essay']])[0])
+    if note:
+        overall_feedback = f"{overall_feedback.strip()} {note}"
 
     plan = state.get('plan', 'free')
-    if plan == 'premium':
-        threshold = PREMIUM_THRESHOLD
-    elif plan == 'basic':
-        threshold = BASIC_THRESHOLD
-    else:
-        threshold = float('inf')
-
+    threshold = run_threshold(state)
     needs_improvements = (avg_score < threshold) and (plan in ('basic', 'premium'))
 
     return {
@@ -159,34 +819,100 @@ Instructions:
     }
 
 
+# Fields of the best-scoring iteration that are handed back when a run stops
+BEST_RESULT_FIELDS = ('essay', 'avg_score', 'language_feedback', 'analysis_feedback',
+                      'clarity_feedback', 'overall_feedback')
+
+
+def stop_reason(state: UPSEState) -> str:
+    """Why the improvement loop should stop now, or "" to keep improving."""
+    if state['avg_score'] >= state['threshold_score']:
+        return 'threshold'
+    if state['iteration_count'] >= state['max_iterations']:
+        return 'max_iterations'
+    if state.get('stale_iterations', 0) >= state.get('patience', 1):
+        return 'plateau'
+    return ""
+
+
+def calls_per_iteration(state: UPSEState) -> float:
+    """Average model calls an improvement iteration (rewrite plus re-evaluation) has cost in this run."""
+    timings = state.get('node_timings') or []
+    iterations = state.get('iteration_count', 0)
+    if iterations:
+        return sum(record['llm_calls'] for record in timings
+                   if record['node'] == 'improve_essay' or record['iteration'] >= 1) / iterations
+    # No iteration yet: one rewrite plus the calls of the first evaluation
+    return 1 + sum(record['llm_calls'] for record in timings)
+
+
 def check_quality(state: UPSEState):
-    print(f"Quality Check: Score = {state.get('avg_score', 0):.2f}, Iteration = {state.get('iteration_count', 0)}")
-    return {}
+    """
+    Keep the best-scoring version of the essay and, when the loop is about
+    to stop, hand that version back instead of the latest one.
+    """
+    score = state.get('avg_score', 0)
+    print(f"Quality Check: Score = {score:.2f}, Iteration = {state.get('iteration_count', 0)}")
+
+    best_score = state.get('best_score')
+    update = {}
+    if best_score is None or score > best_score:
+        update['best_score'] = score
+        update['best_result'] = {field: state.get(field) for field in BEST_RESULT_FIELDS}
+    if best_score is None or score >= best_score + state.get('min_improvement', 0.0):
+        update['stale_iterations'] = 0
+    else:
+        update['stale_iterations'] = state.get('stale_iterations', 0) + 1
+
+    reason = stop_reason({**state, **update})
+    update['stop_reason'] = reason
+    if not reason:
+        return update
+
+    best = update.get('best_result') or state.get('best_result') or {}
+    if best and best['avg_score'] > score:
+        metrics.inc('upse_best_version_restores_total', plan=state.get('plan', 'free'))
+        update.update(best)
+    if reason == 'plateau':
+        remaining = state['max_iterations'] - state['iteration_count']
+        saved = remaining * calls_per_iteration(state)
+        plan = state.get('plan', 'free')
+        metrics.inc('upse_early_stops_total', plan=plan)
+        metrics.inc('upse_llm_calls_saved_total', saved, plan=plan)
+        update['llm_calls_saved'] = state.get('llm_calls_saved', 0.0) + saved
+    return update
 
 
 def should_continue(state: UPSEState) -> str:
-    if state['avg_score'] >= state['threshold_score']:
+    reason = stop_reason(state)
+    if reason == 'threshold':
         print(f"✅ Quality threshold met! Average score: {state['avg_score']:.2f}")
         return "end"
-    elif state['iteration_count'] >= state['max_iterations']:
+    elif reason == 'max_iterations':
         print(f"Max iterations reached ({state['max_iterations']}). Current score: {state['avg_score']:.2f}")
         return "end"
+    elif reason == 'plateau':
+        print(f"Scores stopped improving after {state['stale_iterations']} iteration(s). "
+              f"Best score: {state['avg_score']:.2f}, {state.get('llm_calls_saved', 0):.0f} model calls saved")
+        return "end"
     else:
         print(f"🔄 Continuing improvement. Current score: {state['avg_score']:.2f}, Iteration: {state['iteration_count']}")
         return "improve_essay"
 
 
-def improve_essay(state: UPSEState):
-    prompt = f"""You are an expert UPSC essay writer with mastery in formal, persuasive, and logically coherent writing.
+def route_evaluation(state: UPSEState, mode: str = None) -> List[str]:
+    return MODE_EVALUATORS[eval_mode(state, mode)]
+
 
-Rewrite this essay improving clarity, language, and analysis, guided by feedback:
+async def rewrite_essay(state: UPSEState) -> str:
+    feedback = budgeted_feedback(state)
+    prompt = f"""{essay_prefix(state['essay'])}You are an expert UPSC essay writer with mastery in formal, persuasive, and logically coherent writing.
 
-Clarity: {state['clarity_feedback']}
-Language: {state['language_feedback']}
-Analysis: {state['analysis_feedback']}
+Rewrite the essay above improving clarity, language, and analysis, guided by feedback:
 
-Original essay:
-{state['essay']}
+Clarity: {feedback['clarity']}
+Language: {feedback['language']}
+Analysis: {feedback['analysis']}
 
 Guidelines:
 - Keep original theme and ideas.
@@ -197,11 +923,57 @@ Guidelines:
 
 Return ONLY the improved essay as plain text.
 """
-    improved = model.invoke(prompt).content
+    return await ask_model(prompt)
+
+
+async def edit_essay(state: UPSEState):
+    """Improve the essay with an edit script; None if the script could not be applied."""
+    feedback = budgeted_feedback(state)
+    prompt = f"""Essay under review, each sentence prefixed with its id (paragraphs are p1, p2, ...):
+<essay>
+{number_sentences(state['essay'])}
+</essay>
+
+You are an expert UPSC essay editor with mastery in formal, persuasive, and logically coherent writing.
+
+Improve the essay's clarity, language, and analysis, guided by feedback, by editing only the sentences that need it:
+
+Clarity: {feedback['clarity']}
+Language: {feedback['language']}
+Analysis: {feedback['analysis']}
+
+Instructions:
+1. "replace" and "delete" take a sentence id (p2.s3) or a paragraph id (p4).
+2. "insert" adds a sentence after a sentence id, or a new paragraph after a paragraph id (p0 is the start).
+3. Ids refer to the essay above; keep the original theme and ideas, and deepen analysis with examples.
+4. Respond ONLY with minified valid JSON:
+{{"edits":[{{"op":"replace","id":"p1.s2","text":"..."}},{{"op":"insert","after":"p2","text":"..."}},{{"op":"delete","id":"p3.s1"}}]}}
+"""
+    raw_output = await ask_model(prompt, tags=[EDIT_SCRIPT_TAG])
+    plan = state.get('plan', 'free')
+    try:
+        script = parse_json_response(raw_output)
+        edited = apply_edits(state['essay'], script.get('edits') if isinstance(script, dict) else script)
+    except ValueError:
+        # Unparsable, or does not fit the essay: improve_essay rewrites it instead
+        metrics.inc('upse_edit_scripts_total', outcome='fallback', plan=plan)
+        return None
+    metrics.inc('upse_edit_scripts_total', outcome='applied', plan=plan)
+    return edited
+
+
+async def improve_essay(state: UPSEState):
+    mode = state.get('improve_mode') or PLAN_IMPROVE_MODES.get(state.get('plan', 'free'), 'rewrite')
+    improved = await edit_essay(state) if mode == 'edits' else None
+    if improved is None:
+        improved = await rewrite_essay(state)
     return {
         "essay": improved,
         "iteration_count": state.get("iteration_count", 0) + 1,
-        "individual_scores": [],
+        "features": extract_features([improved])[0],
+        "section_results": [],
+        # The next iteration is scored on the cheap model again
+        "eval_model": "",
         "language_feedback": "",
         "clarity_feedback": "",
         "analysis_feedback": "",
@@ -209,31 +981,317 @@ Return ONLY the improved essay as plain text.
     }
 
 
-# Build the workflow graph
-graph = StateGraph(UPSEState)
-
-graph.add_node('evaluate_COT', evaluate_COT)
-graph.add_node('evaluate_analysis', evaluate_analysis)
-graph.add_node('evaluate_language', evaluate_language)
-graph.add_node('final_evaluation', final_evaluation)
-graph.add_node('check_quality', check_quality)
-graph.add_node('improve_essay', improve_essay)
-
-graph.add_edge(START, 'evaluate_COT')
-graph.add_edge('evaluate_COT', 'evaluate_analysis')
-graph.add_edge('evaluate_analysis', 'evaluate_language')
-graph.add_edge('evaluate_language', 'final_evaluation')
-graph.add_edge('final_evaluation', 'check_quality')
-
-graph.add_conditional_edges(
-    'check_quality',
-    should_continue,
-    {
-        "end": END,
-        "improve_essay": "improve_essay"
-    }
-)
+EVALUATORS = ['evaluate_COT', 'evaluate_analysis', 'evaluate_language']
+
+
+EVALUATOR_NODES = {
+    'evaluate_COT': evaluate_COT,
+    'evaluate_analysis': evaluate_analysis,
+    'evaluate_language': evaluate_language,
+    'evaluate_combined': evaluate_combined,
+    'evaluate_paragraphs': evaluate_paragraphs,
+    'evaluate_sections': evaluate_sections,
+}
+
+# Evaluators each evaluation mode runs
+MODE_EVALUATORS = {
+    'separate': EVALUATORS,
+    'combined': ['evaluate_combined'],
+    'incremental': ['evaluate_paragraphs'],
+    'chunked': ['evaluate_sections'],
+}
+
+
+def graph_evaluators(mode: str = None) -> List[str]:
+    """Evaluator nodes of a workflow built for mode (None: every mode, picked per run)."""
+    if mode is None:
+        return [name for evaluators in MODE_EVALUATORS.values() for name in evaluators]
+    if mode in WHOLE_ESSAY_MODES:
+        # Long essays switch to chunked evaluation
+        return MODE_EVALUATORS[mode] + MODE_EVALUATORS['chunked']
+    return MODE_EVALUATORS[mode]
+
+
+metrics.describe('upse_workflow_compile_seconds', 'histogram', "Time to build and compile a workflow")
 
-graph.add_edge('improve_essay', 'evaluate_COT')
 
-workflow = graph.compile()
+def with_model(node, model_name):
+    """
+    Make every model call inside an async node use model_name, or the model
+    model_name(state) picks for the run when it is a function.
+    """
+    @functools.wraps(node)
+    async def wrapper(state):
+        token = _workflow_model.set(model_name(state) if callable(model_name) else model_name)
+        try:
+            return await node(state)
+        finally:
+            _workflow_model.reset(token)
+    return wrapper
+
+
+def evaluator_model(state) -> str:
+    return state.get('eval_model') or CHEAP_MODEL
+
+
+def rewrite_model(state) -> str:
+    return PLAN_REWRITE_MODELS.get(state.get('plan', 'free'), CHEAP_MODEL)
+
+
+def build_graph(mode: str = None, model_name: str = None):
+    """
+    Build the workflow graph. mode fixes the evaluation mode ('separate',
+    'combined', 'incremental' or 'chunked'); None picks it per run from the
+    state's plan. Either way a long essay in a whole-essay mode is evaluated
+    in chunked mode. langgraph is imported here rather than at module import so the UI can render first.
+    model_name binds every node to one model; without it evaluators use the
+    cheap/strong cascade and the rewrite uses the plan's model.
+    """
+    from langgraph.graph import StateGraph, START, END
+
+    def add_node(name, node, cascade_model=None):
+        if inspect.iscoroutinefunction(node):
+            if model_name is not None:
+                node = with_model(node, model_name)
+            elif cascade_model is not None:
+                node = with_model(node, cascade_model)
+        graph.add_node(name, instrument_node(name, node))
+
+    def route_evaluators(state):
+        return route_evaluation(state, mode)
+
+    def route_prescreen(state):
+        if state.get('prescreen_failures'):
+            return [END]
+        if state.get('similar_essay'):
+            return ['final_evaluation']
+        return route_evaluators(state)
+
+    def route_cascade(state):
+        if state.get('cascade_step') == 'escalate':
+            return route_evaluators(state)
+        return ['final_evaluation']
+
+    evaluators = graph_evaluators(mode)
+    graph = StateGraph(UPSEState)
+    for name in evaluators:
+        add_node(name, EVALUATOR_NODES[name], evaluator_model)
+    add_node('prescreen', prescreen)
+    add_node('final_evaluation', final_evaluation)
+    add_node('check_quality', check_quality)
+    add_node('improve_essay', improve_essay, rewrite_model)
+    join = 'final_evaluation' if model_name is not None else 'cascade_check'
+    if join == 'cascade_check':
+        add_node('cascade_check', cascade_check)
+
+    # Every essay is pre-screened locally first; junk ends the run right there.
+    # The three evaluators are independent, so fan out to all of them at once
+    # and join at final_evaluation once every one of them has reported.
+    # In combined mode a single evaluator covers all three rubrics instead, and
+    # in incremental mode the paragraph scores are aggregated before the join.
+    # Chunked mode scores the sections of a long essay in parallel inside one
+    # node and merges them before the join.
+    # Unless the workflow is bound to one model, the join goes through the
+    # cascade check, which can send the iteration back to be re-scored.
+    graph.add_edge(START, 'prescreen')
+    graph.add_conditional_edges('prescreen', route_prescreen, evaluators + ['final_evaluation', END])
+    graph.add_conditional_edges('improve_essay', route_evaluators, evaluators)
+    if 'evaluate_language' in evaluators:
+        graph.add_edge(EVALUATORS, join)
+    if 'evaluate_combined' in evaluators:
+        graph.add_edge('evaluate_combined', join)
+    if 'evaluate_sections' in evaluators:
+        graph.add_edge('evaluate_sections', join)
+    if 'evaluate_paragraphs' in evaluators:
+        add_node('aggregate_paragraphs', aggregate_paragraphs)
+        graph.add_edge('evaluate_paragraphs', 'aggregate_paragraphs')
+        graph.add_edge('aggregate_paragraphs', join)
+    if join == 'cascade_check':
+        graph.add_conditional_edges('cascade_check', route_cascade, evaluators + ['final_evaluation'])
+    graph.add_edge('final_evaluation', 'check_quality')
+
+    graph.add_conditional_edges(
+        'check_quality',
+        should_continue,
+        {
+            "end": END,
+            "improve_essay": "improve_essay"
+        }
+    )
+    return graph
+
+
+# Checkpointed runs kept for resuming; the least recently written are forgotten first
+MAX_CHECKPOINT_THREADS = int(os.getenv("UPSE_CHECKPOINT_THREADS", "100"))
+
+_checkpointer = None
+
+
+def _bounded_saver(max_threads: int):
+    from langgraph.checkpoint.memory import InMemorySaver
+
+    class BoundedSaver(InMemorySaver):
+        """InMemorySaver that deletes the least recently written threads past max_threads."""
+
+        def __init__(self):
+            super().__init__()
+            self._threads = OrderedDict()
+            self._threads_lock = threading.Lock()
+
+        def put(self, config, checkpoint, metadata, new_versions):
+            thread_id = config['configurable']['thread_id']
+            with self._threads_lock:
+                self._threads[thread_id] = None
+                self._threads.move_to_end(thread_id)
+                stale = list(self._threads)[:max(0, len(self._threads) - max_threads)]
+                for old in stale:
+                    del self._threads[old]
+            for old in stale:
+                self.delete_thread(old)
+            return super().put(config, checkpoint, metadata, new_versions)
+
+        def delete_thread(self, thread_id):
+            with self._threads_lock:
+                self._threads.pop(thread_id, None)
+            super().delete_thread(thread_id)
+
+    return BoundedSaver()
+
+
+def get_checkpointer():
+    """
+    Every checkpointed run is saved under its thread id so a finished run can
+    be resumed at improve_essay without repeating the evaluation. All
+    checkpointed workflows share one saver, so any of them can resume a thread.
+    Only the MAX_CHECKPOINT_THREADS most recent runs are kept.
+    """
+    global _checkpointer
+    if _checkpointer is None:
+        _checkpointer = _bounded_saver(MAX_CHECKPOINT_THREADS)
+    return _checkpointer
+
+
+def forget_run(thread_id: str):
+    """Drop a checkpointed run once it can no longer be resumed."""
+    if _checkpointer is not None:
+        _checkpointer.delete_thread(thread_id)
+
+
+@functools.lru_cache(maxsize=None)
+def _compiled_workflow(mode: str, model_name: str, checkpointed: bool):
+    start = time.perf_counter()
+    graph = build_graph(mode, model_name)
+    compiled = graph.compile(checkpointer=get_checkpointer() if checkpointed else None)
+    metrics.observe('upse_workflow_compile_seconds', time.perf_counter() - start, mode=mode or 'plan')
+    return compiled
+
+
+def get_workflow(plan: str = None, model_name: str = None, mode: str = None, checkpointed: bool = True):
+    """
+    Compiled workflow for a plan tier, model and evaluation mode, built on
+    first use and reused afterwards. With neither plan nor mode the workflow
+    picks the mode per run from the state's plan.
+    """
+    if mode is None and plan is not None:
+        mode = PLAN_EVAL_MODES[plan]
+    return _compiled_workflow(mode, model_name, checkpointed)
+
+
+async def warm_up(plan: str = None):
+    """Build the model client and compile the workflow ahead of the first request."""
+    get_model()
+    return get_workflow(plan)
+
+
+def __getattr__(name):
+    # Module-level graph/workflow/checkpointer are kept for existing callers,
+    # now built on first access
+    if name == 'graph':
+        return build_graph()
+    if name == 'workflow':
+        return get_workflow()
+    if name == 'checkpointer':
+        return get_checkpointer()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def thread_config(thread_id: str) -> dict:
+    return {'configurable': {'thread_id': thread_id}}
+
+
+def recursion_limit(max_iterations: int) -> int:
+    """LangGraph supersteps a run of max_iterations improvements may take: prescreen, then every iteration."""
+    return 1 + STEPS_PER_ITERATION * (max_iterations + 1)
+
+
+def run_config(state, config: dict = None) -> dict:
+    """config with a recursion limit sized for the run's max_iterations (LangGraph's default is 25)."""
+    config = dict(config or {})
+    config.setdefault('recursion_limit', recursion_limit(state.get('max_iterations', 0)))
+    return config
+
+
+async def prepare_improvement(config: dict, workflow=None):
+    """
+    Set up a finished run for one more improvement iteration.
+    Raises the iteration cap by one and clears a plateau stop as if
+    check_quality had just run, so should_continue routes straight to
+    improve_essay when the run resumes.
+    """
+    workflow = workflow or get_workflow()
+    snapshot = await workflow.aget_state(config)
+    if not snapshot.values:
+        raise ValueError(f"No checkpointed run for thread {config['configurable']['thread_id']}")
+
+    await workflow.aupdate_state(
+        config,
+        {'max_iterations': snapshot.values['iteration_count'] + 1, 'stale_iterations': 0, 'stop_reason': ""},
+        as_node='check_quality',
+    )
+
+
+async def continue_improvement(config: dict, workflow=None):
+    workflow = workflow or get_workflow()
+    await prepare_improvement(config, workflow)
+    # A resumed run does one more iteration
+    return await workflow.ainvoke(None, run_config({'max_iterations': 1}, config))
+
+
+async def astream_progress(state, config: dict = None, workflow=None):
+    """
+    Run the workflow and yield (kind, node, payload) progress events:
+      ('node', name, update)  - a node finished with this state update
+      ('token', name, text)   - a streamed token from final_evaluation or improve_essay
+      ('done', None, output)  - the final state
+    Pass state=None to resume a checkpointed run. workflow defaults to get_workflow().
+    """
+    workflow = workflow or get_workflow()
+    # A resumed run (state None) does one more iteration
+    config = run_config(state or {'max_iterations': 1}, config)
+    output = state
+    async for mode, chunk in workflow.astream(state, config, stream_mode=['updates', 'messages', 'values']):
+        if mode == 'updates':
+            for node, update in chunk.items():
+                yield ('node', node, update or {})
+        elif mode == 'messages':
+            message, metadata = chunk
+            node = metadata.get('langgraph_node')
+            tags = metadata.get('tags', ())
+            if node in STREAMED_NODES and message.content and EDIT_SCRIPT_TAG not in tags and HEDGE_TAG not in tags:
+                yield ('token', node, message.content)
+        else:
+            output = chunk
+    yield ('done', None, output)
+
+
+def stream_progress(state, config: dict = None, workflow=None):
+    """Synchronous wrapper around astream_progress for the Streamlit script thread."""
+    events = astream_progress(state, config, workflow)
+    try:
+        while True:
+            try:
+                yield run_async(events.__anext__())
+            except StopAsyncIteration:
+                return
+    finally:
+        run_async(events.aclose())
@@ -1,8 +1,32 @@
+import uuid
 import streamlit as st
-from Backend import workflow, UPSEState
+from Backend import forget_run, initial_state, score_trajectory, thread_config, prepare_improvement, warm_up
+from model_setup import run_async, run_in_background
+from eval_cache import cache
+from instrumentation import start_metrics_server, summarize_timings, parse_stats
+from jobs import runner, JobNotFound
+from scheduler import scheduler
+from similar_index import similar_essays
 
 st.set_page_config(page_title="UPSC Essay Evaluator & Improver", layout="wide")
 
+
+@st.cache_resource
+def metrics_server():
+    # Serves Prometheus metrics once per process when UPSE_METRICS_PORT is set
+    return start_metrics_server()
+
+
+@st.cache_resource
+def warm_start():
+    # Build the pooled model client and compile the workflow once per process,
+    # in the background so the page renders without waiting for langgraph
+    return run_in_background(warm_up())
+
+
+metrics_server()
+warm_start()
+
 st.title("🖋️ UPSC Essay Evaluator & Improver")
 
 st.markdown("""
@@ -38,6 +62,122 @@ max_iterations = st.sidebar.number_input(
     help="Set to 0 for no improvement (only evaluation)."
 )
 
+with st.sidebar.expander("🗄️ Evaluation Cache"):
+    cache_stats = cache.stats()
+    st.write(f"Hits: {cache_stats['hits']} · Misses: {cache_stats['misses']} · Hit rate: {cache_stats['hit_rate']:.0%}")
+    st.write(f"Entries: {cache_stats['entries']} / {cache_stats['max_entries']} · Evicted: {cache_stats['evictions']}")
+    similar_stats = similar_essays.stats()
+    st.write(f"Near-duplicates reused: {similar_stats['matches']} of {similar_stats['lookups']} · "
+             f"Indexed essays: {similar_stats['entries']}")
+
+with st.sidebar.expander("🧩 Model Reply Parsing"):
+    parsing = parse_stats()
+    st.write(f"Replies parsed: {parsing['attempts']:.0f} · Success rate: {parsing['success_rate']:.1%}")
+    st.write(f"Repairs: {', '.join(f'{kind} {count:.0f}' for kind, count in parsing['repairs'].items()) or 'none'}")
+
+with st.sidebar.expander("⏳ Job Queue"):
+    job_stats = runner.stats()
+    st.write(f"Running: {job_stats['running']} / {job_stats['max_in_flight']} · Queued: {job_stats['queued']}")
+
+with st.sidebar.expander("🚦 Upstream Scheduler"):
+    for tier, tier_stats in scheduler.stats().items():
+        st.write(f"{tier.title()}: {tier_stats['queued']} queued · mean wait {tier_stats['mean_wait_seconds']:.2f}s · "
+                 f"max {tier_stats['max_wait_seconds']:.2f}s · rejected {tier_stats['rejected']}")
+
+EVALUATOR_LABELS = {
+    'evaluate_language': "Language quality",
+    'evaluate_analysis': "Analytical depth",
+    'evaluate_COT': "Clarity of thought",
+    'evaluate_combined': "Combined rubric",
+    'aggregate_paragraphs': "Paragraph rubric",
+}
+
+
+# Seconds to wait for new progress events before refreshing the queue position
+POLL_SECONDS = 0.5
+
+
+def submit_job(state, config, target, label, iteration=0):
+    """Run the workflow in the background; its final state goes to st.session_state[target]."""
+    st.session_state['job'] = {
+        'id': runner.submit(state, config), 'target': target, 'label': label, 'iteration': iteration,
+    }
+
+
+def can_improve(latest, first) -> bool:
+    """Whether the "Improve Essay" button can resume this run for another iteration."""
+    return bool(latest and latest.get('needs_improvements', False)
+                and first['max_iterations'] > 0 and first['plan'] != "free")
+
+
+def follow_job(job):
+    """
+    Show a background job's node progress and stream its summary and rewrite
+    as they are generated; returns its final state. After a rerun the job's
+    events are replayed from the start, so the page picks up where it was.
+    """
+    label, iteration = job['label'], job['iteration']
+    status = st.status(label, expanded=True)
+    summary_box = st.empty()
+    essay_box = st.empty()
+    streamed = {'final_evaluation': "", 'improve_essay': ""}
+    output = None
+    since = 0
+    job_status = 'queued'
+
+    while job_status in ('queued', 'running'):
+        job_status, events = runner.poll(job['id'], since, timeout=POLL_SECONDS)
+        since += len(events)
+        if job_status == 'queued':
+            status.update(label=f"{label} (queued, {runner.stats()['queued']} waiting)")
+        for kind, node, payload in events:
+            if kind == 'token':
+                streamed[node] += payload
+                if node == 'final_evaluation':
+                    summary_box.markdown(f"**📊 Summary (iteration {iteration})**\n\n{streamed[node]}")
+                else:
+                    essay_box.markdown(f"**✍️ Rewriting (iteration {iteration + 1})**\n\n{streamed[node]}")
+            elif kind == 'node':
+                if node == 'prescreen':
+                    features = payload['features']
+                    status.write(f"🔎 {features['words']} words, {features['sentences']} sentences, "
+                                 f"{features['paragraphs']} paragraphs · reading ease {features['reading_ease']:.0f}")
+                    if payload.get('similar_essay'):
+                        status.write(f"♻️ Reusing the evaluation of a near-identical essay "
+                                     f"({payload['similar_essay']['similarity']:.0%} similar)")
+                elif node == 'evaluate_sections':
+                    scores = ", ".join(f"{score:.1f}" for score in payload['score_history']['scores'].values())
+                    status.write(f"🧩 Long essay evaluated in {len(payload['section_results'])} sections ({scores})")
+                elif node in EVALUATOR_LABELS:
+                    scores = ", ".join(f"{score:.1f}" for score in payload['score_history']['scores'].values())
+                    status.write(f"✅ {EVALUATOR_LABELS[node]} evaluated ({scores})")
+                elif node == 'evaluate_paragraphs':
+                    total = len(payload['paragraph_results'])
+                    status.write(f"🧾 {total} paragraphs scored ({payload['paragraphs_reused']} unchanged, reused)")
+                elif node == 'cascade_check' and payload.get('cascade_step') == 'escalate':
+                    status.write("🔁 Score is close to the threshold; re-scoring with the stronger model")
+                elif node == 'final_evaluation':
+                    status.write(f"📊 Iteration {iteration}: average score {payload['avg_score']:.2f}")
+                elif node == 'improve_essay':
+                    iteration = payload['iteration_count']
+                    status.write(f"✍️ Rewrite {iteration} finished")
+                if node in streamed:
+                    streamed[node] = ""
+            else:
+                output = payload
+        if job_status == 'running':
+            status.update(label=label)
+
+    summary_box.empty()
+    essay_box.empty()
+    if job_status != 'done':
+        status.update(label="❌ Workflow failed", state="error", expanded=True)
+        st.error(runner.get(job['id']).error or f"Job {job_status}")
+        return None
+    status.update(label="✅ Workflow finished", state="complete", expanded=False)
+    return output
+
+
 # --- Essay Input ---
 st.subheader("✏️ Paste Your Essay")
 essay_text = st.text_area("Enter your essay below:", height=300, placeholder="Paste your essay here...")
@@ -49,67 +189,99 @@ if run_eval:
     if not essay_text.strip():
         st.error("Please paste your essay before running evaluation.")
     else:
-        with st.spinner("Running UPSC Essay Evaluation Workflow..."):
-            initial_state: UPSEState = {
-                'essay': essay_text.strip(),
-                'language_feedback': "",
-                'clarity_feedback': "",
-                'overall_feedback': "",
-                'analysis_feedback': "",
-                'individual_scores': [],
-                'improved_essay': "",
-                'max_iterations': max_iterations,
-                'avg_score': 0.0,
-                'iteration_count': 0,
-                'plan': plan,
-                'threshold_score': threshold_score,
-            }
-
-            output = workflow.invoke(initial_state)
-
-        # --- Display Results ---
-        st.success("✅ Evaluation Completed!")
-        col1, col2 = st.columns(2)
-
-        with col1:
-            st.metric("Final Average Score", f"{output['avg_score']:.2f} / 10")
-            st.markdown("### 📊 Overall Feedback")
-            st.write(output['overall_feedback'])
-
-        with col2:
-            st.markdown("### 📝 Final Essay (Improved if available)")
-            st.text_area("Essay", value=output.get('essay', essay_text.strip()), height=400)
-
-        # --- Download button ---
-        st.download_button(
-            label="📥 Download Final Essay",
-            data=output.get('essay', essay_text.strip()),
-            file_name="final_essay.txt",
-            mime="text/plain"
+        state = initial_state(essay_text, plan, threshold_score, max_iterations)
+
+        # Each run gets its own checkpoint thread so "Improve Essay" can resume it;
+        # the previous run's is no longer reachable from this session
+        if st.session_state.get('thread_id'):
+            forget_run(st.session_state['thread_id'])
+        st.session_state['thread_id'] = str(uuid.uuid4())
+        st.session_state['output'] = None
+        st.session_state['improved_output'] = None
+        submit_job(state, thread_config(st.session_state['thread_id']), 'output',
+                   "Running UPSC Essay Evaluation Workflow...")
+
+# --- Progress of the background run, if one is in flight (survives reruns) ---
+job = st.session_state.get('job')
+if job:
+    try:
+        result = st.session_state[job['target']] = follow_job(job)
+        # Keep the checkpoint only while the run can still be improved
+        first = st.session_state.get('output')
+        if not (first and can_improve(result, first)):
+            forget_run(st.session_state['thread_id'])
+    except JobNotFound:
+        st.error("This run is no longer available; please run the evaluation again.")
+    del st.session_state['job']
+
+# --- Display Results (kept in session state across reruns) ---
+output = st.session_state.get('output')
+
+if output and output.get('prescreen_failures'):
+    st.warning("⚠️ " + output['overall_feedback'])
+elif output:
+    st.success("✅ Evaluation Completed!")
+    col1, col2 = st.columns(2)
+
+    with col1:
+        st.metric("Final Average Score", f"{output['avg_score']:.2f} / 10")
+        if output.get('stop_reason') == 'plateau':
+            st.caption(
+                f"Stopped early: scores stopped improving. Showing the best version; "
+                f"about {output['llm_calls_saved']:.0f} model calls saved."
+            )
+        st.markdown("### 📊 Overall Feedback")
+        st.write(output['overall_feedback'])
+
+    with col2:
+        st.markdown("### 📝 Final Essay (Improved if available)")
+        st.text_area("Essay", value=output['essay'], height=400)
+
+    # --- Download button ---
+    st.download_button(
+        label="📥 Download Final Essay",
+        data=output['essay'],
+        file_name="final_essay.txt",
+        mime="text/plain"
+    )
+
+    # --- Conditional Improve Button ---
+    latest = st.session_state.get('improved_output') or output
+    if can_improve(latest, output):
+        if st.button("🛠️ Improve Essay"):
+            # Resume the checkpointed run directly at improve_essay
+            config = thread_config(st.session_state['thread_id'])
+            run_async(prepare_improvement(config))
+            submit_job(None, config, 'improved_output', "Improving essay...", iteration=latest['iteration_count'])
+            st.rerun()
+
+    # --- Timing breakdown for the latest run ---
+    with st.expander("⏱️ Timing breakdown"):
+        timing_rows = summarize_timings(latest.get('node_timings'))
+        st.dataframe(timing_rows, use_container_width=True)
+        st.caption(
+            f"Total node time: {sum(row['seconds'] for row in timing_rows):.2f}s · "
+            f"Estimated cost: ${sum(row['cost_usd'] for row in timing_rows):.5f}"
         )
 
-        # --- Conditional Improve Button ---
-        if output.get('needs_improvements', False) and max_iterations > 0 and plan != "free":
-            if st.button("🛠️ Improve Essay"):
-                with st.spinner("Improving essay..."):
-                    # Run improve_essay node manually
-                    improved_state = initial_state.copy()
-                    improved_state.update(output)
-                    improved_state['iteration_count'] += 1
-
-                    # Call improve_essay node (assuming you have a separate function)
-                    # If not, you can invoke workflow with new state or call improve_essay directly
-                    # For demo: just invoke workflow again with improved essay
-                    improved_output = workflow.invoke(improved_state)
-
-                st.success("✍️ Improvement Completed!")
-                st.text_area("Improved Essay", value=improved_output.get('essay', ''), height=400)
-                st.metric("Updated Average Score", f"{improved_output['avg_score']:.2f} / 10")
-                
-                st.download_button(
-                    label="📥 Download Improved Essay",
-                    data=improved_output.get('essay', ''),
-                    file_name="improved_essay.txt",
-                    mime="text/plain"
-                )
+    # --- Score trajectory across iterations ---
+    with st.expander("📈 Score trajectory"):
+        trajectory = score_trajectory(latest)
+        st.dataframe(
+            [dict(zip(trajectory['dimensions'], row), iteration=iteration, average=average)
+             for iteration, (row, average) in enumerate(zip(trajectory['scores'], trajectory['averages']))],
+            use_container_width=True,
+        )
 
+    improved_output = st.session_state.get('improved_output')
+    if improved_output:
+        st.success("✍️ Improvement Completed!")
+        st.text_area("Improved Essay", value=improved_output.get('essay', ''), height=400)
+        st.metric("Updated Average Score", f"{improved_output['avg_score']:.2f} / 10")
+
+        st.download_button(
+            label="📥 Download Improved Essay",
+            data=improved_output.get('essay', ''),
+            file_name="improved_essay.txt",
+            mime="text/plain"
+        )
@@ -0,0 +1,433 @@
+# api.py
+"""
+HTTP API for the evaluation workflow, for integrations (an LMS) that cannot
+drive the Streamlit page. It is a plain ASGI application; serve it with any
+ASGI server, one event loop per process:
+
+    uvicorn api:app --host 0.0.0.0 --port 8000
+
+Routes:
+  POST   /v1/evaluations              submit one essay; 202 with its job id
+  POST   /v1/evaluations/bulk         submit many essays; 202 with a batch id and job ids
+  GET    /v1/evaluations/{id}         job status, and the result once done
+  GET    /v1/evaluations/{id}/events  progress as server-sent events
+  DELETE /v1/evaluations/{id}         cancel a job
+  GET    /v1/batches/{id}             status and results of every job of a bulk submission
+  GET    /healthz                     job and scheduler queues
+  GET    /metrics                     Prometheus metrics
+
+A submission is {"essay": ..., "plan": "free"|"basic"|"premium"} plus any of
+threshold_score, max_iterations, min_improvement and patience (each from 0
+to 10; values outside that get 400); a bulk
+submission is {"essays": [submission, ...]} where top-level fields are the
+defaults for every essay and each essay may carry its own "id".
+
+Every run is a job on the server's own event loop (jobs.runner is bound to
+it at startup), so one process keeps hundreds of evaluations in flight, each
+mostly waiting on model calls, without a thread per request. At most
+UPSE_API_MAX_JOBS run at once and the rest queue; submissions past
+UPSE_API_MAX_QUEUED queued jobs get 503. Upstream rate limits are applied
+per plan tier by the scheduler underneath.
+
+The event stream sends one event per progress event of the job, with its
+index as the SSE id, so a client that reconnects with Last-Event-ID (or
+?since=N) picks up where it left off:
+  event: node    {"node": ..., "update": {...}}   a node finished (partial results)
+  event: token   {"node": ..., "text": ...}       a streamed token of the summary or rewrite
+  event: result  {...}                            the final result
+  event: end     {...}                            the job's final status; the stream closes
+"""
+import asyncio
+import json
+import os
+import re
+import traceback
+import uuid
+from collections import OrderedDict
+from urllib.parse import parse_qs
+
+from Backend import get_workflow, initial_state, result_summary
+from instrumentation import metrics
+from jobs import JobNotFound, MAX_FINISHED, runner
+from model_setup import get_model
+from prescreen import extract_features
+from scheduler import scheduler
+
+MAX_IN_FLIGHT = int(os.getenv("UPSE_API_MAX_JOBS", "256"))
+MAX_QUEUED = int(os.getenv("UPSE_API_MAX_QUEUED", "5000"))
+MAX_BULK = int(os.getenv("UPSE_API_MAX_BULK", "500"))
+MAX_BODY_BYTES = int(os.getenv("UPSE_API_MAX_BODY_BYTES", str(8 * 1024 * 1024)))
+# Comment lines sent on idle event streams so proxies don't close them
+HEARTBEAT_SECONDS = 15.0
+
+PLANS = ('free', 'basic', 'premium')
+# Optional settings of a submission -> (type, largest value), matching initial_state's
+# parameters; the bounds keep one request from looping on the model without end
+# (max_iterations matches the UI's limit)
+SETTINGS = {
+    'threshold_score': (float, 10.0),
+    'max_iterations': (int, 10),
+    'min_improvement': (float, 10.0),
+    'patience': (int, 10),
+}
+
+SSE_HEADERS = [
+    (b'content-type', b'text/event-stream; charset=utf-8'),
+    (b'cache-control', b'no-cache'),
+    (b'x-accel-buffering', b'no'),
+]
+
+metrics.describe('upse_api_requests_total', 'counter', "HTTP API requests, by route and status")
+metrics.describe('upse_api_event_streams', 'gauge', "Open server-sent event streams")
+
+_batches = OrderedDict()
+_open_streams = 0
+_started = False
+
+metrics.add_collector(lambda: {('upse_api_event_streams', ()): _open_streams})
+
+
+class HTTPError(Exception):
+    def __init__(self, status: int, message: str, headers=()):
+        super().__init__(message)
+        self.status = status
+        self.headers = list(headers)
+
+
+def parse_submission(body, defaults: dict = None) -> dict:
+    """initial_state arguments for one submitted essay; raises HTTPError(400) if it is invalid."""
+    if not isinstance(body, dict):
+        raise HTTPError(400, "a submission must be a JSON object")
+    merged = {**(defaults or {}), **body}
+    essay = merged.get('essay')
+    if not isinstance(essay, str) or not essay.strip():
+        raise HTTPError(400, "'essay' must be a non-empty string")
+    plan = merged.get('plan', 'free')
+    if plan not in PLANS:
+        raise HTTPError(400, f"'plan' must be one of {', '.join(PLANS)}")
+    submission = {'essay': essay, 'plan': plan}
+    for name, (kind, upper) in SETTINGS.items():
+        value = merged.get(name)
+        if value is None:
+            continue
+        if isinstance(value, bool) or not isinstance(value, (int, float)) or not 0 <= value <= upper:
+            raise HTTPError(400, f"'{name}' must be a number from 0 to {upper}")
+        submission[name] = kind(value)
+    return submission
+
+
+def submit(submission: dict, features: dict = None) -> str:
+    state = initial_state(**submission)
+    if features is not None:
+        state['features'] = features
+    # API runs are never resumed, so they skip the checkpointer
+    return runner.submit(state, workflow=get_workflow(submission['plan'], checkpointed=False))
+
+
+def admit(count: int):
+    """Refuse submissions that would grow the job queue past MAX_QUEUED."""
+    if runner.stats()['queued'] + count > MAX_QUEUED:
+        raise HTTPError(503, "too many queued evaluations, retry later", [(b'retry-after', b'30')])
+
+
+def job_view(job) -> dict:
+    view = job.summary()
+    if job.status == 'done' and job.result is not None:
+        view['result'] = result_summary(job.result)
+    return view
+
+
+def sse_message(event: str, data, event_id: int = None) -> bytes:
+    lines = [] if event_id is None else [f"id: {event_id}"]
+    lines.append(f"event: {event}")
+    lines.append(f"data: {json.dumps(data, ensure_ascii=False, default=str)}")
+    return ("\n".join(lines) + "\n\n").encode('utf-8')
+
+
+def progress_message(index: int, kind: str, node: str, payload) -> bytes:
+    if kind == 'node':
+        update = {key: value for key, value in payload.items() if key != 'signature'}
+        return sse_message('node', {'node': node, 'update': update}, index)
+    if kind == 'token':
+        return sse_message('token', {'node': node, 'text': payload}, index)
+    return sse_message('result', result_summary(payload), index)
+
+
+# ---------------------------------------------------------------------------
+# Routes
+
+ROUTES = []
+
+
+def route(method: str, pattern: str):
+    def register(handler):
+        # Metrics label: the path with its parameters as {name}
+        label = re.sub(r"\(\?P<(\w+)>[^)]*\)", r"{\1}", pattern)
+        ROUTES.append((method, re.compile(f"^{pattern}$"), label, handler))
+        return handler
+    return register
+
+
+@route('POST', r'/v1/evaluations')
+async def create_evaluation(scope, receive, send):
+    submission = parse_submission(await read_json(receive))
+    admit(1)
+    job_id = submit(submission)
+    return 202, {'job_id': job_id, 'status': 'queued', 'events': f"/v1/evaluations/{job_id}/events"}
+
+
+@route('POST', r'/v1/evaluations/bulk')
+async def create_bulk(scope, receive, send):
+    body = await read_json(receive)
+    if not isinstance(body, dict) or not isinstance(body.get('essays'), list) or not body['essays']:
+        raise HTTPError(400, "'essays' must be a non-empty list")
+    if len(body['essays']) > MAX_BULK:
+        raise HTTPError(413, f"at most {MAX_BULK} essays per bulk request")
+    defaults = {key: value for key, value in body.items() if key != 'essays'}
+
+    entries, valid = [], []
+    for position, item in enumerate(body['essays']):
+        if isinstance(item, str):
+            item = {'essay': item}
+        entry = {'id': item.get('id', position) if isinstance(item, dict) else position}
+        try:
+            entry['submission'] = parse_submission(item, defaults)
+            valid.append(entry)
+        except HTTPError as e:
+            entry['error'] = str(e)
+        entries.append(entry)
+    admit(len(valid))
+
+    # Measure the whole request locally in one pass, as batch.py does; the
+    # prescreen node reuses these features
+    for entry, features in zip(valid, extract_features(entry['submission']['essay'] for entry in valid)):
+        entry['job_id'] = submit(entry.pop('submission'), features)
+
+    batch_id = uuid.uuid4().hex
+    _batches[batch_id] = entries
+    while len(_batches) > MAX_FINISHED:
+        _batches.popitem(last=False)
+    return 202, {'batch_id': batch_id, 'accepted': len(valid), 'rejected': len(entries) - len(valid),
+                 'jobs': entries}
+
+
+@route('GET', r'/v1/evaluations/(?P<job_id>[0-9a-f]+)')
+async def get_evaluation(scope, receive, send, job_id):
+    return 200, job_view(runner.get(job_id))
+
+
+@route('DELETE', r'/v1/evaluations/(?P<job_id>[0-9a-f]+)')
+async def cancel_evaluation(scope, receive, send, job_id):
+    cancelled = runner.cancel(job_id)
+    return 200, {'job_id': job_id, 'cancelled': cancelled}
+
+
+@route('GET', r'/v1/batches/(?P<batch_id>[0-9a-f]+)')
+async def get_batch(scope, receive, send, batch_id):
+    entries = _batches.get(batch_id)
+    if entries is None:
+        raise HTTPError(404, f"no batch {batch_id}")
+    jobs, counts = [], {}
+    for entry in entries:
+        view = dict(entry)
+        if 'job_id' in entry:
+            try:
+                job = job_view(runner.get(entry['job_id']))
+                view.update({key: value for key, value in job.items() if key != 'id'})
+            except JobNotFound:
+                view['status'] = 'expired'
+        else:
+            view['status'] = 'rejected'
+        counts[view['status']] = counts.get(view['status'], 0) + 1
+        jobs.append(view)
+    return 200, {'batch_id': batch_id, 'counts': counts, 'jobs': jobs}
+
+
+@route('GET', r'/v1/evaluations/(?P<job_id>[0-9a-f]+)/events')
+async def stream_evaluation(scope, receive, send, job_id):
+    global _open_streams
+    job = runner.get(job_id)
+    since = resume_index(scope)
+    await send({'type': 'http.response.start', 'status': 200, 'headers': SSE_HEADERS})
+
+    _open_streams += 1
+    events = job.subscribe(since)
+    disconnected = asyncio.ensure_future(wait_disconnect(receive))
+    next_event = None
+    index = since
+    try:
+        while True:
+            if next_event is None:
+                next_event = asyncio.ensure_future(events.__anext__())
+            done, _ = await asyncio.wait({next_event, disconnected}, timeout=HEARTBEAT_SECONDS,
+                                         return_when=asyncio.FIRST_COMPLETED)
+            if disconnected in done:
+                return 200, None
+            if not done:
+                await send_chunk(send, b": keep-alive\n\n")
+                continue
+            try:
+                event = next_event.result()
+            except StopAsyncIteration:
+                break
+            next_event = None
+            await send_chunk(send, progress_message(index, *event))
+            index += 1
+        await send_chunk(send, sse_message('end', job.summary()))
+        await send({'type': 'http.response.body', 'body': b'', 'more_body': False})
+        return 200, None
+    finally:
+        _open_streams -= 1
+        disconnected.cancel()
+        if next_event is not None and not next_event.done():
+            # Let the subscription unwind before closing it
+            next_event.cancel()
+            await asyncio.gather(next_event, return_exceptions=True)
+        await events.aclose()
+
+
+@route('GET', r'/healthz')
+async def health(scope, receive, send):
+    return 200, {'status': 'ok', 'jobs': runner.stats(), 'scheduler': scheduler.stats()}
+
+
+@route('GET', r'/metrics')
+async def metrics_text(scope, receive, send):
+    await send_body(send, 200, metrics.render().encode('utf-8'), b'text/plain; version=0.0.4')
+    return 200, None
+
+
+# ---------------------------------------------------------------------------
+# ASGI plumbing
+
+def resume_index(scope) -> int:
+    """First event to send: after Last-Event-ID if the client is reconnecting, else ?since=N."""
+    for name, value in scope.get('headers', ()):
+        if name == b'last-event-id':
+            try:
+                return int(value) + 1
+            except ValueError:
+                raise HTTPError(400, "Last-Event-ID must be an event index")
+    since = parse_qs(scope.get('query_string', b'').decode()).get('since', ['0'])[0]
+    try:
+        return max(0, int(since))
+    except ValueError:
+        raise HTTPError(400, "'since' must be an event index")
+
+
+async def read_json(receive):
+    chunks, size = [], 0
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            raise HTTPError(400, "client disconnected")
+        chunk = message.get('body', b'')
+        size += len(chunk)
+        if size > MAX_BODY_BYTES:
+            raise HTTPError(413, f"request body larger than {MAX_BODY_BYTES} bytes")
+        chunks.append(chunk)
+        if not message.get('more_body'):
+            break
+    try:
+        return json.loads(b''.join(chunks))
+    except ValueError:
+        raise HTTPError(400, "request body must be JSON")
+
+
+async def wait_disconnect(receive):
+    while (await receive())['type'] != 'http.disconnect':
+        pass
+
+
+async def send_chunk(send, chunk: bytes):
+    await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+
+
+async def send_body(send, status: int, body: bytes, content_type: bytes, headers=()):
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(b'content-type', content_type), (b'content-length', str(len(body)).encode()), *headers],
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def send_json(send, status: int, body, headers=()):
+    payload = json.dumps(body, ensure_ascii=False, default=str).encode('utf-8')
+    await send_body(send, status, payload, b'application/json', headers)
+
+
+def start():
+    """Bind the job runner to this event loop and build the model client and workflows; idempotent."""
+    global _started
+    if _started:
+        return
+    runner.run_on(asyncio.get_running_loop(), MAX_IN_FLIGHT)
+    get_model()
+    for plan in PLANS:
+        get_workflow(plan, checkpointed=False)
+    _started = True
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            try:
+                start()
+            except Exception as e:
+                await send({'type': 'lifespan.startup.failed', 'message': f"{type(e).__name__}: {e}"})
+                return
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def app(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        return await lifespan(receive, send)
+    if scope['type'] != 'http':
+        return
+    # Servers run without lifespan events start the service on the first request
+    start()
+
+    path, method = scope['path'], scope['method']
+    handler, params, label = None, {}, 'unmatched'
+    allowed = False
+    for route_method, pattern, route_label, route_handler in ROUTES:
+        match = pattern.match(path)
+        if match:
+            allowed = True
+            if route_method == method:
+                handler, params, label = route_handler, match.groupdict(), route_label
+                break
+
+    started = False
+
+    async def send_tracked(message):
+        nonlocal started
+        started = started or message['type'] == 'http.response.start'
+        await send(message)
+
+    status = 500
+    try:
+        if handler is None:
+            raise HTTPError(405 if allowed else 404, "method not allowed" if allowed else "not found")
+        status, body = await handler(scope, receive, send_tracked, **params)
+        if body is not None:
+            await send_json(send, status, body)
+    except HTTPError as e:
+        status = e.status
+        await send_json(send, status, {'error': str(e)}, e.headers)
+    except JobNotFound as e:
+        status = 404
+        await send_json(send, status, {'error': f"no job {e.args[0]}"})
+    except Exception:
+        status = 500
+        traceback.print_exc()
+        # A stream that already started can only be cut short; the server closes it
+        if not started:
+            await send_json(send, status, {'error': "internal server error"})
+    finally:
+        metrics.inc('upse_api_requests_total', route=label, method=method, status=str(status))
@@ -0,0 +1,149 @@
+# batch.py
+"""
+Evaluate a batch of essays from the command line.
+
+Input is either a directory of .txt files (the file name is the essay id) or
+a JSONL file with one {"id": ..., "essay": ..., "plan": ...} object per line.
+Each result (with its per-node timing records and score trajectory) is
+appended to the output JSONL file as soon as that essay finishes, and essays
+already present in the output are skipped, so an interrupted batch can simply
+be re-run.
+
+    python batch.py mock_test/ -o results.jsonl --plan basic --concurrency 8
+"""
+import argparse
+import asyncio
+import json
+import os
+import time
+
+from Backend import PLAN_EVAL_MODES, get_workflow, initial_state, result_summary, run_config
+from prescreen import extract_features
+
+
+def load_essays(path: str):
+    essays = []
+    if os.path.isdir(path):
+        for name in sorted(os.listdir(path)):
+            if name.endswith('.txt'):
+                with open(os.path.join(path, name), encoding='utf-8') as f:
+                    essays.append({'id': os.path.splitext(name)[0], 'essay': f.read()})
+        return essays
+
+    with open(path, encoding='utf-8') as f:
+        for line_no, line in enumerate(f, start=1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                record = None
+            if not isinstance(record, dict):
+                # Kept without an essay, so it is reported as an error row
+                record = {}
+            record.setdefault('id', f"line-{line_no}")
+            essays.append(record)
+    return essays
+
+
+def completed_ids(output_path: str) -> set:
+    """Ids already evaluated successfully; failed essays are retried on the next run."""
+    done = set()
+    if not os.path.exists(output_path):
+        return done
+    with open(output_path, encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # A crash can leave a truncated last line behind
+                continue
+            if 'error' not in record:
+                done.add(str(record['id']))
+    return done
+
+
+def record_problem(record: dict, default_plan: str) -> str:
+    """Why a record cannot be evaluated, or "" if it can."""
+    essay = record.get('essay')
+    if not isinstance(essay, str) or not essay.strip():
+        return "record has no essay text"
+    plan = record.get('plan', default_plan)
+    if plan not in PLAN_EVAL_MODES:
+        return f"unknown plan {plan!r}"
+    return ""
+
+
+async def evaluate_one(record: dict, args, semaphore: asyncio.Semaphore) -> dict:
+    async with semaphore:
+        plan = record.get('plan', args.plan)
+        start = time.perf_counter()
+        try:
+            problem = record_problem(record, args.plan)
+            if problem:
+                raise ValueError(problem)
+            state = initial_state(record['essay'], plan, args.threshold, args.max_iterations)
+            state['features'] = record['features']
+            # Batch runs never resume individual essays, so they skip the checkpointer
+            workflow = get_workflow(plan, checkpointed=False)
+            output = await workflow.ainvoke(state, run_config(state))
+        except Exception as e:
+            return {'id': record['id'], 'plan': plan, 'error': f"{type(e).__name__}: {e}",
+                    'elapsed_seconds': round(time.perf_counter() - start, 3)}
+
+        return {
+            'id': record['id'],
+            'plan': plan,
+            **result_summary(output),
+            'elapsed_seconds': round(time.perf_counter() - start, 3),
+            'node_timings': output['node_timings'],
+        }
+
+
+async def run_batch(args):
+    essays = load_essays(args.input)
+    done = completed_ids(args.output)
+    pending = [record for record in essays if str(record['id']) not in done]
+    print(f"{len(essays)} essays, {len(essays) - len(pending)} already done, {len(pending)} to evaluate")
+
+    # Measure the whole batch locally in one pass; the workflow's prescreen
+    # node reuses these features instead of measuring each essay again;
+    # invalid records are left for evaluate_one to report
+    valid = [record for record in pending if not record_problem(record, args.plan)]
+    for record, features in zip(valid, extract_features(record['essay'] for record in valid)):
+        record['features'] = features
+
+    semaphore = asyncio.Semaphore(args.concurrency)
+    tasks = [asyncio.create_task(evaluate_one(record, args, semaphore)) for record in pending]
+    failures = 0
+    with open(args.output, 'a', encoding='utf-8') as out:
+        for finished, task in enumerate(asyncio.as_completed(tasks), start=1):
+            result = await task
+            out.write(json.dumps(result, ensure_ascii=False) + "\n")
+            out.flush()
+            if 'error' in result:
+                failures += 1
+                print(f"[{finished}/{len(pending)}] {result['id']} failed: {result['error']}")
+            else:
+                print(f"[{finished}/{len(pending)}] {result['id']} score={result['avg_score']:.2f} "
+                      f"iterations={result['iteration_count']} ({result['elapsed_seconds']:.1f}s)")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Evaluate a batch of UPSC essays.")
+    parser.add_argument('input', help="Directory of .txt essays or a JSONL file")
+    parser.add_argument('-o', '--output', default='results.jsonl', help="JSONL file results are appended to")
+    parser.add_argument('--plan', choices=['free', 'basic', 'premium'], default='free',
+                        help="Plan for essays that don't set their own")
+    parser.add_argument('--concurrency', type=int, default=4, help="Maximum essays evaluated at once")
+    parser.add_argument('--threshold', type=float, default=None, help="Override the plan's quality threshold")
+    parser.add_argument('--max-iterations', type=int, default=None, help="Override the plan's improvement iterations")
+    args = parser.parse_args()
+
+    failures = asyncio.run(run_batch(args))
+    raise SystemExit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
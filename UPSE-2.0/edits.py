@@ -0,0 +1,147 @@
+# edits.py
+"""
+Edit scripts: improve an essay by applying a short list of edits instead of
+having the model regenerate the whole text.
+
+number_sentences labels every paragraph (p1, p2, ...) and sentence (p1.s1,
+p1.s2, ...) so the model can refer to them, and apply_edits applies the
+edits the model returns:
+
+    {"op": "replace", "id": "p2.s3", "text": "..."}   sentence or paragraph
+    {"op": "delete", "id": "p4"}                        sentence or paragraph
+    {"op": "insert", "after": "p2.s3", "text": "..."}  sentence after a sentence,
+                                                        paragraph after a paragraph (p0 = start)
+
+All ids refer to the essay as numbered, before any edit is applied. Any
+edit that cannot be applied cleanly raises EditError, so the caller can
+fall back to a full rewrite.
+"""
+import re
+
+_PARAGRAPH_BREAK = re.compile(r'\n\s*\n')
+# A sentence ends at . ! or ? followed by whitespace, or at a line break
+_SENTENCE_BREAK = re.compile(r'((?<=[.!?])[ \t]+|[ \t]*\n\s*)')
+# ...except after a title or abbreviation, or an initial as in "A. P. J. Abdul Kalam"
+_ABBREVIATION = re.compile(r'(?:\b(?:Dr|Mr|Mrs|Ms|Prof|Sr|Jr|St|Mt|Rs|Govt|vs|viz|cf|e\.g|i\.e)|(?<!\w)[A-Z])\.$')
+# Longest abbreviation above, so the check only looks at the end of the sentence
+_ABBREVIATION_CHARS = 5
+_PARAGRAPH_ID = re.compile(r'^p(\d+)$')
+_SENTENCE_ID = re.compile(r'^p(\d+)\.s(\d+)$')
+
+# An edit script may not remove more than this share of the essay's words
+MAX_WORDS_REMOVED = 0.5
+
+
+class EditError(ValueError):
+    """The edit script is malformed or does not match the essay."""
+
+
+def _split_sentences(paragraph: str):
+    """Sentences and the separators between them, alternating as re.split returns them."""
+    parts = []
+    start = 0
+    for match in _SENTENCE_BREAK.finditer(paragraph):
+        end = match.start()
+        if '\n' not in match.group(0) and _ABBREVIATION.search(paragraph, max(start, end - _ABBREVIATION_CHARS), end):
+            continue
+        parts += [paragraph[start:end], match.group(0)]
+        start = match.end()
+    parts.append(paragraph[start:])
+    return parts
+
+
+def split_essay(essay: str):
+    """Paragraphs as lists of (sentence, separator after it) pairs."""
+    paragraphs = []
+    for paragraph in _PARAGRAPH_BREAK.split(essay.strip()):
+        if not paragraph.strip():
+            continue
+        parts = _split_sentences(paragraph.strip())
+        sentences = parts[0::2]
+        separators = parts[1::2] + ['']
+        paragraphs.append([(s, sep) for s, sep in zip(sentences, separators) if s.strip()])
+    return paragraphs
+
+
+def number_sentences(essay: str) -> str:
+    """The essay with each sentence prefixed by its id, one paragraph per block."""
+    blocks = []
+    for p, paragraph in enumerate(split_essay(essay), start=1):
+        blocks.append("\n".join(f"[p{p}.s{s}] {sentence}" for s, (sentence, _) in enumerate(paragraph, start=1)))
+    return "\n\n".join(blocks)
+
+
+def _check_anchor(anchor, paragraphs, allow_start=False):
+    if not isinstance(anchor, str):
+        raise EditError(f"Edit anchor must be an id string, got {anchor!r}")
+    anchor = anchor.strip().strip('[]')
+    match = _SENTENCE_ID.match(anchor)
+    if match:
+        p, s = int(match.group(1)), int(match.group(2))
+        if 1 <= p <= len(paragraphs) and 1 <= s <= len(paragraphs[p - 1]):
+            return anchor
+    match = _PARAGRAPH_ID.match(anchor)
+    if match:
+        p = int(match.group(1))
+        if 1 <= p <= len(paragraphs) or (allow_start and p == 0):
+            return anchor
+    raise EditError(f"Unknown edit anchor {anchor!r}")
+
+
+def apply_edits(essay: str, edits) -> str:
+    """Apply an edit script to the essay and return the edited text; raises EditError."""
+    if not isinstance(edits, list) or not edits:
+        raise EditError("Edit script must be a non-empty list of edits")
+
+    paragraphs = split_essay(essay)
+    replacements, deletions, insertions = {}, set(), {}
+    for edit in edits:
+        if not isinstance(edit, dict):
+            raise EditError(f"Edit must be an object, got {edit!r}")
+        op = edit.get('op')
+        text = edit.get('text')
+        if op == 'insert':
+            anchor = _check_anchor(edit.get('after', edit.get('id')), paragraphs, allow_start=True)
+        elif op in ('replace', 'delete'):
+            anchor = _check_anchor(edit.get('id'), paragraphs)
+            if anchor in replacements or anchor in deletions:
+                raise EditError(f"More than one edit changes {anchor}")
+        else:
+            raise EditError(f"Unknown edit operation {op!r}")
+        if op != 'delete' and (not isinstance(text, str) or not text.strip()):
+            raise EditError(f"{op} edit at {anchor} has no text")
+
+        if op == 'replace':
+            replacements[anchor] = text.strip()
+        elif op == 'delete':
+            deletions.add(anchor)
+        else:
+            insertions.setdefault(anchor, []).append(text.strip())
+
+    changed_paragraphs = {anchor for anchor in replacements.keys() | deletions if '.' not in anchor}
+    for anchor in list(replacements) + list(deletions) + list(insertions):
+        if '.' in anchor and anchor.split('.')[0] in changed_paragraphs:
+            raise EditError(f"{anchor} is inside a paragraph that is replaced or deleted")
+
+    result = list(insertions.get('p0', []))
+    for p, paragraph in enumerate(paragraphs, start=1):
+        paragraph_id = f"p{p}"
+        if paragraph_id in replacements:
+            result.append(replacements[paragraph_id])
+        elif paragraph_id not in deletions:
+            pieces = []
+            for s, (sentence, separator) in enumerate(paragraph, start=1):
+                sentence_id = f"{paragraph_id}.s{s}"
+                if sentence_id not in deletions:
+                    pieces += [replacements.get(sentence_id, sentence), separator or ' ']
+                for text in insertions.get(sentence_id, []):
+                    pieces += [text, ' ']
+            text = ''.join(pieces).strip()
+            if text:
+                result.append(text)
+        result.extend(insertions.get(paragraph_id, []))
+
+    edited = "\n\n".join(result)
+    if len(edited.split()) < len(essay.split()) * (1 - MAX_WORDS_REMOVED):
+        raise EditError("Edit script removes too much of the essay")
+    return edited
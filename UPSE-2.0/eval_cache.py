@@ -0,0 +1,145 @@
+# eval_cache.py
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+# Directory the SQLite stores default to; each path can also be set on its own
+DATA_DIR = os.getenv("UPSE_DATA_DIR", ".")
+
+
+def open_database(path: str) -> sqlite3.Connection:
+    """Connect to a SQLite store shared across threads, creating its directory if needed."""
+    if path != ":memory:":
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    return sqlite3.connect(path, check_same_thread=False)
+
+
+class EvalCache:
+    """
+    Disk-backed cache for evaluator and summary responses.
+
+    Entries are content-addressed (see make_key) and stored in a local SQLite
+    file. Expired entries (older than ttl_seconds) are never returned, and once
+    the table grows past max_entries the least recently used rows are evicted.
+    Hits only mark their rows as used in memory; the access times are written
+    in one batch with the next set() or once touch_batch hits have built up.
+    """
+
+    def __init__(self, path: str, max_entries: int = 5000, ttl_seconds: float = 7 * 24 * 3600,
+                 touch_batch: int = 64):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.touch_batch = touch_batch
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._conn = None
+        self._entries = 0
+        self._touched = {}
+
+    def _db(self):
+        """The SQLite connection, opened on first use so importing never creates the file (caller holds the lock)."""
+        if self._conn is None:
+            conn = open_database(self.path)
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS eval_cache ("
+                " key TEXT PRIMARY KEY,"
+                " value TEXT NOT NULL,"
+                " created_at REAL NOT NULL,"
+                " accessed_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS eval_cache_accessed ON eval_cache (accessed_at)")
+            conn.commit()
+            self._entries = conn.execute("SELECT COUNT(*) FROM eval_cache").fetchone()[0]
+            self._conn = conn
+        return self._conn
+
+    @staticmethod
+    def make_key(*parts) -> str:
+        digest = hashlib.sha256()
+        for part in parts:
+            digest.update(str(part).encode("utf-8"))
+            digest.update(b"\x00")
+        return digest.hexdigest()
+
+    def get(self, key: str):
+        now = time.time()
+        with self._lock:
+            row = self._db().execute(
+                "SELECT value, created_at FROM eval_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None or now - row[1] > self.ttl_seconds:
+                self.misses += 1
+                return None
+            self._touched[key] = now
+            if len(self._touched) >= self.touch_batch:
+                self._flush_touched()
+                self._db().commit()
+            self.hits += 1
+            return row[0]
+
+    def _flush_touched(self):
+        if self._touched:
+            self._db().executemany(
+                "UPDATE eval_cache SET accessed_at = ? WHERE key = ?",
+                [(accessed_at, key) for key, accessed_at in self._touched.items()],
+            )
+            self._touched.clear()
+
+    def set(self, key: str, value: str):
+        now = time.time()
+        with self._lock:
+            self._flush_touched()
+            exists = self._db().execute("SELECT 1 FROM eval_cache WHERE key = ?", (key,)).fetchone()
+            self._db().execute(
+                "INSERT OR REPLACE INTO eval_cache (key, value, created_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, value, now, now),
+            )
+            if exists is None:
+                self._entries += 1
+            self._evict(now)
+            self._db().commit()
+
+    def _evict(self, now: float):
+        expired = self._db().execute(
+            "DELETE FROM eval_cache WHERE created_at < ?", (now - self.ttl_seconds,)
+        ).rowcount
+        self._entries -= expired
+        overflow = max(0, self._entries - self.max_entries)
+        if overflow:
+            self._db().execute(
+                "DELETE FROM eval_cache WHERE key IN"
+                " (SELECT key FROM eval_cache ORDER BY accessed_at ASC LIMIT ?)",
+                (overflow,),
+            )
+            self._entries -= overflow
+        self.evictions += expired + overflow
+
+    def clear(self):
+        with self._lock:
+            self._db().execute("DELETE FROM eval_cache")
+            self._db().commit()
+            self._touched.clear()
+            self._entries = 0
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'evictions': self.evictions,
+            'entries': self._entries,
+            'max_entries': self.max_entries,
+        }
+
+
+cache = EvalCache(
+    os.getenv("UPSE_CACHE_PATH", os.path.join(DATA_DIR, "upse_cache.sqlite3")),
+    max_entries=int(os.getenv("UPSE_CACHE_MAX_ENTRIES", "5000")),
+    ttl_seconds=float(os.getenv("UPSE_CACHE_TTL_SECONDS", str(7 * 24 * 3600))),
+)
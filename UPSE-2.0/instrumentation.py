@@ -0,0 +1,318 @@
+# instrumentation.py
+"""
+Per-node telemetry for the evaluation workflow.
+
+Every graph node is wrapped with instrument_node, which records wall time,
+prompt/completion tokens, estimated cost, parse failures/repairs and retries,
+tagged with the plan tier and iteration. Each node also appends one record
+to the 'node_timings' state field so a run carries its own breakdown, and
+the aggregate metrics are served in Prometheus text format by
+start_metrics_server.
+"""
+import contextvars
+import functools
+import inspect
+import logging
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Estimated USD per million (prompt, completion) tokens, at OpenRouter list prices
+MODEL_PRICES = {
+    'mistralai/mistral-7b-instruct': (0.028, 0.054),
+    'mistralai/mixtral-8x22b-instruct': (0.9, 0.9),
+}
+
+logger = logging.getLogger(__name__)
+# Models already warned about for having no price
+_unpriced = set()
+
+DURATION_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# Telemetry of the node currently running in this task
+_current = contextvars.ContextVar('upse_current_node', default=None)
+
+
+class Metrics:
+    """Minimal thread-safe counter/histogram registry rendered in Prometheus text format."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._histograms = {}
+        self._help = {}
+        self._collectors = []
+
+    def describe(self, name: str, kind: str, help_text: str):
+        self._help[name] = (kind, help_text)
+
+    def inc(self, name: str, value: float = 1.0, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0.0) + value
+
+    def observe(self, name: str, value: float, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            buckets, total, count = self._histograms.get(key, ([0] * len(DURATION_BUCKETS), 0.0, 0))
+            buckets = [n + (value <= bound) for n, bound in zip(buckets, DURATION_BUCKETS)]
+            self._histograms[key] = (buckets, total + value, count + 1)
+
+    def add_collector(self, collect):
+        """Register a callable returning {(name, labels_tuple): value} gauges, read at render time."""
+        self._collectors.append(collect)
+
+    @staticmethod
+    def _labels(labels, extra=()):
+        pairs = list(labels) + list(extra)
+        if not pairs:
+            return ""
+        return "{" + ",".join(f'{k}="{v}"' for k, v in pairs) + "}"
+
+    def render(self) -> str:
+        lines = []
+        with self._lock:
+            counters = dict(self._counters)
+            histograms = dict(self._histograms)
+        gauges = {}
+        for collect in self._collectors:
+            gauges.update(collect())
+
+        described = set()
+
+        def header(name):
+            if name in self._help and name not in described:
+                kind, help_text = self._help[name]
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {kind}")
+                described.add(name)
+
+        for (name, labels), value in sorted(list(counters.items()) + list(gauges.items())):
+            header(name)
+            lines.append(f"{name}{self._labels(labels)} {value}")
+        for (name, labels), (buckets, total, count) in sorted(histograms.items()):
+            header(name)
+            for bound, n in zip(DURATION_BUCKETS, buckets):
+                lines.append(f"{name}_bucket{self._labels(labels, [('le', bound)])} {n}")
+            lines.append(f"{name}_bucket{self._labels(labels, [('le', '+Inf')])} {count}")
+            lines.append(f"{name}_sum{self._labels(labels)} {total}")
+            lines.append(f"{name}_count{self._labels(labels)} {count}")
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
+metrics.describe('upse_node_duration_seconds', 'histogram', "Wall time of each workflow node")
+metrics.describe('upse_llm_tokens_total', 'counter', "Prompt and completion tokens sent to the model")
+metrics.describe('upse_llm_cost_usd_total', 'counter', "Estimated model cost in USD")
+metrics.describe('upse_llm_calls_total', 'counter', "Model calls made (cache misses)")
+metrics.describe('upse_parse_attempts_total', 'counter', "Model replies parsed as JSON")
+metrics.describe('upse_parse_failures_total', 'counter', "Model replies that could not be parsed")
+metrics.describe('upse_parse_repairs_total', 'counter', "Repairs needed to use a model reply, by kind")
+metrics.describe('upse_llm_retries_total', 'counter', "Model calls retried")
+metrics.describe('upse_llm_abandoned_calls_total', 'counter', "Model calls cancelled or timed out before replying")
+
+
+def estimate_cost(model_name: str, prompt_tokens: int, completion_tokens: int) -> float:
+    if model_name not in MODEL_PRICES:
+        if model_name not in _unpriced:
+            _unpriced.add(model_name)
+            logger.warning("No price for model %s in MODEL_PRICES; its cost is reported as 0", model_name)
+        return 0.0
+    prompt_price, completion_price = MODEL_PRICES[model_name]
+    return (prompt_tokens * prompt_price + completion_tokens * completion_price) / 1_000_000
+
+
+def _labels():
+    record = _current.get()
+    if record is None:
+        return {'node': 'unknown', 'plan': 'unknown'}
+    return {'node': record['node'], 'plan': record['plan']}
+
+
+def current_plan(default: str = 'free') -> str:
+    """Plan tier of the node running in this task."""
+    record = _current.get()
+    return record['plan'] if record is not None else default
+
+
+def record_llm_usage(message, model_name: str):
+    """Account the tokens and estimated cost of one model response to the running node."""
+    usage = getattr(message, 'usage_metadata', None) or {}
+    prompt_tokens = usage.get('input_tokens', 0)
+    completion_tokens = usage.get('output_tokens', 0)
+    cost = estimate_cost(model_name, prompt_tokens, completion_tokens)
+
+    labels = _labels()
+    metrics.inc('upse_llm_calls_total', model=model_name, **labels)
+    metrics.inc('upse_llm_tokens_total', prompt_tokens, kind='prompt', **labels)
+    metrics.inc('upse_llm_tokens_total', completion_tokens, kind='completion', **labels)
+    metrics.inc('upse_llm_cost_usd_total', cost, model=model_name, **labels)
+
+    record = _current.get()
+    if record is not None:
+        record['llm_calls'] += 1
+        record['prompt_tokens'] += prompt_tokens
+        record['completion_tokens'] += completion_tokens
+        record['cost_usd'] += cost
+
+
+def record_abandoned_call(model_name: str, prompt_tokens: int):
+    """
+    Account a call given up before it replied (a losing hedge or a timeout)
+    to the running node. Its prompt was sent and is billed; the completion
+    tokens generated before it was dropped are unknown and not counted.
+    """
+    cost = estimate_cost(model_name, prompt_tokens, 0)
+
+    labels = _labels()
+    metrics.inc('upse_llm_abandoned_calls_total', model=model_name, **labels)
+    metrics.inc('upse_llm_tokens_total', prompt_tokens, kind='prompt', **labels)
+    metrics.inc('upse_llm_cost_usd_total', cost, model=model_name, **labels)
+
+    record = _current.get()
+    if record is not None:
+        record['prompt_tokens'] += prompt_tokens
+        record['cost_usd'] += cost
+
+
+def record_parse_attempt():
+    metrics.inc('upse_parse_attempts_total', **_labels())
+
+
+def record_parse_repair(repair: str):
+    metrics.inc('upse_parse_repairs_total', repair=repair, **_labels())
+    record = _current.get()
+    if record is not None:
+        record['parse_repairs'] += 1
+
+
+def parse_stats() -> dict:
+    """Process-wide parse success rate and repair counts."""
+    totals = {'attempts': 0.0, 'failures': 0.0, 'repairs': {}}
+    with metrics._lock:
+        counters = dict(metrics._counters)
+    for (name, labels), value in counters.items():
+        if name == 'upse_parse_attempts_total':
+            totals['attempts'] += value
+        elif name == 'upse_parse_failures_total':
+            totals['failures'] += value
+        elif name == 'upse_parse_repairs_total':
+            repair = dict(labels)['repair']
+            totals['repairs'][repair] = totals['repairs'].get(repair, 0) + value
+    attempts = totals['attempts']
+    totals['success_rate'] = (attempts - totals['failures']) / attempts if attempts else 1.0
+    return totals
+
+
+def record_parse_failure():
+    metrics.inc('upse_parse_failures_total', **_labels())
+    record = _current.get()
+    if record is not None:
+        record['parse_failures'] += 1
+
+
+def record_retry():
+    metrics.inc('upse_llm_retries_total', **_labels())
+    record = _current.get()
+    if record is not None:
+        record['retries'] += 1
+
+
+def _start_record(node: str, state) -> dict:
+    return {
+        'node': node,
+        'plan': state.get('plan', 'free'),
+        'iteration': state.get('iteration_count', 0),
+        'seconds': 0.0,
+        'llm_calls': 0,
+        'prompt_tokens': 0,
+        'completion_tokens': 0,
+        'cost_usd': 0.0,
+        'parse_failures': 0,
+        'parse_repairs': 0,
+        'retries': 0,
+    }
+
+
+def _finish_record(record: dict, start: float, update):
+    record['seconds'] = round(time.perf_counter() - start, 4)
+    record['cost_usd'] = round(record['cost_usd'], 8)
+    metrics.observe('upse_node_duration_seconds', record['seconds'],
+                    node=record['node'], plan=record['plan'], iteration=record['iteration'])
+    update = dict(update or {})
+    update['node_timings'] = [record]
+    return update
+
+
+def instrument_node(node: str, func):
+    """Wrap a graph node (sync or async) so it reports telemetry and appends its timing record."""
+    if inspect.iscoroutinefunction(func):
+        @functools.wraps(func)
+        async def wrapper(state):
+            record = _start_record(node, state)
+            token = _current.set(record)
+            start = time.perf_counter()
+            try:
+                update = await func(state)
+            finally:
+                _current.reset(token)
+            return _finish_record(record, start, update)
+    else:
+        @functools.wraps(func)
+        def wrapper(state):
+            record = _start_record(node, state)
+            token = _current.set(record)
+            start = time.perf_counter()
+            try:
+                update = func(state)
+            finally:
+                _current.reset(token)
+            return _finish_record(record, start, update)
+    return wrapper
+
+
+def summarize_timings(node_timings: list) -> list:
+    """Total seconds, model calls, tokens and cost per node across a run's timing records."""
+    totals = {}
+    for record in node_timings or []:
+        row = totals.setdefault(record['node'], {
+            'node': record['node'], 'runs': 0, 'seconds': 0.0, 'llm_calls': 0, 'prompt_tokens': 0,
+            'completion_tokens': 0, 'cost_usd': 0.0, 'parse_failures': 0, 'parse_repairs': 0, 'retries': 0,
+        })
+        row['runs'] += 1
+        for key in ('seconds', 'llm_calls', 'prompt_tokens', 'completion_tokens', 'cost_usd',
+                    'parse_failures', 'parse_repairs', 'retries'):
+            row[key] += record.get(key, 0)
+    for row in totals.values():
+        row['seconds'] = round(row['seconds'], 4)
+        row['cost_usd'] = round(row['cost_usd'], 8)
+    return sorted(totals.values(), key=lambda row: row['seconds'], reverse=True)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_response(404)
+            self.end_headers()
+            return
+        payload = metrics.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+
+def start_metrics_server(port: int = None, host: str = '0.0.0.0'):
+    """Serve /metrics on a background thread. Port defaults to UPSE_METRICS_PORT; returns None if unset."""
+    port = port if port is not None else int(os.getenv('UPSE_METRICS_PORT', '0') or 0)
+    if not port:
+        return None
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='upse-metrics', daemon=True).start()
+    return server
@@ -0,0 +1,237 @@
+# jobs.py
+"""
+Background execution of workflow runs.
+
+submit() queues a run and returns a job id straight away. The run itself
+executes on the shared event loop (see model_setup.event_loop), so a
+Streamlit session only polls for progress instead of holding its script
+thread for the whole run, and every session's runs share one pool of
+pooled HTTP connections. At most max_in_flight runs execute at once; the
+rest wait in submission order and are reported as queued.
+
+Each job keeps the (kind, node, payload) progress events of
+Backend.astream_progress. Synchronous callers read them with wait(),
+async callers with subscribe().
+
+A server that already runs its own event loop (the HTTP API) calls
+run_on() at startup so jobs run on that loop instead of a second one.
+"""
+import asyncio
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from model_setup import event_loop
+from instrumentation import metrics
+
+MAX_IN_FLIGHT = int(os.getenv("UPSE_MAX_JOBS", "8"))
+# Finished jobs kept for polling; the oldest are forgotten first
+MAX_FINISHED = int(os.getenv("UPSE_JOB_RETENTION", "500"))
+
+metrics.describe('upse_jobs_queued', 'gauge', "Submitted jobs waiting for a free slot")
+metrics.describe('upse_jobs_running', 'gauge', "Jobs currently running")
+metrics.describe('upse_jobs_total', 'counter', "Finished jobs, by outcome")
+metrics.describe('upse_job_queue_wait_seconds', 'histogram', "Time jobs spent queued before starting")
+
+
+class JobNotFound(KeyError):
+    """No job with this id, or it has been forgotten."""
+
+
+class Job:
+    """One submitted run: its status, progress events and final state."""
+
+    def __init__(self, job_id: str, state, config: dict = None, workflow=None, stream=None):
+        self.id = job_id
+        self.state = state
+        self.config = config
+        self.workflow = workflow
+        self.stream = stream
+        self.status = 'queued'
+        self.events = []
+        self.result = None
+        self.error = None
+        self.submitted_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.task = None
+        self.cancel_requested = False
+        self._cond = threading.Condition()
+        # (loop, asyncio.Event) of each waiting async subscriber, which may
+        # be on a different event loop than the job
+        self._waiters = set()
+
+    @property
+    def done(self) -> bool:
+        return self.status in ('done', 'failed', 'cancelled')
+
+    def _publish(self, event=None, status: str = None):
+        """Record an event and/or status change and wake every waiter (event loop thread only)."""
+        with self._cond:
+            if event is not None:
+                self.events.append(event)
+            if status is not None:
+                self.status = status
+            self._cond.notify_all()
+            waiters = list(self._waiters)
+        for loop, updated in waiters:
+            loop.call_soon_threadsafe(updated.set)
+
+    def wait(self, since: int = 0, timeout: float = None):
+        """
+        Block until there are events after index since or the job is done,
+        then return (status, those events). A 'done' status means every event
+        has been returned.
+        """
+        with self._cond:
+            self._cond.wait_for(lambda: len(self.events) > since or self.done, timeout)
+            return self.status, self.events[since:]
+
+    async def subscribe(self, since: int = 0):
+        """Yield the job's events from index since onward as they arrive, until it is done."""
+        waiter = (asyncio.get_running_loop(), asyncio.Event())
+        try:
+            while True:
+                with self._cond:
+                    waiter[1].clear()
+                    self._waiters.add(waiter)
+                    events, done = self.events[since:], self.done
+                for event in events:
+                    yield event
+                since += len(events)
+                if done:
+                    return
+                await waiter[1].wait()
+        finally:
+            with self._cond:
+                self._waiters.discard(waiter)
+
+    def summary(self) -> dict:
+        return {
+            'id': self.id,
+            'status': self.status,
+            'events': len(self.events),
+            'error': self.error,
+            'submitted_at': self.submitted_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+        }
+
+
+class JobRunner:
+    """Runs submitted workflow runs on the shared event loop, max_in_flight at a time."""
+
+    def __init__(self, max_in_flight: int = MAX_IN_FLIGHT, max_finished: int = MAX_FINISHED):
+        self.max_in_flight = max_in_flight
+        self.max_finished = max_finished
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+        self._slots = None
+        self._loop = None
+
+    def run_on(self, loop, max_in_flight: int = None):
+        """Run jobs on loop instead of the shared background loop; only before the first job."""
+        if self._slots is not None:
+            raise RuntimeError("jobs have already run on another event loop")
+        self._loop = loop
+        if max_in_flight is not None:
+            self.max_in_flight = max_in_flight
+
+    def loop(self):
+        return self._loop or event_loop()
+
+    def submit(self, state, config: dict = None, workflow=None, stream=None) -> str:
+        """
+        Queue a run and return its job id; safe to call from any thread.
+        Pass state=None with a checkpoint config to resume a run. stream
+        defaults to Backend.astream_progress.
+        """
+        job = Job(uuid.uuid4().hex, state, config, workflow, stream)
+        with self._lock:
+            self._jobs[job.id] = job
+        asyncio.run_coroutine_threadsafe(self._run(job), self.loop())
+        return job.id
+
+    async def _run(self, job: Job):
+        job.task = asyncio.current_task()
+        if self._slots is None:
+            # Created on the event loop it is used from
+            self._slots = asyncio.Semaphore(self.max_in_flight)
+        try:
+            if job.cancel_requested:
+                raise asyncio.CancelledError()
+            async with self._slots:
+                job.started_at = time.time()
+                metrics.observe('upse_job_queue_wait_seconds', job.started_at - job.submitted_at)
+                job._publish(status='running')
+                stream = job.stream
+                if stream is None:
+                    from Backend import astream_progress as stream
+                async for event in stream(job.state, job.config, job.workflow):
+                    kind, _, payload = event
+                    if kind == 'done':
+                        job.result = payload
+                    job._publish(event)
+        except asyncio.CancelledError:
+            job.finished_at = time.time()
+            job._publish(status='cancelled')
+            metrics.inc('upse_jobs_total', outcome='cancelled')
+            raise
+        except Exception as e:
+            job.error = f"{type(e).__name__}: {e}"
+            job.finished_at = time.time()
+            job._publish(status='failed')
+            metrics.inc('upse_jobs_total', outcome='failed')
+        else:
+            job.finished_at = time.time()
+            job._publish(status='done')
+            metrics.inc('upse_jobs_total', outcome='done')
+        finally:
+            self._forget_finished()
+
+    def _forget_finished(self):
+        with self._lock:
+            finished = [job_id for job_id, job in self._jobs.items() if job.done]
+            for job_id in finished[:max(0, len(finished) - self.max_finished)]:
+                del self._jobs[job_id]
+
+    def get(self, job_id: str) -> Job:
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is None:
+            raise JobNotFound(job_id)
+        return job
+
+    def poll(self, job_id: str, since: int = 0, timeout: float = None):
+        """(status, new events) for a job, waiting up to timeout seconds for something new."""
+        return self.get(job_id).wait(since, timeout)
+
+    def cancel(self, job_id: str) -> bool:
+        """Cancel a queued or running job; False if it had already finished."""
+        job = self.get(job_id)
+        if job.done:
+            return False
+        job.cancel_requested = True
+        if job.task is not None:
+            self.loop().call_soon_threadsafe(job.task.cancel)
+        return True
+
+    def stats(self) -> dict:
+        """Queue length and in-flight count, for sizing instances."""
+        with self._lock:
+            statuses = [job.status for job in self._jobs.values()]
+        return {
+            'queued': statuses.count('queued'),
+            'running': statuses.count('running'),
+            'finished': sum(status in ('done', 'failed', 'cancelled') for status in statuses),
+            'max_in_flight': self.max_in_flight,
+        }
+
+
+runner = JobRunner()
+metrics.add_collector(lambda: {
+    ('upse_jobs_queued', ()): runner.stats()['queued'],
+    ('upse_jobs_running', ()): runner.stats()['running'],
+})
@@ -1,13 +1,141 @@
 # model_setup.py
+"""
+Model registry shared by every node.
+
+Models are created lazily, one per (base URL, model, temperature), and all
+models talking to the same base URL share one pooled HTTP client with
+keep-alive, HTTP/2 (when the h2 package is installed) and connection limits.
+The async client's connections belong to the event loop that opened them,
+so async clients and the models using them are kept per event loop.
+"""
 from dotenv import load_dotenv
+import asyncio
+import importlib.util
 import os
-from langchain_openai import ChatOpenAI
+import threading
+import weakref
 
 load_dotenv()  # load environment variables once here
 
-model = ChatOpenAI(
-    model_name="mistralai/mistral-7b-instruct",
-    openai_api_base="https://openrouter.ai/api/v1",
-    openai_api_key=os.getenv("OPENROUTER_API_KEY"),
-    temperature=0.7,
-)
+DEFAULT_MODEL = os.getenv("UPSE_MODEL", "mistralai/mistral-7b-instruct")
+DEFAULT_BASE_URL = os.getenv("OPENROUTER_BASE_URL", "https://openrouter.ai/api/v1")
+DEFAULT_TEMPERATURE = 0.7
+# Cost-aware cascade: evaluators start on the cheap model and only essays
+# scored close to their plan's threshold are re-scored on the strong one
+CHEAP_MODEL = os.getenv("UPSE_CHEAP_MODEL", DEFAULT_MODEL)
+STRONG_MODEL = os.getenv("UPSE_STRONG_MODEL", "mistralai/mixtral-8x22b-instruct")
+
+MAX_CONNECTIONS = int(os.getenv("UPSE_HTTP_MAX_CONNECTIONS", "100"))
+MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("UPSE_HTTP_MAX_KEEPALIVE", "20"))
+KEEPALIVE_EXPIRY_SECONDS = 60.0
+HTTP2 = importlib.util.find_spec("h2") is not None
+
+_registry_lock = threading.Lock()
+_sync_clients = {}
+# event loop -> {base_url: async client} and {(base_url, model, temperature): model}
+_async_clients = weakref.WeakKeyDictionary()
+_models = weakref.WeakKeyDictionary()
+_models_without_loop = {}
+
+
+def _client_options() -> dict:
+    import openai
+    from openai._constants import DEFAULT_CONNECTION_LIMITS
+
+    # Same Limits class the installed openai client is built on
+    limits = type(DEFAULT_CONNECTION_LIMITS)(
+        max_connections=MAX_CONNECTIONS,
+        max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=KEEPALIVE_EXPIRY_SECONDS,
+    )
+    return {'openai': openai, 'limits': limits, 'http2': HTTP2}
+
+
+def _sync_client(base_url: str):
+    client = _sync_clients.get(base_url)
+    if client is None:
+        options = _client_options()
+        client = options['openai'].DefaultHttpxClient(limits=options['limits'], http2=options['http2'])
+        _sync_clients[base_url] = client
+    return client
+
+
+def _async_client(base_url: str, loop):
+    clients = _async_clients.setdefault(loop, {})
+    client = clients.get(base_url)
+    if client is None:
+        options = _client_options()
+        client = options['openai'].DefaultAsyncHttpxClient(limits=options['limits'], http2=options['http2'])
+        clients[base_url] = client
+    return client
+
+
+def get_model(model_name: str = None, temperature: float = None, base_url: str = None):
+    """Return the shared chat model for this configuration, creating it on first use."""
+    model_name = model_name or DEFAULT_MODEL
+    temperature = DEFAULT_TEMPERATURE if temperature is None else temperature
+    base_url = base_url or DEFAULT_BASE_URL
+    key = (base_url, model_name, temperature)
+
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        loop = None
+
+    with _registry_lock:
+        models = _models.setdefault(loop, {}) if loop is not None else _models_without_loop
+        model = models.get(key)
+        if model is None:
+            from langchain_openai import ChatOpenAI
+
+            model = ChatOpenAI(
+                model_name=model_name,
+                openai_api_base=base_url,
+                openai_api_key=os.getenv("OPENROUTER_API_KEY"),
+                temperature=temperature,
+                stream_usage=True,
+                # Retries, timeouts and hedging are handled per call in resilience.py
+                max_retries=0,
+                http_client=_sync_client(base_url),
+                http_async_client=_async_client(base_url, loop) if loop is not None else None,
+            )
+            models[key] = model
+    return model
+
+
+async def warm_up(model_name: str = None, temperature: float = None):
+    """Create the default model on the shared event loop ahead of the first request."""
+    return get_model(model_name, temperature)
+
+
+def __getattr__(name):
+    # `from model_setup import model` keeps working, now lazily
+    if name == "model":
+        return get_model()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+# The async HTTP client keeps its pooled keep-alive connections on the event
+# loop that opened them, so every synchronous caller (the Streamlit scripts)
+# must run its coroutines on the same long-lived loop rather than asyncio.run.
+_loop = None
+_loop_lock = threading.Lock()
+
+
+def event_loop():
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name="upse-event-loop", daemon=True).start()
+    return _loop
+
+
+def run_async(coro):
+    """Run a coroutine on the shared event loop and wait for its result."""
+    return asyncio.run_coroutine_threadsafe(coro, event_loop()).result()
+
+
+def run_in_background(coro):
+    """Schedule a coroutine on the shared event loop without waiting for it."""
+    return asyncio.run_coroutine_threadsafe(coro, event_loop())
@@ -0,0 +1,160 @@
+# parsing.py
+"""
+Tolerant extraction of JSON objects from model replies.
+
+Small models wrap their JSON in prose, leave quotes unescaped inside string
+values, get cut off before the closing brace or drop a field entirely.
+extract_json scans for the first balanced object, repairs what it can and
+reports which repairs were needed, so callers can count them and ask the
+model again for only the fields that are still missing.
+"""
+import json
+import re
+
+_TRAILING_COMMA = re.compile(r',\s*([}\]])')
+_FEEDBACK_FIELD = re.compile(r'"feedback"\s*:\s*"((?:[^"\\]|\\.)*)', re.DOTALL)
+# The feedback value up to the quote that ends it: the one followed by the next
+# key or the closing brace, so stray quotes inside the text are kept
+_FEEDBACK_VALUE = re.compile(r'"feedback"\s*:\s*"(.*?)"\s*(?:,\s*"\w+"\s*:|\})', re.DOTALL)
+_SCORE_FIELD = re.compile(r'"score"\s*:\s*"?(-?\d+(?:\.\d+)?)')
+_NUMBER = re.compile(r'-?\d+(?:\.\d+)?')
+
+
+def _next_significant(text: str, index: int) -> str:
+    while index < len(text) and text[index].isspace():
+        index += 1
+    return text[index] if index < len(text) else ""
+
+
+def scan_object(text: str, start: int):
+    """
+    Walk the object opening at text[start] and return (candidate, end, closed).
+
+    A quote inside a string value that is not followed by , } or ] (or, for a
+    key, by :) is taken to be part of the text and escaped; raw newlines and
+    tabs inside strings become spaces. If the text ends before the object closes, open strings
+    and brackets are closed so the candidate can still be parsed.
+    """
+    out = []
+    closers = []
+    in_string = False
+    is_key = False
+    escaped = False
+    last_significant = ''
+    index = start
+    while index < len(text):
+        ch = text[index]
+        if in_string:
+            if escaped:
+                escaped = False
+                out.append(ch)
+            elif ch == '\\':
+                escaped = True
+                out.append(ch)
+            elif ch == '"':
+                terminators = (':', '') if is_key else (',', '}', ']', '')
+                if _next_significant(text, index + 1) in terminators:
+                    in_string = False
+                    last_significant = '"'
+                    out.append(ch)
+                else:
+                    out.append('\\"')
+            elif ch in '\r\n\t':
+                out.append(' ')
+            else:
+                out.append(ch)
+        elif ch == '"':
+            in_string = True
+            is_key = bool(closers) and closers[-1] == '}' and last_significant in ('{', ',')
+            out.append(ch)
+        elif ch in '{[':
+            closers.append('}' if ch == '{' else ']')
+            out.append(ch)
+        elif ch in '}]':
+            if closers:
+                closers.pop()
+            out.append(ch)
+            if not closers:
+                return ''.join(out), index + 1, True
+        else:
+            out.append(ch)
+        if not in_string and not ch.isspace() and ch != '"':
+            last_significant = ch
+        index += 1
+
+    if in_string:
+        out.append('"')
+    out.extend(reversed(closers))
+    return ''.join(out), len(text), False
+
+
+def coerce_score(value):
+    """Turn 8, "8.5", "8.5/10" or "Score: 7" into a float clamped to 0-10; None if there is no number."""
+    if isinstance(value, bool) or value is None:
+        return None
+    if isinstance(value, (int, float)):
+        score = float(value)
+    else:
+        match = _NUMBER.search(str(value))
+        if not match:
+            return None
+        score = float(match.group(0))
+    return min(10.0, max(0.0, score))
+
+
+def extract_json(raw_output: str):
+    """
+    Return (data, repairs) for the first JSON object in raw_output.
+    repairs lists what had to be tolerated: 'surrounding_text', 'syntax',
+    'truncated', 'fields_only'. Raises ValueError when nothing usable is found.
+    """
+    stripped = raw_output.strip()
+    if stripped.startswith('"'):
+        # The whole object was returned as a JSON-encoded string
+        try:
+            decoded = json.loads(stripped)
+        except json.JSONDecodeError:
+            decoded = None
+        if isinstance(decoded, str):
+            return extract_json(decoded)
+
+    start = raw_output.find('{')
+    if start == -1:
+        raise ValueError(f"No JSON object found in model output: {raw_output}")
+
+    repairs = []
+    candidate, end, closed = scan_object(raw_output, start)
+    original = raw_output[start:end]
+    if raw_output[:start].strip() or raw_output[end:].strip():
+        repairs.append('surrounding_text')
+    # Only a reply that stops before any closing brace was cut off; the scan
+    # also leaves open an object whose stray quotes it could not place
+    if not closed and '}' not in raw_output[start:]:
+        repairs.append('truncated')
+
+    data = None
+    for attempt_no, attempt in enumerate((candidate, _TRAILING_COMMA.sub(r'\1', candidate))):
+        try:
+            data = json.loads(attempt)
+            break
+        except json.JSONDecodeError:
+            continue
+
+    if data is None:
+        # Last resort: pull the known evaluator fields out of the reply
+        # individually, each from the raw text so one mangled field cannot
+        # take the other with it
+        data = {}
+        text = raw_output[start:]
+        feedback = _FEEDBACK_VALUE.search(text) or _FEEDBACK_FIELD.search(candidate)
+        score = _SCORE_FIELD.search(text)
+        if feedback:
+            data['feedback'] = feedback.group(1).replace('\\"', '"').strip()
+        if score:
+            data['score'] = float(score.group(1))
+        if not data:
+            raise ValueError(f"Invalid JSON in extracted string: {original}\nOriginal output: {raw_output}")
+        repairs.append('fields_only')
+    elif 'truncated' not in repairs and (attempt_no or candidate != original):
+        repairs.append('syntax')
+    return data, repairs
@@ -0,0 +1,105 @@
+# prescreen.py
+"""
+Local pre-screening of essays before any model call.
+
+extract_features measures a batch of essays in one pass with precompiled
+patterns: word, sentence and paragraph counts, lexical diversity,
+sentence-length variance, repeated word n-grams and Flesch reading ease.
+gate_failures applies the hard gates (empty, far too short, mostly
+duplicated text); an essay failing any of them gets instant feedback
+instead of an evaluation. length_note turns the word count into the
+"too short" remark the summary used to ask the model for.
+"""
+import os
+import re
+from collections import Counter
+
+MIN_WORDS = int(os.getenv("UPSE_MIN_WORDS", "50"))
+# Below this an essay is evaluated, but told it is too short to develop its ideas
+SHORT_ESSAY_WORDS = int(os.getenv("UPSE_SHORT_ESSAY_WORDS", "600"))
+TARGET_WORDS = (1000, 1200)
+# Word n-grams used to detect duplicated text, and the share of them that
+# may repeat an earlier one before the essay is rejected
+NGRAM = 5
+MAX_DUPLICATE_SHARE = 0.5
+
+_WORD = re.compile(r"[A-Za-z0-9]+(?:['’-][A-Za-z0-9]+)*")
+_SENTENCE_END = re.compile(r"[.!?]+(?=\s|$)")
+_PARAGRAPH_BREAK = re.compile(r"\n\s*\n")
+_VOWEL_GROUP = re.compile(r"[aeiouy]+")
+
+
+def _syllables(word: str) -> int:
+    groups = len(_VOWEL_GROUP.findall(word))
+    if word.endswith('e') and groups > 1 and not word.endswith('le'):
+        groups -= 1
+    return max(1, groups)
+
+
+def _features(essay: str) -> dict:
+    text = essay.strip()
+    words = [word.lower() for word in _WORD.findall(text)]
+    word_count = len(words)
+    paragraphs = [p for p in _PARAGRAPH_BREAK.split(text) if p.strip()]
+
+    sentence_lengths = []
+    for sentence in _SENTENCE_END.split(text):
+        length = len(_WORD.findall(sentence))
+        if length:
+            sentence_lengths.append(length)
+    sentence_count = len(sentence_lengths)
+    mean_length = word_count / sentence_count if sentence_count else 0.0
+    variance = (sum((length - mean_length) ** 2 for length in sentence_lengths) / sentence_count
+                if sentence_count else 0.0)
+
+    ngrams = Counter(zip(*(words[i:] for i in range(NGRAM))))
+    ngram_total = sum(ngrams.values())
+    repeated = sum(count - 1 for count in ngrams.values() if count > 1)
+    paragraph_counts = Counter(' '.join(p.split()).lower() for p in paragraphs)
+
+    if word_count and sentence_count:
+        syllables = sum(_syllables(word) for word in words)
+        reading_ease = 206.835 - 1.015 * mean_length - 84.6 * syllables / word_count
+    else:
+        reading_ease = 0.0
+
+    return {
+        'words': word_count,
+        'sentences': sentence_count,
+        'paragraphs': len(paragraphs),
+        'lexical_diversity': round(len(set(words)) / word_count, 4) if word_count else 0.0,
+        'mean_sentence_length': round(mean_length, 2),
+        'sentence_length_variance': round(variance, 2),
+        'repeated_ngram_share': round(repeated / ngram_total, 4) if ngram_total else 0.0,
+        'top_repeated_ngrams': [' '.join(gram) for gram, count in ngrams.most_common(3) if count > 1],
+        'duplicate_paragraphs': sum(count - 1 for count in paragraph_counts.values()),
+        'reading_ease': round(reading_ease, 1),
+    }
+
+
+def extract_features(essays) -> list:
+    """Features of each essay in a batch, in order."""
+    return [_features(essay or "") for essay in essays]
+
+
+def gate_failures(features: dict) -> list:
+    """Reasons an essay fails the hard gates; empty if it should be evaluated."""
+    if not features['words']:
+        return ["The essay is empty."]
+    failures = []
+    if features['words'] < MIN_WORDS:
+        failures.append(
+            f"The essay has only {features['words']} words; at least {MIN_WORDS} are needed for an evaluation."
+        )
+    if features['repeated_ngram_share'] > MAX_DUPLICATE_SHARE or (
+            features['paragraphs'] > 1 and features['duplicate_paragraphs'] >= features['paragraphs'] / 2):
+        failures.append("Most of the essay repeats the same text; please submit the essay once, without duplicated passages.")
+    return failures
+
+
+def length_note(features: dict) -> str:
+    """A remark on the essay's length when it is too short to develop its ideas, else ""."""
+    if features.get('words', 0) >= SHORT_ESSAY_WORDS:
+        return ""
+    return (f"At {features['words']} words the essay is too short to develop its ideas; "
+            f"UPSC essays usually run {TARGET_WORDS[0]:,}-{TARGET_WORDS[1]:,} words.")
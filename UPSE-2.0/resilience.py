@@ -0,0 +1,160 @@
+# resilience.py
+"""
+Timeouts, retries and hedging for model calls.
+
+call_resilient sends a call through a caller-supplied send(model, hedge)
+coroutine function, each attempt (and hedge) first waiting in admit() for
+the upstream rate limits, and:
+
+- gives up on an attempt after CALL_TIMEOUT seconds,
+- retries timeouts, connection errors, 429s and 5xx replies up to
+  MAX_RETRIES times with full-jitter exponential backoff,
+- hedges, when UPSE_HEDGING=1: once an attempt has run longer than the
+  observed p95 latency of that model, a duplicate is sent (to
+  FALLBACK_MODEL when one is set) and whichever answers first wins; the
+  other is cancelled. Hedging is off by default because every hedge is a
+  second billed call.
+
+An attempt that is cancelled or times out after its request went out is
+still accounted to the running node: its prompt tokens were sent and billed.
+
+Timeouts and latencies cover the upstream call only, not the time spent
+queued in admit(), so local queueing never triggers a timeout or a hedge.
+Latencies are tracked per model over a rolling window, and hedging only
+starts once MIN_LATENCY_SAMPLES calls have been observed, so a cold process
+does not double its traffic.
+"""
+import asyncio
+import os
+import random
+import threading
+import time
+from collections import deque
+
+from instrumentation import metrics, record_abandoned_call, record_retry
+
+CALL_TIMEOUT = float(os.getenv("UPSE_CALL_TIMEOUT", "60"))
+MAX_RETRIES = int(os.getenv("UPSE_MAX_RETRIES", "3"))
+BACKOFF_BASE = float(os.getenv("UPSE_BACKOFF_BASE", "0.5"))
+BACKOFF_MAX = float(os.getenv("UPSE_BACKOFF_MAX", "8"))
+HEDGING = os.getenv("UPSE_HEDGING", "0") not in ("0", "false", "")
+HEDGE_PERCENTILE = float(os.getenv("UPSE_HEDGE_PERCENTILE", "95"))
+FALLBACK_MODEL = os.getenv("UPSE_FALLBACK_MODEL") or None
+MIN_LATENCY_SAMPLES = 20
+LATENCY_WINDOW = 500
+
+# HTTP statuses worth retrying: timeout, conflict, rate limit, server errors
+RETRYABLE_STATUSES = {408, 409, 429, 500, 502, 503, 504}
+
+metrics.describe('upse_llm_timeouts_total', 'counter', "Model call attempts that timed out")
+metrics.describe('upse_llm_hedges_total', 'counter', "Hedged model calls, by whether the hedge won")
+
+
+class LatencyTracker:
+    """Rolling window of successful call latencies per model."""
+
+    def __init__(self, window: int = LATENCY_WINDOW):
+        self.window = window
+        self._samples = {}
+        self._lock = threading.Lock()
+
+    def observe(self, model_name: str, seconds: float):
+        with self._lock:
+            self._samples.setdefault(model_name, deque(maxlen=self.window)).append(seconds)
+
+    def percentile(self, model_name: str, pct: float):
+        """The pct-th percentile latency, or None until MIN_LATENCY_SAMPLES have been seen."""
+        with self._lock:
+            samples = sorted(self._samples.get(model_name, ()))
+        if len(samples) < MIN_LATENCY_SAMPLES:
+            return None
+        return samples[min(len(samples) - 1, int(pct / 100 * len(samples)))]
+
+
+latencies = LatencyTracker()
+
+
+def is_retryable(error: BaseException) -> bool:
+    if isinstance(error, (asyncio.TimeoutError, TimeoutError)):
+        return True
+    try:
+        import openai
+    except ImportError:
+        return False
+    if isinstance(error, (openai.APIConnectionError, openai.RateLimitError, openai.InternalServerError)):
+        return True
+    return isinstance(error, openai.APIStatusError) and error.status_code in RETRYABLE_STATUSES
+
+
+def backoff_delay(attempt: int) -> float:
+    """Full-jitter exponential backoff for the given retry (0-based)."""
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+
+
+async def _timed(send, model, hedge: bool, prompt_tokens: int, admit=None):
+    if admit is not None:
+        await admit()
+    start = time.perf_counter()
+    try:
+        response = await asyncio.wait_for(send(model, hedge), CALL_TIMEOUT)
+    except asyncio.TimeoutError:
+        metrics.inc('upse_llm_timeouts_total', model=model.model_name)
+        record_abandoned_call(model.model_name, prompt_tokens)
+        raise
+    except asyncio.CancelledError:
+        # The losing side of a hedge: dropped, but its prompt was already sent
+        record_abandoned_call(model.model_name, prompt_tokens)
+        raise
+    latencies.observe(model.model_name, time.perf_counter() - start)
+    return response, model
+
+
+async def _attempt(send, primary, fallback, admit, prompt_tokens):
+    """One attempt, hedged with a second call if the first runs past the p95 latency."""
+    if admit is not None:
+        # Admitted before the hedge timer starts
+        await admit()
+    first = asyncio.ensure_future(_timed(send, primary, False, prompt_tokens))
+    hedge_after = latencies.percentile(primary.model_name, HEDGE_PERCENTILE) if HEDGING else None
+    if hedge_after is None:
+        return await first
+
+    second = None
+    try:
+        done, _ = await asyncio.wait({first}, timeout=hedge_after)
+        if done:
+            return first.result()
+
+        second = asyncio.ensure_future(_timed(send, fallback or primary, True, prompt_tokens, admit))
+        pending = {first, second}
+        error = None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    metrics.inc('upse_llm_hedges_total', outcome='hedge_won' if task is second else 'primary_won')
+                    return task.result()
+                error = error or task.exception()
+        raise error
+    finally:
+        for task in (first, second):
+            if task is not None and not task.done():
+                task.cancel()
+
+
+async def call_resilient(send, primary, fallback=None, admit=None, prompt_tokens: int = 0):
+    """
+    Call send(model, hedge) with timeouts, retries and hedging; returns
+    (response, model that answered). hedge is True for duplicate calls, so
+    send can keep them out of the UI stream. admit, if given, is awaited
+    before every upstream call, outside its timeout and latency.
+    prompt_tokens is what an abandoned attempt is accounted as having cost.
+    """
+    for attempt in range(MAX_RETRIES + 1):
+        try:
+            return await _attempt(send, primary, fallback, admit, prompt_tokens)
+        except Exception as e:
+            if attempt == MAX_RETRIES or not is_retryable(e):
+                raise
+            record_retry()
+            await asyncio.sleep(backoff_delay(attempt))
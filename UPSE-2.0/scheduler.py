@@ -0,0 +1,199 @@
+# scheduler.py
+"""
+Plan-tier-aware admission control in front of every model call.
+
+All calls share two token buckets matched to the upstream limits: requests
+per minute and tokens per minute. A call is admitted as soon as both
+buckets can cover it and no call of the same or a higher tier is waiting
+ahead of it, so premium calls always go first, then basic, then free.
+
+Backpressure falls on the lower tiers first: each tier has a maximum queue
+length and a maximum wait, and a call that would exceed either raises
+UpstreamBusy instead of waiting. Queue wait is recorded per tier.
+
+The scheduler is shared by calls from any event loop (the Streamlit loop,
+batch runs); waiters are woken with call_soon_threadsafe.
+"""
+import asyncio
+import os
+import threading
+import time
+from collections import deque
+
+from instrumentation import metrics
+
+# 0 disables a limit
+REQUESTS_PER_MINUTE = float(os.getenv("UPSE_RATE_RPM", "200"))
+TOKENS_PER_MINUTE = float(os.getenv("UPSE_RATE_TPM", "200000"))
+
+# Highest priority first
+TIERS = ('premium', 'basic', 'free')
+
+# Tier -> (max queued calls, max seconds a call may wait); None is unbounded
+TIER_LIMITS = {
+    'premium': (None, None),
+    'basic': (int(os.getenv("UPSE_BASIC_MAX_QUEUE", "200")), float(os.getenv("UPSE_BASIC_MAX_WAIT", "120"))),
+    'free': (int(os.getenv("UPSE_FREE_MAX_QUEUE", "50")), float(os.getenv("UPSE_FREE_MAX_WAIT", "30"))),
+}
+
+metrics.describe('upse_scheduler_wait_seconds', 'histogram', "Time model calls waited for admission, by plan")
+metrics.describe('upse_scheduler_rejections_total', 'counter', "Model calls rejected by backpressure, by plan and reason")
+metrics.describe('upse_scheduler_queued', 'gauge', "Model calls waiting for admission, by plan")
+
+
+class UpstreamBusy(RuntimeError):
+    """A model call was rejected because its tier's queue is full or it waited too long."""
+
+
+class TokenBucket:
+    """Refills continuously at rate_per_minute up to one minute's worth; 0 means unlimited."""
+
+    def __init__(self, rate_per_minute: float):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = rate_per_minute
+        self.tokens = rate_per_minute
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, amount: float, now: float) -> float:
+        """Seconds until amount can be taken (0 if it can be taken now)."""
+        if not self.rate:
+            return 0.0
+        self._refill(now)
+        # A request larger than the whole bucket is let through once it is full
+        amount = min(amount, self.capacity)
+        return max(0.0, (amount - self.tokens) / self.rate)
+
+    def take(self, amount: float, now: float):
+        """Remove amount; the balance may go negative, delaying later calls."""
+        if self.rate:
+            self._refill(now)
+            self.tokens -= amount
+
+
+class _Waiter:
+    __slots__ = ('loop', 'event', 'tokens', 'enqueued_at')
+
+    def __init__(self, tokens: float):
+        self.loop = asyncio.get_running_loop()
+        self.event = asyncio.Event()
+        self.tokens = tokens
+        self.enqueued_at = time.monotonic()
+
+    def wake(self):
+        self.loop.call_soon_threadsafe(self.event.set)
+
+
+class Scheduler:
+    def __init__(self, requests_per_minute: float = REQUESTS_PER_MINUTE,
+                 tokens_per_minute: float = TOKENS_PER_MINUTE, tier_limits: dict = None):
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+        self.tier_limits = dict(TIER_LIMITS if tier_limits is None else tier_limits)
+        self._lock = threading.Lock()
+        self._queues = {tier: deque() for tier in TIERS}
+        self._waits = {tier: {'admitted': 0, 'rejected': 0, 'wait_seconds': 0.0, 'max_wait_seconds': 0.0}
+                       for tier in TIERS}
+
+    @staticmethod
+    def tier(plan: str) -> str:
+        return plan if plan in TIERS else 'free'
+
+    def _head(self):
+        for tier in TIERS:
+            if self._queues[tier]:
+                return self._queues[tier][0]
+        return None
+
+    def _reject(self, tier: str, reason: str, message: str):
+        self._waits[tier]['rejected'] += 1
+        metrics.inc('upse_scheduler_rejections_total', plan=tier, reason=reason)
+        raise UpstreamBusy(message)
+
+    def _remove(self, tier: str, waiter: _Waiter):
+        """Drop a waiter and, if it was at the head, wake the next one (caller holds the lock)."""
+        was_head = self._head() is waiter
+        try:
+            self._queues[tier].remove(waiter)
+        except ValueError:
+            return
+        if was_head:
+            head = self._head()
+            if head is not None:
+                head.wake()
+
+    async def acquire(self, plan: str, tokens: float):
+        """Wait until a call of this plan costing tokens may be sent; raises UpstreamBusy under backpressure."""
+        tier = self.tier(plan)
+        max_queue, max_wait = self.tier_limits.get(tier, (None, None))
+        waiter = _Waiter(tokens)
+        with self._lock:
+            if max_queue is not None and len(self._queues[tier]) >= max_queue:
+                self._reject(tier, 'queue_full', f"{tier} queue is full ({max_queue} calls waiting)")
+            self._queues[tier].append(waiter)
+
+        try:
+            while True:
+                now = time.monotonic()
+                with self._lock:
+                    waiter.event.clear()
+                    if self._head() is waiter:
+                        delay = max(self.requests.delay(1, now), self.tokens.delay(tokens, now))
+                        if delay <= 0:
+                            self.requests.take(1, now)
+                            self.tokens.take(tokens, now)
+                            self._remove(tier, waiter)
+                            break
+                    else:
+                        # Woken when it reaches the head of the queue
+                        delay = None
+                timeout = delay
+                if max_wait is not None:
+                    remaining = max_wait - (now - waiter.enqueued_at)
+                    if remaining <= 0:
+                        with self._lock:
+                            self._reject(tier, 'timeout', f"{tier} call waited more than {max_wait:.0f}s for the upstream limit")
+                    timeout = remaining if timeout is None else min(timeout, remaining)
+                try:
+                    await asyncio.wait_for(waiter.event.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+        except BaseException:
+            with self._lock:
+                self._remove(tier, waiter)
+            raise
+
+        waited = time.monotonic() - waiter.enqueued_at
+        with self._lock:
+            stats = self._waits[tier]
+            stats['admitted'] += 1
+            stats['wait_seconds'] += waited
+            stats['max_wait_seconds'] = max(stats['max_wait_seconds'], waited)
+        metrics.observe('upse_scheduler_wait_seconds', waited, plan=tier)
+        return waited
+
+    def charge(self, tokens: float):
+        """Debit tokens only known after the call (the completion) from the token bucket."""
+        with self._lock:
+            self.tokens.take(tokens, time.monotonic())
+
+    def stats(self) -> dict:
+        """Per tier: calls queued, admitted and rejected, and mean/max queue wait."""
+        with self._lock:
+            result = {}
+            for tier in TIERS:
+                stats = dict(self._waits[tier])
+                stats['queued'] = len(self._queues[tier])
+                stats['mean_wait_seconds'] = stats['wait_seconds'] / stats['admitted'] if stats['admitted'] else 0.0
+                result[tier] = stats
+        return result
+
+
+scheduler = Scheduler()
+metrics.add_collector(lambda: {
+    ('upse_scheduler_queued', (('plan', tier),)): stats['queued']
+    for tier, stats in scheduler.stats().items()
+})
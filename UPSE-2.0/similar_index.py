@@ -0,0 +1,170 @@
+# similar_index.py
+import hashlib
+import os
+import random
+import re
+import struct
+import threading
+import time
+
+from eval_cache import DATA_DIR, open_database
+
+_WORD = re.compile(r"[a-z0-9]+")
+
+# Signature length and LSH banding: 16 bands of 4 rows make essays with a
+# Jaccard similarity around 0.5 or more likely to share a bucket, and the
+# signatures of those candidates decide the actual match
+NUM_HASHES = 64
+BANDS = 16
+ROWS = NUM_HASHES // BANDS
+SHINGLE_WORDS = 5
+
+# Fixed seed: signatures are stored on disk and must not change between runs
+_XOR_MASKS = [random.Random(20240601 + i).getrandbits(64) for i in range(NUM_HASHES)]
+_SIGNATURE = struct.Struct(f"<{NUM_HASHES}Q")
+
+
+def _hash64(text: str) -> int:
+    return int.from_bytes(hashlib.blake2b(text.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+def minhash(essay: str) -> list:
+    """MinHash signature of the essay's word 5-gram shingles."""
+    words = _WORD.findall(essay.lower())
+    if len(words) <= SHINGLE_WORDS:
+        shingles = {" ".join(words)}
+    else:
+        shingles = {" ".join(words[i:i + SHINGLE_WORDS]) for i in range(len(words) - SHINGLE_WORDS + 1)}
+    hashes = [_hash64(shingle) for shingle in shingles]
+    return [min(h ^ mask for h in hashes) for mask in _XOR_MASKS]
+
+
+def similarity(a: list, b: list) -> float:
+    """Estimated Jaccard similarity of two signatures."""
+    return sum(x == y for x, y in zip(a, b)) / NUM_HASHES
+
+
+def _bands(signature: list) -> list:
+    buckets = []
+    for band in range(BANDS):
+        rows = signature[band * ROWS:(band + 1) * ROWS]
+        digest = hashlib.blake2b(struct.pack(f"<{ROWS}Q", *rows), digest_size=8).digest()
+        # SQLite integers are signed 64-bit
+        buckets.append(int.from_bytes(digest, "little", signed=True))
+    return buckets
+
+
+class SimilarityIndex:
+    """
+    MinHash/LSH index over previously evaluated essays, so a resubmission
+    with a few words changed can reuse the earlier evaluation.
+
+    Signatures, LSH band buckets and the stored evaluations live in a local
+    SQLite file read through memory-mapped I/O; a lookup is one indexed
+    query over the essay's band buckets plus a signature comparison for
+    each candidate. kind namespaces entries (prompt version, evaluation
+    mode) so evaluations of different prompts are never mixed. Once the
+    index grows past max_entries the oldest essays are dropped.
+    """
+
+    def __init__(self, path: str, threshold: float = 0.9, max_entries: int = 500_000,
+                 mmap_bytes: int = 256 * 1024 * 1024):
+        self.path = path
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.matches = 0
+        self.lookups = 0
+        self.mmap_bytes = mmap_bytes
+        self._lock = threading.Lock()
+        self._conn = None
+        self._entries = 0
+
+    def _db(self):
+        """The SQLite connection, opened on first use so importing never creates the file (caller holds the lock)."""
+        if self._conn is None:
+            conn = open_database(self.path)
+            conn.execute(f"PRAGMA mmap_size = {int(self.mmap_bytes)}")
+            conn.execute("PRAGMA journal_mode = WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS essays ("
+                " id INTEGER PRIMARY KEY,"
+                " kind TEXT NOT NULL,"
+                " signature BLOB NOT NULL,"
+                " result TEXT NOT NULL,"
+                " created_at REAL NOT NULL)"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS buckets ("
+                " bucket INTEGER NOT NULL,"
+                " essay_id INTEGER NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS buckets_bucket ON buckets (bucket)")
+            conn.execute("CREATE INDEX IF NOT EXISTS buckets_essay ON buckets (essay_id)")
+            conn.commit()
+            self._entries = conn.execute("SELECT COUNT(*) FROM essays").fetchone()[0]
+            self._conn = conn
+        return self._conn
+
+    @staticmethod
+    def _band_keys(signature: list) -> list:
+        # The band number is folded into the key so equal rows in different bands don't collide
+        return [hash_ ^ band for band, hash_ in enumerate(_bands(signature))]
+
+    def lookup(self, signature: list, kind: str):
+        """(stored result, similarity) of the most similar essay at or above the threshold, else None."""
+        keys = self._band_keys(signature)
+        with self._lock:
+            self.lookups += 1
+            rows = self._db().execute(
+                f"SELECT DISTINCT e.signature, e.result FROM buckets b JOIN essays e ON e.id = b.essay_id"
+                f" WHERE b.bucket IN ({','.join('?' * len(keys))}) AND e.kind = ?",
+                (*keys, kind),
+            ).fetchall()
+        best = None
+        for blob, result in rows:
+            score = similarity(signature, _SIGNATURE.unpack(blob))
+            if score >= self.threshold and (best is None or score > best[1]):
+                best = (result, score)
+        if best is not None:
+            with self._lock:
+                self.matches += 1
+        return best
+
+    def add(self, signature: list, kind: str, result: str):
+        now = time.time()
+        with self._lock:
+            cursor = self._db().execute(
+                "INSERT INTO essays (kind, signature, result, created_at) VALUES (?, ?, ?, ?)",
+                (kind, _SIGNATURE.pack(*signature), result, now),
+            )
+            self._db().executemany(
+                "INSERT INTO buckets (bucket, essay_id) VALUES (?, ?)",
+                [(key, cursor.lastrowid) for key in self._band_keys(signature)],
+            )
+            self._entries += 1
+            self._evict()
+            self._db().commit()
+
+    def _evict(self):
+        overflow = self._entries - self.max_entries
+        if overflow > 0:
+            oldest = "SELECT id FROM essays ORDER BY id ASC LIMIT ?"
+            self._db().execute(f"DELETE FROM buckets WHERE essay_id IN ({oldest})", (overflow,))
+            self._db().execute(f"DELETE FROM essays WHERE id IN ({oldest})", (overflow,))
+            self._entries -= overflow
+
+    def stats(self) -> dict:
+        return {
+            'entries': self._entries,
+            'lookups': self.lookups,
+            'matches': self.matches,
+            'match_rate': self.matches / self.lookups if self.lookups else 0.0,
+            'threshold': self.threshold,
+        }
+
+
+similar_essays = SimilarityIndex(
+    os.getenv("UPSE_SIMILAR_PATH", os.path.join(DATA_DIR, "upse_similar.sqlite3")),
+    threshold=float(os.getenv("UPSE_SIMILARITY_THRESHOLD", "0.9")),
+    max_entries=int(os.getenv("UPSE_SIMILAR_MAX_ENTRIES", "500000")),
+)
@@ -0,0 +1,144 @@
+# token_budget.py
+"""
+Token accounting for prompts built from earlier nodes' output.
+
+count_tokens uses tiktoken when it is installed and a chars/4 estimate
+otherwise. compress_feedback turns verbose evaluator feedback into a short,
+deduplicated bullet list of actionable issues, which downstream prompts use
+once the feedback goes over FEEDBACK_TOKEN_BUDGET. check_prompt measures a
+whole prompt against the model's context window before it is sent.
+split_sections cuts an essay too long to evaluate in one prompt into
+sections of at most SECTION_TOKENS.
+"""
+import math
+import os
+import re
+
+try:
+    import tiktoken
+    _encoding = tiktoken.get_encoding("cl100k_base")
+except Exception:  # tiktoken is optional
+    _encoding = None
+
+CONTEXT_WINDOW = int(os.getenv("UPSE_CONTEXT_WINDOW", "32768"))
+# Tokens kept free for the completion when checking a prompt
+COMPLETION_RESERVE = int(os.getenv("UPSE_COMPLETION_RESERVE", "2048"))
+# Total tokens of rubric feedback a prompt may carry before it is compressed
+FEEDBACK_TOKEN_BUDGET = int(os.getenv("UPSE_FEEDBACK_TOKEN_BUDGET", "600"))
+# Essays longer than this are evaluated section by section, each section
+# holding at most SECTION_TOKENS
+CHUNK_THRESHOLD_TOKENS = int(os.getenv("UPSE_CHUNK_THRESHOLD_TOKENS", "1500"))
+SECTION_TOKENS = int(os.getenv("UPSE_SECTION_TOKENS", "750"))
+
+# Issues that ask for a change are kept ahead of general remarks
+_ACTIONABLE = re.compile(
+    r"\b(lack|lacks|missing|needs?|should|must|avoid|improve|add|unclear|weak|vague|repetit\w*|"
+    r"without|error|errors|incorrect|inconsistent|abrupt|unsupported|shallow|overly|too)\b", re.IGNORECASE)
+_SPLIT = re.compile(r"(?<=[.!?;])\s+|\n+")
+_BULLET = re.compile(r"^\s*(?:[-*•]|\d+[.)]|(?:Paragraph|Section) \d+:)\s*", re.IGNORECASE)
+_WORD = re.compile(r"[a-z0-9']+")
+_PARAGRAPH_BREAK = re.compile(r"\n\s*\n")
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+# Issues sharing at least this share of their words are treated as duplicates
+DUPLICATE_OVERLAP = 0.7
+
+
+class PromptTooLong(ValueError):
+    """A prompt does not fit the model's context window."""
+
+
+def count_tokens(text: str) -> int:
+    if _encoding is not None:
+        return len(_encoding.encode(text, disallowed_special=()))
+    return math.ceil(len(text) / 4)
+
+
+def _issues(feedback: str):
+    for piece in _SPLIT.split(feedback or ""):
+        piece = _BULLET.sub("", piece).strip().rstrip(";,")
+        if len(piece) > 3:
+            yield piece
+
+
+def compress_feedback(feedback: str, budget: int) -> str:
+    """A deduplicated "- issue" list of at most budget tokens, actionable issues first."""
+    kept, seen = [], []
+    for issue in _issues(feedback):
+        words = set(_WORD.findall(issue.lower()))
+        if not words:
+            continue
+        if any(len(words & other) / min(len(words), len(other)) >= DUPLICATE_OVERLAP for other in seen):
+            continue
+        seen.append(words)
+        kept.append(issue)
+
+    # Stable sort: actionable issues first, otherwise in their original order
+    kept.sort(key=lambda issue: not _ACTIONABLE.search(issue))
+    lines, used = [], 0
+    for issue in kept:
+        line = f"- {issue}"
+        cost = count_tokens(line) + 1
+        if used + cost > budget:
+            break
+        lines.append(line)
+        used += cost
+    return "\n".join(lines)
+
+
+def fit_feedback(feedbacks: dict, budget: int = None) -> dict:
+    """
+    Return the rubric feedbacks unchanged if together they fit the budget,
+    otherwise with each one longer than an equal share of it compressed.
+    """
+    budget = FEEDBACK_TOKEN_BUDGET if budget is None else budget
+    if sum(count_tokens(text or "") for text in feedbacks.values()) <= budget:
+        return dict(feedbacks)
+    share = budget // max(1, len(feedbacks))
+    return {
+        name: compress_feedback(text, share) if count_tokens(text or "") > share else text
+        for name, text in feedbacks.items()
+    }
+
+
+def check_prompt(prompt: str) -> int:
+    """Token count of the prompt; raises PromptTooLong if it leaves no room for the completion."""
+    tokens = count_tokens(prompt)
+    if tokens + COMPLETION_RESERVE > CONTEXT_WINDOW:
+        raise PromptTooLong(
+            f"Prompt needs {tokens} tokens, leaving less than {COMPLETION_RESERVE} of the "
+            f"{CONTEXT_WINDOW}-token context window for the reply"
+        )
+    return tokens
+
+
+def _pack(pieces, max_tokens: int, separator: str) -> list:
+    """Join consecutive pieces into groups of at most max_tokens (a single larger piece stays whole)."""
+    groups, current, used = [], [], 0
+    for piece in pieces:
+        tokens = count_tokens(piece)
+        if current and used + tokens > max_tokens:
+            groups.append(separator.join(current))
+            current, used = [], 0
+        current.append(piece)
+        used += tokens
+    if current:
+        groups.append(separator.join(current))
+    return groups
+
+
+def split_sections(essay: str, max_tokens: int = None) -> list:
+    """
+    Consecutive sections of the essay of at most max_tokens each, cut at
+    paragraph breaks; a paragraph longer than that is cut between sentences.
+    """
+    max_tokens = SECTION_TOKENS if max_tokens is None else max_tokens
+    pieces = []
+    for paragraph in _PARAGRAPH_BREAK.split(essay):
+        paragraph = paragraph.strip()
+        if not paragraph:
+            continue
+        if count_tokens(paragraph) <= max_tokens:
+            pieces.append(paragraph)
+        else:
+            pieces.extend(_pack(_SENTENCE_END.split(paragraph), max_tokens, " "))
+    return _pack(pieces, max_tokens, "\n\n")
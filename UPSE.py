@@ -1,29 +1,34 @@
-from langgraph.graph import StateGraph, START, END
-from langchain_openai import ChatOpenAI
 from dotenv import load_dotenv
 from typing import TypedDict, List
 from typing_extensions import Annotated
 import operator
-import json
-import re
+import functools
 
 load_dotenv()
 import os 
-
-model = ChatOpenAI(
-    model_name="mistralai/mistral-7b-instruct",
-    openai_api_base="https://openrouter.ai/api/v1",
-    openai_api_key=os.getenv("OPENROUTER_API_KEY"),
-    temperature=0.7,
+import sys
+
+# The edit-script helpers, node telemetry, reply parsing, score_history
+# reducer, progress streaming and model clients are shared with the v2 app
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "UPSE-2.0"))
+import Backend
+from Backend import EDIT_SCRIPT_TAG, HEDGE_TAG, merge_scores, score_update
+from edits import apply_edits, number_sentences
+from instrumentation import (
+    instrument_node, record_llm_usage, record_parse_attempt, record_parse_failure, record_parse_repair,
 )
+# The model (UPSE_MODEL) and its pooled client (UPSE_HTTP_* limits) are kept
+# per event loop; synchronous callers share model_setup's long-lived loop
+from model_setup import event_loop, get_model, run_async, run_in_background
+from parsing import coerce_score, extract_json
+from resilience import call_resilient
+from token_budget import count_tokens
 
-from pydantic import BaseModel, Field
-
-class Schema(BaseModel):
-    feedback: str = Field(description="Detailed feedback for the essay")
-    score: float = Field(description="Score out of 10", ge=0, le=10)
 
-str_model = model.with_structured_output(Schema)
+async def warm_up():
+    """Build the model and compile the workflow ahead of the first request."""
+    get_model()
+    return get_workflow()
 
 
 class UPSEState(TypedDict):
@@ -32,33 +37,48 @@ class UPSEState(TypedDict):
     clarity_feedback: str
     overall_feedback: str
     analysis_feedback: str
-    individual_scores: Annotated[list[float], operator.add]
+    score_history: Annotated[list[list[float]], merge_scores]
     improved_essay: str
     max_iterations: int
     avg_score: float
     iteration_count: int
     threshold_score: float
-
-
-def json_string(raw_str):
-    cleaned = re.sub(r'[\x00-\x1F]+', ' ', raw_str)
-    return cleaned
-
-def llm_json(old_output):
-    if isinstance(old_output, str):
-        cleaned_output = json_string(old_output)  # sanitize control chars
-        try:
-            once = json.loads(cleaned_output)
-            if isinstance(once, str):
-                once = json.loads(once)
-            return once
-        except json.JSONDecodeError:
-            raise ValueError(f"Invalid JSON from model after sanitizing: {cleaned_output}")
-    return old_output
-
-
-
-def evaluate_language(state: UPSEState):
+    improve_mode: str
+    # One telemetry record per node run (see instrumentation.instrument_node)
+    node_timings: Annotated[List[dict], operator.add]
+
+
+def parse_evaluation(reply: str):
+    """
+    (feedback, score) from an evaluator reply, tolerating the prose, stray
+    quotes and truncation small models produce. A reply with no usable JSON
+    keeps its text as the feedback and reports no score for this iteration.
+    """
+    record_parse_attempt()
+    try:
+        data, repairs = extract_json(reply)
+    except ValueError:
+        record_parse_failure()
+        return reply.strip(), None
+    for repair in repairs:
+        record_parse_repair(repair)
+    if not isinstance(data, dict):
+        return reply.strip(), None
+    return str(data.get('feedback') or reply).strip(), coerce_score(data.get('score'))
+
+
+async def invoke_model(prompt, tags=None):
+    """Call the shared model with timeouts and retries and account the call to the running node."""
+    async def send(model, hedge):
+        call_tags = list(tags or []) + ([HEDGE_TAG] if hedge else [])
+        return await model.ainvoke(prompt, {'tags': call_tags} if call_tags else None)
+
+    response, model = await call_resilient(send, get_model(), prompt_tokens=count_tokens(prompt))
+    record_llm_usage(response, model.model_name)
+    return response
+
+
+async def evaluate_language(state: UPSEState):
     prompt = f"""You are a strict language quality evaluator.
     You have 20 + experience in checking UPSE exam (Largest and most important exam of India).
 Analyze the essay below ONLY for language quality — focusing on grammar, clarity, coherence, adherence to a formal tone, and vocabulary richness. Do NOT assess content accuracy or factual correctness.
@@ -87,12 +107,12 @@ Required JSON output format:
 }}
 """
 
-    output = llm_json(str_model.invoke(prompt))
-    return {'language_feedback': output.feedback, 'individual_scores': [output.score]}
+    feedback, score = parse_evaluation((await invoke_model(prompt)).content)
+    return {'language_feedback': feedback, 'score_history': score_update(state, language=score)}
 
 
 
-def evaluate_analysis(state: UPSEState):
+async def evaluate_analysis(state: UPSEState):
     prompt = f"""You are a strict evaluator of analytical depth in essays.
 You have 20 + experience in checking UPSE exam (Largest and most important exam of India).
  Assess ONLY the depth and quality of analysis, not language or grammar.
@@ -120,12 +140,12 @@ Required JSON output format:
 }}
 """
 
-    output = llm_json(str_model.invoke(prompt))
-    return {'analysis_feedback': output.feedback, 'individual_scores': [output.score]}
+    feedback, score = parse_evaluation((await invoke_model(prompt)).content)
+    return {'analysis_feedback': feedback, 'score_history': score_update(state, analysis=score)}
 
 
 
-def evaluate_COT(state: UPSEState):
+async def evaluate_COT(state: UPSEState):
     prompt = f"""You are a strict evaluator of clarity of thought in essays.
     Assess ONLY the logical flow, organization, and ease of understanding — do not evaluate grammar, vocabulary, or analytical depth.
     You have 20 + experience in checking UPSE exam (Largest and most important exam of India).
@@ -153,12 +173,12 @@ Required JSON output format:
 }}
 """
 
-    output = llm_json(str_model.invoke(prompt))
-    return {'clarity_feedback': output.feedback, 'individual_scores': [output.score]}
+    feedback, score = parse_evaluation((await invoke_model(prompt)).content)
+    return {'clarity_feedback': feedback, 'score_history': score_update(state, clarity=score)}
 
 
 # Function for final summary
-def final_evaluation(state: UPSEState):
+async def final_evaluation(state: UPSEState):
     prompt = f"""You are a summarization expert.
 Based on the three feedback sections below, produce a concise, integrated summary that captures the most important improvement points and strengths from all of them.
 
@@ -179,8 +199,12 @@ Instructions:
 5. Talk about majorly on mistakes .Dont apply butter .Stay forward .Finds mistakes in essay.
 6. Return ONLY the summarized feedback as plain text, without JSON, code fences, or additional commentary.
 """
-    overall_feedback = model.invoke(prompt).content
-    avg_score = sum(state['individual_scores']) / len(state['individual_scores']) if state['individual_scores'] else 0.0
+    overall_feedback = (await invoke_model(prompt)).content
+    # Average only this iteration's row of the history
+    history = state.get('score_history') or []
+    iteration = state.get('iteration_count', 0)
+    scores = [score for score in history[iteration] if score is not None] if iteration < len(history) else []
+    avg_score = sum(scores) / len(scores) if scores else 0.0
     return {'overall_feedback': overall_feedback, 'avg_score': avg_score}
 
 
@@ -205,7 +229,14 @@ def should_continue(state: UPSEState) -> str:
     
 
 
-def improve_essay(state: UPSEState):
+# How improve_essay changes the essay, unless the state sets improve_mode:
+#   'rewrite' - the model regenerates the whole essay
+#   'edits'   - the model returns a short edit script applied locally (see
+#               UPSE-2.0/edits.py), falling back to a full rewrite if it does not apply
+IMPROVE_MODE = 'rewrite'
+
+
+async def rewrite_essay(state: UPSEState) -> str:
     prompt = f"""You are an expert UPSC essay writer with mastery in formal, persuasive, and logically coherent writing.
 
 Task:
@@ -234,12 +265,52 @@ Output Instructions:
 Return ONLY the improved essay as plain text — no headings, notes, explanations, or JSON.
 """
 
-    improved = model.invoke(prompt).content
+    return (await invoke_model(prompt)).content
+
+
+async def edit_essay(state: UPSEState):
+    """Improve the essay with an edit script; None if the script could not be applied."""
+    prompt = f"""You are an expert UPSC essay editor with mastery in formal, persuasive, and logically coherent writing.
+
+Task:
+Improve the following essay by editing only the sentences that need it, to enhance:
+1. Clarity of thought (based on the provided feedback)
+2. Language quality (based on the provided feedback)
+3. Analytical depth (based on the provided feedback)
+
+Feedback for reference:
+- Clarity of Thought: {state["clarity_feedback"]}
+- Language Quality: {state["language_feedback"]}
+- Analytical Depth: {state["analysis_feedback"]}
+
+Essay to edit (each sentence is prefixed with its id; paragraphs are p1, p2, ...):
+{number_sentences(state["essay"])}
+
+Output Instructions:
+- "replace" and "delete" take a sentence id (p2.s3) or a paragraph id (p4).
+- "insert" adds a sentence after a sentence id, or a new paragraph after a paragraph id (p0 is the start).
+- Ids refer to the essay above. Preserve the original theme and key ideas.
+Return ONLY minified valid JSON:
+{{"edits":[{{"op":"replace","id":"p1.s2","text":"..."}},{{"op":"insert","after":"p2","text":"..."}},{{"op":"delete","id":"p3.s1"}}]}}
+"""
+    raw = (await invoke_model(prompt, tags=[EDIT_SCRIPT_TAG])).content
+    try:
+        # The first balanced object, so prose or a second object after it is ignored
+        script, _ = extract_json(raw)
+        return apply_edits(state["essay"], script.get("edits") if isinstance(script, dict) else script)
+    except ValueError as e:
+        print(f"Edit script rejected ({e}); falling back to a full rewrite")
+        return None
+
+
+async def improve_essay(state: UPSEState):
+    improved = await edit_essay(state) if state.get("improve_mode", IMPROVE_MODE) == 'edits' else None
+    if improved is None:
+        improved = await rewrite_essay(state)
     return {
         "essay": improved,
         "iteration_count": state.get("iteration_count", 0) + 1,
-       
-        "individual_scores": [],
+
         "language_feedback": "",
         "clarity_feedback": "",
         "analysis_feedback": "",
@@ -247,35 +318,71 @@ Return ONLY the improved essay as plain text — no headings, notes, explanation
     }
 
 
-graph = StateGraph(UPSEState)
+# The three evaluators are independent, so fan out to all of them at once
+# and join at final_evaluation once every one of them has reported.
+EVALUATORS = ['evaluate_COT', 'evaluate_analysis', 'evaluate_language']
 
-# Add all nodes
-graph.add_node('evaluate_COT', evaluate_COT)
-graph.add_node('evaluate_analysis', evaluate_analysis)
-graph.add_node('evaluate_language', evaluate_language)
-graph.add_node('final_evaluation', final_evaluation)
-graph.add_node('check_quality', check_quality)
-graph.add_node('improve_essay', improve_essay)
 
+def build_graph():
+    # langgraph is imported here rather than at module import so the UI can render first
+    from langgraph.graph import StateGraph, START, END
 
-graph.add_edge(START, 'evaluate_COT')
-graph.add_edge('evaluate_COT', 'evaluate_analysis')
-graph.add_edge('evaluate_analysis', 'evaluate_language')
-graph.add_edge('evaluate_language', 'final_evaluation')
-graph.add_edge('final_evaluation', 'check_quality')
+    graph = StateGraph(UPSEState)
 
-graph.add_conditional_edges(
-    'check_quality',
-    should_continue,  # This function determines the routing
-    {
-        "end": END,
-        "improve_essay": "improve_essay"
+    # Add all nodes
+    nodes = {
+        'evaluate_COT': evaluate_COT,
+        'evaluate_analysis': evaluate_analysis,
+        'evaluate_language': evaluate_language,
+        'final_evaluation': final_evaluation,
+        'check_quality': check_quality,
+        'improve_essay': improve_essay,
     }
-)
+    for name, node in nodes.items():
+        graph.add_node(name, instrument_node(name, node))
+
+    for evaluator in EVALUATORS:
+        graph.add_edge(START, evaluator)
+    graph.add_edge(EVALUATORS, 'final_evaluation')
+    graph.add_edge('final_evaluation', 'check_quality')
+
+    graph.add_conditional_edges(
+        'check_quality',
+        should_continue,  # This function determines the routing
+        {
+            "end": END,
+            "improve_essay": "improve_essay"
+        }
+    )
+
+    for evaluator in EVALUATORS:
+        graph.add_edge('improve_essay', evaluator)
+    return graph
+
+
+@functools.lru_cache(maxsize=None)
+def get_workflow():
+    """The compiled workflow, built on first use."""
+    return build_graph().compile()
+
+
+def __getattr__(name):
+    # Module-level graph/workflow are kept for existing callers, now built on first access
+    if name == 'graph':
+        return build_graph()
+    if name == 'workflow':
+        return get_workflow()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def astream_progress(state, config: dict = None):
+    """Backend.astream_progress over the v1 workflow: (kind, node, payload) progress events."""
+    return Backend.astream_progress(state, config, get_workflow())
 
-graph.add_edge('improve_essay', 'evaluate_COT')
 
-workflow = graph.compile()
+def stream_progress(state, config: dict = None):
+    """Synchronous wrapper around astream_progress for the Streamlit script thread."""
+    return Backend.stream_progress(state, config, get_workflow())
 
 
 # if __name__ == "__main__":
@@ -298,7 +405,7 @@ workflow = graph.compile()
 #         'clarity_feedback': "",
 #         'overall_feedback': "",
 #         'analysis_feedback': "",
-#         'individual_scores': [],
+#         'score_history': [],
 #         'improved_essay': "",
 #         'max_iterations': 3,
 #         'avg_score': 0.0,
@@ -308,7 +415,7 @@ workflow = graph.compile()
 
 #     try:
 #         print(" Starting UPSC Essay Evaluation Workflow...")
-#         output = workflow.invoke(initial_state)
+#         output = run_async(get_workflow().ainvoke(initial_state))
         
 #         print("\n" + "="*80)
 #         print(" FINAL RESULTS")
@@ -0,0 +1,331 @@
+# bench_workflow.py
+"""
+Reproducible performance benchmarks for the v1 (UPSE.py) and v2 (UPSE-2.0/Backend.py)
+workflows, run against the deterministic local stub LLM server.
+
+Reports per-node latency percentiles, end-to-end latency per plan tier,
+throughput at increasing concurrency, JSON parsing cost, graph overhead and
+import/compile time. Results are written as JSON and compared with a stored
+baseline; the exit code is 1 when any metric regressed beyond the tolerance.
+
+    python benchmarks/bench_workflow.py                     # run and compare
+    python benchmarks/bench_workflow.py --update-baseline   # accept current numbers
+
+CI (.github/workflows/ci.yml) runs the comparison on every push, with a
+wider tolerance for the slower hosted runners.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import timeit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+V2_DIR = os.path.join(ROOT, "UPSE-2.0")
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+
+sys.path.insert(0, ROOT)
+import stub_llm_server  # noqa: E402
+
+PLAN_ITERATIONS = {'free': 0, 'basic': 2, 'premium': 4}
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def summarize(values):
+    return {
+        'p50_s': round(percentile(values, 50), 4),
+        'p95_s': round(percentile(values, 95), 4),
+        'p99_s': round(percentile(values, 99), 4),
+    }
+
+
+def load_essays(count):
+    with open(os.path.join(ROOT, "output.txt"), encoding="utf-8") as f:
+        essay = f.read().strip()
+    # Vary the text so no two runs send identical prompts
+    return [f"Essay {i}.\n\n{essay}" for i in range(count)]
+
+
+def v1_state(essay, plan):
+    return {
+        'essay': essay, 'language_feedback': "", 'clarity_feedback': "", 'overall_feedback': "",
+        'analysis_feedback': "", 'score_history': [], 'improved_essay': "",
+        'max_iterations': PLAN_ITERATIONS[plan], 'avg_score': 0.0, 'iteration_count': 0,
+        'threshold_score': 9.0 if plan == 'premium' else 7.0,
+    }
+
+
+class Target:
+    """One workflow under test: how to import it and build its input state."""
+
+    def __init__(self, name):
+        self.name = name
+        if name == 'v1':
+            import UPSE
+            self.module = UPSE
+            self.workflow = UPSE.get_workflow()
+        else:
+            sys.path.insert(0, V2_DIR)
+            import Backend
+            self.module = Backend
+            # The checkpointer would keep every benchmark run in memory
+            self.workflow = Backend.get_workflow(checkpointed=False)
+
+    def state(self, essay, plan):
+        if self.name == 'v1':
+            return v1_state(essay, plan)
+        return self.module.initial_state(essay, plan)
+
+    def config(self, state):
+        if self.name == 'v1':
+            return None
+        return self.module.run_config(state)
+
+
+async def timed_run(target, state, node_durations=None):
+    """Run one workflow; optionally collect per-node wall times from the event stream."""
+    start = time.perf_counter()
+    if node_durations is None:
+        await target.workflow.ainvoke(state, target.config(state))
+        return time.perf_counter() - start
+
+    started = {}
+    async for event in target.workflow.astream_events(state, target.config(state), version='v2'):
+        node = event['metadata'].get('langgraph_node')
+        if event['name'] != node or len(event['parent_ids']) != 1:
+            continue
+        if event['event'] == 'on_chain_start':
+            started[event['run_id']] = time.perf_counter()
+        elif event['event'] == 'on_chain_end' and event['run_id'] in started:
+            node_durations.setdefault(node, []).append(time.perf_counter() - started.pop(event['run_id']))
+    return time.perf_counter() - start
+
+
+async def bench_nodes_and_tiers(target, runs):
+    node_durations = {}
+    tiers = {}
+    essays = load_essays(runs)
+    for plan in PLAN_ITERATIONS:
+        latencies = [await timed_run(target, target.state(essay, plan), node_durations) for essay in essays]
+        tiers[plan] = summarize(latencies)
+    return {node: summarize(values) for node, values in sorted(node_durations.items())}, tiers
+
+
+async def bench_throughput(target, levels, per_level):
+    results = {}
+    for concurrency in levels:
+        essays = load_essays(max(per_level, concurrency))
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def one(essay):
+            async with semaphore:
+                await timed_run(target, target.state(essay, 'basic'))
+
+        start = time.perf_counter()
+        await asyncio.gather(*(one(essay) for essay in essays))
+        results[f"c{concurrency}_essays_per_s"] = round(len(essays) / (time.perf_counter() - start), 3)
+    return results
+
+
+class InstantModel:
+    """In-process model with no I/O, used to isolate graph overhead from model latency."""
+    model_name = "instant"
+    temperature = 0.0
+
+    class Message:
+        def __init__(self, content):
+            self.content = content
+
+    async def ainvoke(self, prompt, *args, **kwargs):
+        if '{"edits":' in prompt:
+            return self.Message('{"edits":[{"op":"replace","id":"p1.s1","text":"Rewritten sentence."}]}')
+        if '"language":{' in prompt:
+            return self.Message(json.dumps({d: {"feedback": "ok", "score": 6.0} for d in ("language", "analysis", "clarity")}))
+        if '"feedback"' in prompt:
+            return self.Message('{"feedback":"ok","score":6.0}')
+        return self.Message("Rewritten essay.")
+
+
+async def bench_graph_overhead(target, runs):
+    module = target.module
+    saved = module.get_model
+    module.get_model = lambda *args, **kwargs: InstantModel()
+    try:
+        # Real essays, so the local pre-screen lets them through to the model nodes
+        latencies = [await timed_run(target, target.state(essay, 'premium')) for essay in load_essays(runs)]
+    finally:
+        module.get_model = saved
+    # The instant model scores every version the same, well under premium's
+    # threshold. v1 therefore runs all five rounds of evaluation. v2 stops on
+    # a plateau once premium's patience (two iterations) runs out, after three
+    # rounds. Either way, this is the per-run cost of the graph itself.
+    return {'premium_run_overhead': summarize(latencies)}
+
+
+def bench_parsing(target):
+    number = 2000
+    clean = '{"feedback":"The essay needs sharper structure and more evidence.","score":6.5}'
+    messy = "Here is the evaluation:\n" + clean + "\nI hope this helps!"
+    if target.name == 'v1':
+        func = target.module.parse_evaluation
+        cases = {'parse_evaluation_clean': clean, 'parse_evaluation_prose': messy}
+    else:
+        func = target.module.parse_json_response
+        cases = {'parse_json_response_clean': clean, 'parse_json_response_prose': messy}
+
+    results = {}
+    for name, payload in cases.items():
+        seconds = min(timeit.repeat(lambda: func(payload), number=number, repeat=5))
+        results[f"{name}_us"] = round(seconds / number * 1e6, 3)
+    return results
+
+
+def bench_import_and_compile(target, env):
+    """Cold-start cost in a fresh interpreter: the import alone, then import plus the first compiled workflow."""
+    if target.name == 'v1':
+        cwd, module = ROOT, "UPSE"
+    else:
+        cwd, module = V2_DIR, "Backend"
+    code = (f"import time; t = time.perf_counter(); import {module}; i = time.perf_counter() - t; "
+            f"{module}.get_workflow(); print(i, time.perf_counter() - t)")
+    imports, first_workflows = [], []
+    for _ in range(3):
+        out = subprocess.run([sys.executable, "-c", code], cwd=cwd, env=env, capture_output=True, text=True, check=True)
+        import_s, first_workflow_s = map(float, out.stdout.strip().splitlines()[-1].split())
+        imports.append(import_s)
+        first_workflows.append(first_workflow_s)
+
+    compile_seconds = min(timeit.repeat(lambda: target.module.build_graph().compile(), number=5, repeat=3)) / 5
+    return {'import_s': round(min(imports), 4), 'first_workflow_s': round(min(first_workflows), 4),
+            'compile_s': round(compile_seconds, 5)}
+
+
+async def run_target(name, args, env):
+    target = Target(name)
+    # Warm up connections and lazy imports so the first measured run isn't an outlier
+    await timed_run(target, target.state(load_essays(1)[0], 'free'))
+    nodes, tiers = await bench_nodes_and_tiers(target, args.runs)
+    return {
+        'nodes': nodes,
+        'tiers': tiers,
+        'throughput': await bench_throughput(target, args.concurrency, args.runs * 2),
+        'graph_overhead': await bench_graph_overhead(target, args.runs),
+        'parsing': bench_parsing(target),
+        'startup': bench_import_and_compile(target, env),
+    }
+
+
+def flatten(results, prefix=""):
+    flat = {}
+    for key, value in results.items():
+        name = f"{prefix}.{key}" if prefix else key
+        if isinstance(value, dict):
+            flat.update(flatten(value, name))
+        else:
+            flat[name] = value
+    return flat
+
+
+def compare(current, baseline, tolerance, min_delta_s=0.0):
+    """
+    Metrics ending in _per_s are higher-is-better; everything else is a time.
+    Times in seconds must also have grown by more than min_delta_s, so
+    sub-millisecond nodes do not fail on scheduling noise.
+    """
+    regressions = []
+    current_flat, baseline_flat = flatten(current), flatten(baseline)
+    for name, old in baseline_flat.items():
+        new = current_flat.get(name)
+        if new is None or not old:
+            continue
+        if name.endswith("_per_s"):
+            regressed = new < old * (1 - tolerance)
+        else:
+            regressed = new > old * (1 + tolerance)
+            if name.endswith("_s"):
+                regressed = regressed and new - old > min_delta_s
+        if regressed:
+            regressions.append(f"{name}: {old} -> {new}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the essay evaluation workflows.")
+    parser.add_argument('--targets', nargs='+', choices=['v1', 'v2'], default=['v1', 'v2'])
+    parser.add_argument('--runs', type=int, default=5, help="Essays per plan tier")
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 4, 16])
+    parser.add_argument('--latency-ms', type=float, default=20.0, help="Stub model median latency")
+    parser.add_argument('--tokens-per-second', type=float, default=2000.0, help="Stub model generation speed")
+    parser.add_argument('--output', default=os.path.join(ROOT, "bench_results.json"))
+    parser.add_argument('--baseline', default=BASELINE_PATH)
+    parser.add_argument('--tolerance', type=float, default=0.5, help="Allowed relative slowdown before failing")
+    parser.add_argument('--min-delta-ms', type=float, default=5.0,
+                        help="Slowdowns of a time in seconds smaller than this never fail")
+    parser.add_argument('--update-baseline', action='store_true')
+    args = parser.parse_args()
+
+    server = stub_llm_server.start_in_thread(latency_ms=args.latency_ms, latency_sigma=0.3,
+                                             tokens_per_second=args.tokens_per_second, seed=0)
+    env = dict(os.environ, OPENROUTER_BASE_URL=server.base_url, OPENROUTER_API_KEY="stub",
+               UPSE_CACHE_PATH=":memory:", UPSE_CACHE_MAX_ENTRIES="0",
+               # The benchmark essays are near-duplicates of each other; never reuse their evaluations
+               UPSE_SIMILAR_PATH=":memory:", UPSE_SIMILARITY_THRESHOLD="1.01",
+               # The stub has no rate limit; the scheduler's would make the numbers measure its refill rate
+               UPSE_RATE_RPM="0", UPSE_RATE_TPM="0")
+    os.environ.update(env)
+
+    results = {
+        'meta': {
+            'python': platform.python_version(),
+            'machine': platform.machine(),
+            'runs': args.runs,
+            'stub_latency_ms': args.latency_ms,
+            'stub_tokens_per_second': args.tokens_per_second,
+        },
+        'results': {},
+    }
+
+    async def run_all():
+        for name in args.targets:
+            results['results'][name] = await run_target(name, args, env)
+
+    asyncio.run(run_all())
+
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {args.output}")
+
+    if args.update_baseline:
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+        print(f"Baseline updated: {args.baseline}")
+        return
+
+    if not os.path.exists(args.baseline):
+        print("No baseline to compare against; run with --update-baseline to create one.")
+        return
+
+    with open(args.baseline, encoding='utf-8') as f:
+        baseline = json.load(f)
+    regressions = compare(results['results'], baseline['results'], args.tolerance, args.min_delta_ms / 1000)
+    if regressions:
+        print("Performance regressions:")
+        for line in regressions:
+            print(f"  {line}")
+        raise SystemExit(1)
+    print("No regressions against baseline.")
+
+
+if __name__ == "__main__":
+    main()
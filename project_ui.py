@@ -1,10 +1,20 @@
 import streamlit as st
-import json
-from UPSE import workflow 
+from UPSE import stream_progress, run_in_background, warm_up
+from instrumentation import summarize_timings
 from UPSE import UPSEState  
 
 st.set_page_config(page_title="UPSC Essay Evaluator", layout="wide")
 
+
+@st.cache_resource
+def warm_start():
+    # Build the pooled model client and compile the workflow once per process,
+    # in the background so the page renders without waiting for langgraph
+    return run_in_background(warm_up())
+
+
+warm_start()
+
 st.title("🖋️ UPSC Essay Evaluator & Improver")
 st.markdown("""
 This tool evaluates your UPSC essay on:
@@ -21,6 +31,49 @@ threshold_score = st.sidebar.slider("Quality Threshold (0-10)", 0.0, 10.0, 0.0,
 max_iterations = st.sidebar.number_input("Max Iterations", min_value=1, max_value=10, value=3)
 
 
+EVALUATOR_LABELS = {
+    'evaluate_language': "Language quality",
+    'evaluate_analysis': "Analytical depth",
+    'evaluate_COT': "Clarity of thought",
+}
+
+
+def run_with_progress(state):
+    """Run the workflow, showing node progress and streaming the summary and rewrite as they are generated."""
+    status = st.status("Running UPSC Essay Evaluation Workflow...", expanded=True)
+    summary_box = st.empty()
+    essay_box = st.empty()
+    streamed = {'final_evaluation': "", 'improve_essay': ""}
+    iteration = 0
+    output = None
+
+    for kind, node, payload in stream_progress(state):
+        if kind == 'token':
+            streamed[node] += payload
+            if node == 'final_evaluation':
+                summary_box.markdown(f"**📊 Summary (iteration {iteration})**\n\n{streamed[node]}")
+            else:
+                essay_box.markdown(f"**✍️ Rewriting (iteration {iteration + 1})**\n\n{streamed[node]}")
+        elif kind == 'node':
+            if node in EVALUATOR_LABELS:
+                scores = ", ".join(f"{score:.1f}" for score in payload['score_history']['scores'].values())
+                status.write(f"✅ {EVALUATOR_LABELS[node]} evaluated ({scores})")
+            elif node == 'final_evaluation':
+                status.write(f"📊 Iteration {iteration}: average score {payload['avg_score']:.2f}")
+            elif node == 'improve_essay':
+                iteration = payload['iteration_count']
+                status.write(f"✍️ Rewrite {iteration} finished")
+            if node in streamed:
+                streamed[node] = ""
+        else:
+            output = payload
+
+    summary_box.empty()
+    essay_box.empty()
+    status.update(label="✅ Workflow finished", state="complete", expanded=False)
+    return output
+
+
 # Essay input
 st.subheader("✏️ Paste Your Essay")
 essay_text = st.text_area(
@@ -35,23 +88,22 @@ if run_button:
     if not essay_text.strip():
         st.error("Please paste your essay before running evaluation.")
     else:
-        with st.spinner("Running UPSC Essay Evaluation Workflow..."):
-            initial_state: UPSEState = {
-                'essay': essay_text.strip(),
-                'language_feedback': "",
-                'clarity_feedback': "",
-                'overall_feedback': "",
-                'analysis_feedback': "",
-                'individual_scores': [],
-                'improved_essay': "",
-                'max_iterations': max_iterations,
-                'avg_score': 0.0,
-                'iteration_count': 0,
-                'threshold_score': threshold_score,
-            }
-
-            # Run workflow
-            output = workflow.invoke(initial_state)
+        initial_state: UPSEState = {
+            'essay': essay_text.strip(),
+            'language_feedback': "",
+            'clarity_feedback': "",
+            'overall_feedback': "",
+            'analysis_feedback': "",
+            'score_history': [],
+            'improved_essay': "",
+            'max_iterations': max_iterations,
+            'avg_score': 0.0,
+            'iteration_count': 0,
+            'threshold_score': threshold_score,
+        }
+
+        # Run workflow
+        output = run_with_progress(initial_state)
 
         # Show results
         st.success("✅ Evaluation Completed!")
@@ -74,3 +126,10 @@ if run_button:
             mime="text/plain"
         )
 
+        with st.expander("⏱️ Timing breakdown"):
+            timing_rows = summarize_timings(output.get('node_timings'))
+            st.dataframe(timing_rows, use_container_width=True)
+            st.caption(
+                f"Total node time: {sum(row['seconds'] for row in timing_rows):.2f}s · "
+                f"Model calls: {sum(row['llm_calls'] for row in timing_rows)}"
+            )
@@ -0,0 +1,255 @@
+# stub_llm_server.py
+"""
+Local stand-in for the OpenRouter chat-completions API, for load testing and
+profiling without spending money or hitting rate limits.
+
+Evaluator prompts (the ones asking for {"feedback": ..., "score": ...} JSON)
+get well-formed JSON back, edit-script prompts get a small edit list and
+rewrite and summary prompts get plain text.
+Latency, token throughput, error rate and malformed-JSON rate are
+configurable, and scores are derived from a hash of the prompt so repeated
+runs are reproducible.
+
+    python stub_llm_server.py --port 8001 --latency-ms 800 --tokens-per-second 60
+    OPENROUTER_BASE_URL=http://127.0.0.1:8001/v1 streamlit run project_ui.py
+"""
+import argparse
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class StubConfig:
+    def __init__(self, latency_ms=300.0, latency_sigma=0.5, tokens_per_second=0.0,
+                 error_rate=0.0, malformed_rate=0.0, seed=None):
+        # Time to first token is log-normally distributed around latency_ms
+        self.latency_ms = latency_ms
+        self.latency_sigma = latency_sigma
+        # 0 means the whole completion is sent at once after the first-token latency
+        self.tokens_per_second = tokens_per_second
+        self.error_rate = error_rate
+        self.malformed_rate = malformed_rate
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests = 0
+
+    def sample(self):
+        """Draw (latency seconds, fail?, malformed?) for one request."""
+        with self.lock:
+            self.requests += 1
+            latency = self.latency_ms / 1000 * self.random.lognormvariate(0, self.latency_sigma) if self.latency_ms else 0.0
+            return latency, self.random.random() < self.error_rate, self.random.random() < self.malformed_rate
+
+
+def count_tokens(text: str) -> int:
+    return max(1, len(text) // 4)
+
+
+def prompt_score(prompt: str, salt: str = "") -> float:
+    """Deterministic score between 4.0 and 9.0 for a prompt."""
+    digest = hashlib.sha256((salt + prompt).encode("utf-8")).digest()
+    return round(4.0 + digest[0] / 255 * 5.0, 1)
+
+
+def essay_from_prompt(prompt: str) -> str:
+    match = re.search(r"<essay>\n(.*?)\n</essay>", prompt, re.DOTALL) or re.search(
+        r"(?:Original essay|Essay to improve|Essay):\s*\n(.*?)\n\s*\n(?:Guidelines|Instructions)", prompt, re.DOTALL)
+    return match.group(1).strip() if match else ""
+
+
+def edit_script(prompt: str) -> str:
+    """Replace the first sentence and add a paragraph at the end of a numbered essay."""
+    ids = re.findall(r"^\[(p\d+)\.(s\d+)\] (.*)$", prompt, re.MULTILINE)
+    if not ids:
+        return json.dumps({"edits": []})
+    paragraph, sentence, text = ids[0]
+    return json.dumps({"edits": [
+        {"op": "replace", "id": f"{paragraph}.{sentence}", "text": text.rstrip(".") + ", as the evidence shows."},
+        {"op": "insert", "after": ids[-1][0], "text": "In conclusion, a balanced approach anchored in evidence serves the nation best."},
+    ]}, separators=(",", ":"))
+
+
+def completion_text(prompt: str, structured: bool) -> str:
+    if '{"edits":' in prompt:
+        return edit_script(prompt)
+    if '"language":{' in prompt:
+        return json.dumps({
+            dimension: {"feedback": f"Stub {dimension} feedback: tighten the argument and add examples.",
+                        "score": prompt_score(prompt, dimension)}
+            for dimension in ("language", "analysis", "clarity")
+        }, separators=(",", ":"))
+    if '{"score":' in prompt and '"feedback"' not in prompt:
+        return json.dumps({"score": prompt_score(prompt)}, separators=(",", ":"))
+    if structured or '"feedback"' in prompt:
+        return json.dumps({"feedback": "Stub feedback: the essay needs sharper structure and more evidence.",
+                           "score": prompt_score(prompt)}, separators=(",", ":"))
+    if "Rewrite" in prompt:
+        essay = essay_from_prompt(prompt) or "Stub essay."
+        return essay + "\n\nIn conclusion, a balanced approach anchored in evidence serves the nation best."
+    return ("The essay lacks supporting evidence and its transitions are abrupt. "
+            "Several claims are asserted without examples, and the conclusion repeats the introduction.")
+
+
+def malform(text: str, rnd: random.Random) -> str:
+    """Damage a JSON completion the way small models tend to."""
+    damage = rnd.choice(["prose", "truncate", "no_score", "quotes"])
+    if damage == "prose":
+        return "Here is the evaluation:\n" + text + "\nI hope this helps!"
+    if damage == "truncate":
+        return text[: max(1, len(text) - rnd.randint(2, 12))]
+    if damage == "no_score":
+        return re.sub(r',"score":[0-9.]+', "", text)
+    return text.replace("the essay", 'the "essay"', 1)
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    config: StubConfig = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, status: int, body: dict):
+        payload = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self):
+        if self.path.rstrip("/").endswith("/models"):
+            self.send_json(200, {"object": "list", "data": [{"id": "stub", "object": "model"}]})
+        else:
+            self.send_json(404, {"error": {"message": "not found"}})
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self.send_json(404, {"error": {"message": "not found"}})
+            return
+
+        latency, fail, malformed = self.config.sample()
+        time.sleep(latency)
+        if fail:
+            self.send_json(500, {"error": {"message": "stub injected failure", "type": "server_error"}})
+            return
+
+        prompt = "\n".join(str(m.get("content", "")) for m in body.get("messages", []))
+        tools = body.get("tools")
+        structured = bool(tools) or bool(body.get("response_format"))
+        text = completion_text(prompt, structured)
+        if malformed and text.startswith("{"):
+            with self.config.lock:
+                text = malform(text, self.config.random)
+
+        usage = {"prompt_tokens": count_tokens(prompt), "completion_tokens": count_tokens(text)}
+        usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+        model = body.get("model", "stub")
+
+        if tools:
+            # Structured output via function calling: answer with a tool call
+            message = {"role": "assistant", "content": None, "tool_calls": [{
+                "id": f"call_{uuid.uuid4().hex[:12]}", "type": "function",
+                "function": {"name": tools[0]["function"]["name"], "arguments": text},
+            }]}
+            self.pace(usage["completion_tokens"])
+            self.send_json(200, self.completion(model, message, "tool_calls", usage))
+        elif body.get("stream"):
+            self.stream(model, text, usage, include_usage=(body.get("stream_options") or {}).get("include_usage"))
+        else:
+            self.pace(usage["completion_tokens"])
+            self.send_json(200, self.completion(model, {"role": "assistant", "content": text}, "stop", usage))
+
+    def pace(self, tokens: int):
+        if self.config.tokens_per_second:
+            time.sleep(tokens / self.config.tokens_per_second)
+
+    @staticmethod
+    def completion(model, message, finish_reason, usage):
+        return {
+            "id": f"chatcmpl-{uuid.uuid4().hex}", "object": "chat.completion", "created": int(time.time()),
+            "model": model, "usage": usage,
+            "choices": [{"index": 0, "message": message, "finish_reason": finish_reason}],
+        }
+
+    def stream(self, model, text, usage, include_usage=False):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+
+        def send_event(data):
+            payload = f"data: {data}\n\n".encode("utf-8")
+            self.wfile.write(f"{len(payload):X}\r\n".encode() + payload + b"\r\n")
+            self.wfile.flush()
+
+        def chunk(delta, finish_reason=None, chunk_usage=None):
+            event = {"id": completion_id, "object": "chat.completion.chunk", "created": int(time.time()),
+                     "model": model, "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]}
+            if chunk_usage is not None:
+                event["choices"] = []
+                event["usage"] = chunk_usage
+            send_event(json.dumps(event))
+
+        chunk({"role": "assistant", "content": ""})
+        pieces = re.findall(r"\S+\s*|\s+", text)
+        delay = 1 / self.config.tokens_per_second if self.config.tokens_per_second else 0
+        for piece in pieces:
+            if delay:
+                time.sleep(delay * count_tokens(piece))
+            chunk({"content": piece})
+        chunk({}, finish_reason="stop")
+        if include_usage:
+            chunk(None, chunk_usage=usage)
+        send_event("[DONE]")
+        self.wfile.write(b"0\r\n\r\n")
+        self.wfile.flush()
+
+
+def make_server(host="127.0.0.1", port=8001, **options) -> ThreadingHTTPServer:
+    handler = type("ConfiguredStubHandler", (StubHandler,), {"config": StubConfig(**options)})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    server.base_url = f"http://{host}:{server.server_address[1]}/v1"
+    return server
+
+
+def start_in_thread(host="127.0.0.1", port=0, **options) -> ThreadingHTTPServer:
+    """Start a stub server on a background thread (port 0 picks a free port)."""
+    server = make_server(host, port, **options)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local OpenAI-compatible stub LLM server.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--latency-ms", type=float, default=300.0, help="Median time to first token")
+    parser.add_argument("--latency-sigma", type=float, default=0.5, help="Log-normal spread of the latency")
+    parser.add_argument("--tokens-per-second", type=float, default=0.0, help="Generation speed (0 = instant)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests answered with HTTP 500")
+    parser.add_argument("--malformed-rate", type=float, default=0.0, help="Fraction of JSON replies that are damaged")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    server = make_server(args.host, args.port, latency_ms=args.latency_ms, latency_sigma=args.latency_sigma,
+                         tokens_per_second=args.tokens_per_second, error_rate=args.error_rate,
+                         malformed_rate=args.malformed_rate, seed=args.seed)
+    print(f"Stub LLM server listening on {server.base_url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+import json
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# The v2 modules import each other by bare name, as the Streamlit app runs them;
+# the v1 app (UPSE.py) lives at the top level
+sys.path.insert(0, os.path.join(ROOT, "UPSE-2.0"))
+sys.path.append(ROOT)
+
+# Keep the tests' SQLite stores in memory and let the model clients build without a key
+os.environ.setdefault("UPSE_CACHE_PATH", ":memory:")
+os.environ.setdefault("UPSE_SIMILAR_PATH", ":memory:")
+os.environ.setdefault("OPENROUTER_API_KEY", "test")
+
+import Backend  # noqa: E402
+from eval_cache import EvalCache  # noqa: E402
+from instrumentation import current_plan  # noqa: E402
+from similar_index import SimilarityIndex  # noqa: E402
+
+
+ESSAY = """Economic growth in India has lifted millions out of poverty, yet the gains remain unevenly shared across regions and castes.
+
+Critics argue that fiscal incentives favour capital-intensive industry, while agriculture, which employs nearly half the workforce, stagnates.
+
+Courts have repeatedly intervened, from land acquisition disputes to environmental clearances, reshaping how projects balance speed against consent.
+
+Field studies from Bihar and Odisha suggest that rural employment guarantees raise wages modestly but struggle with delayed payments and leakage.
+
+A durable settlement therefore requires transparent budgets, stronger local institutions and honest measurement of who actually benefits from growth."""
+
+
+async def slow_improver(prompt, tags=None):
+    """Stand-in model: scores climb but stay just under the plan's threshold, so every iteration escalates and improves."""
+    if '"edits"' in prompt:
+        return "no edit script"
+    if "Rewrite the essay above" in prompt:
+        essay = prompt.split("<essay>\n", 1)[1].split("\n</essay>", 1)[0]
+        return "\n\n".join(f"{paragraph} revision" for paragraph in essay.split("\n\n"))
+    if "summarization expert" in prompt:
+        return "Summary."
+    threshold = min(Backend.plan_threshold(current_plan()), 10.0)
+    score = threshold - 0.45 + 0.08 * min(prompt.count("revision"), 4)
+    reply = {'feedback': "Needs work.", 'score': score}
+    return json.dumps({**reply, **{rubric: reply for rubric in Backend.RUBRICS}})
+
+
+@pytest.fixture
+def stand_in_model(monkeypatch):
+    # Fresh stores, so one test's answers are not reused by the next
+    async def reply(prompt, tags=None):
+        return await slow_improver(prompt), Backend.get_model(Backend._workflow_model.get()).model_name
+
+    monkeypatch.setattr(Backend, 'ask_model_reply', reply)
+    monkeypatch.setattr(Backend, 'cache', EvalCache(":memory:"))
+    monkeypatch.setattr(Backend, 'similar_essays', SimilarityIndex(":memory:"))
@@ -0,0 +1,206 @@
+import asyncio
+import json
+
+import pytest
+
+import api
+import Backend
+from conftest import ESSAY, slow_improver
+from jobs import JobRunner
+
+
+@pytest.fixture
+def fresh_api(monkeypatch, stand_in_model):
+    # The shared runner binds to the first event loop it runs on; each test has its own
+    monkeypatch.setattr(api, 'runner', JobRunner())
+    monkeypatch.setattr(api, '_started', False)
+
+
+@pytest.fixture
+def model_gate(monkeypatch, fresh_api):
+    """Model calls wait until the returned event is set."""
+    gate = asyncio.Event()
+
+    async def reply(prompt, tags=None):
+        await gate.wait()
+        return await slow_improver(prompt), Backend.get_model(Backend._workflow_model.get()).model_name
+
+    monkeypatch.setattr(Backend, 'ask_model_reply', reply)
+    return gate
+
+
+async def request(method, path, body=None, headers=(), disconnect=None):
+    """
+    Drive the ASGI app like a server would; returns (status, headers, body bytes).
+    The client disconnects once the disconnect event is set.
+    """
+    payload = b'' if body is None else json.dumps(body).encode('utf-8')
+    sent = []
+    requested = False
+
+    async def receive():
+        nonlocal requested
+        if not requested:
+            requested = True
+            return {'type': 'http.request', 'body': payload, 'more_body': False}
+        # Otherwise the client stays connected until the response is complete
+        await (disconnect or asyncio.Event()).wait()
+        return {'type': 'http.disconnect'}
+
+    async def send(message):
+        sent.append(message)
+
+    path, _, query = path.partition('?')
+    scope = {'type': 'http', 'method': method, 'path': path, 'query_string': query.encode(),
+             'headers': list(headers)}
+    await api.app(scope, receive, send)
+    start = sent[0]
+    return start['status'], dict(start['headers']), b''.join(m.get('body', b'') for m in sent[1:])
+
+
+def parse_events(body: bytes) -> list:
+    events = []
+    for block in body.decode('utf-8').split("\n\n"):
+        fields = dict(line.split(": ", 1) for line in block.splitlines() if line and not line.startswith(":"))
+        if fields:
+            events.append((fields['event'], json.loads(fields['data'])))
+    return events
+
+
+def test_submit_stream_and_fetch_result(fresh_api):
+    async def scenario():
+        status, _, body = await request('POST', '/v1/evaluations', {'essay': ESSAY, 'plan': 'basic'})
+        assert status == 202
+        job_id = json.loads(body)['job_id']
+
+        status, headers, body = await request('GET', f'/v1/evaluations/{job_id}/events')
+        assert status == 200
+        assert headers[b'content-type'].startswith(b'text/event-stream')
+        events = parse_events(body)
+        kinds = [kind for kind, _ in events]
+        assert kinds[-2:] == ['result', 'end']
+        assert {'prescreen', 'final_evaluation'} <= {data['node'] for kind, data in events if kind == 'node'}
+        assert events[-1][1]['status'] == 'done'
+
+        status, _, body = await request('GET', f'/v1/evaluations/{job_id}')
+        assert status == 200
+        view = json.loads(body)
+        assert view['status'] == 'done'
+        assert view['result'] == events[-2][1]
+
+        # A reconnecting client only gets the events after the last one it saw
+        status, _, body = await request('GET', f'/v1/evaluations/{job_id}/events',
+                                        headers=[(b'last-event-id', str(len(events) - 3).encode())])
+        assert [kind for kind, _ in parse_events(body)] == ['result', 'end']
+
+    asyncio.run(scenario())
+
+
+def test_unexpected_errors_return_500(fresh_api, monkeypatch):
+    def broken():
+        raise RuntimeError("scheduler unavailable")
+
+    monkeypatch.setattr(api.scheduler, 'stats', broken)
+
+    async def scenario():
+        status, _, body = await request('GET', '/healthz')
+        assert status == 500
+        assert json.loads(body) == {'error': "internal server error"}
+        status, _, _ = await request('GET', '/v1/evaluations/0123abcd')
+        assert status == 404
+
+    asyncio.run(scenario())
+
+
+def test_bulk_submission_rejects_invalid_essays_only(fresh_api):
+    async def scenario():
+        body = {'plan': 'free', 'essays': [
+            {'id': "ok", 'essay': ESSAY},
+            {'id': "empty", 'essay': " "},
+            {'id': "gold", 'essay': ESSAY, 'plan': "gold"},
+        ]}
+        status, _, response = await request('POST', '/v1/evaluations/bulk', body)
+        assert status == 202
+        response = json.loads(response)
+        assert (response['accepted'], response['rejected']) == (1, 2)
+        job_id = response['jobs'][0]['job_id']
+        await request('GET', f'/v1/evaluations/{job_id}/events')
+
+        status, _, batch = await request('GET', f"/v1/batches/{response['batch_id']}")
+        batch = json.loads(batch)
+        assert batch['counts'] == {'done': 1, 'rejected': 2}
+        assert [job['status'] for job in batch['jobs']] == ['done', 'rejected', 'rejected']
+
+    asyncio.run(scenario())
+
+
+def test_unknown_routes_and_methods(fresh_api):
+    async def scenario():
+        assert (await request('GET', '/v1/evaluations'))[0] == 405
+        assert (await request('PUT', '/v1/evaluations/0123abcd'))[0] == 405
+        assert (await request('GET', '/v2/evaluations'))[0] == 404
+
+    asyncio.run(scenario())
+
+
+@pytest.mark.parametrize("setting, value", [
+    ('max_iterations', 11),
+    ('max_iterations', 10 ** 9),
+    ('patience', 10 ** 9),
+    ('patience', -1),
+    ('threshold_score', 10.5),
+    ('min_improvement', "0.1"),
+    ('max_iterations', True),
+])
+def test_settings_out_of_range_are_rejected(fresh_api, setting, value):
+    async def scenario():
+        status, _, body = await request('POST', '/v1/evaluations', {'essay': ESSAY, 'plan': 'basic', setting: value})
+        assert status == 400
+        assert setting in json.loads(body)['error']
+        assert api.runner.stats()['queued'] == 0
+
+    asyncio.run(scenario())
+
+
+def test_disconnected_stream_is_cleaned_up(model_gate):
+    async def scenario():
+        _, _, body = await request('POST', '/v1/evaluations', {'essay': ESSAY})
+        job_id = json.loads(body)['job_id']
+        job = api.runner.get(job_id)
+        gone = asyncio.Event()
+        stream = asyncio.ensure_future(request('GET', f'/v1/evaluations/{job_id}/events', disconnect=gone))
+        while not job._waiters:
+            await asyncio.sleep(0.01)
+        assert api._open_streams == 1
+
+        gone.set()
+        status, _, _ = await stream
+        assert status == 200
+        assert api._open_streams == 0
+        assert not job._waiters
+        assert job.status == 'running'
+
+        _, _, body = await request('DELETE', f'/v1/evaluations/{job_id}')
+        assert json.loads(body)['cancelled']
+        while not job.done:
+            await asyncio.sleep(0.01)
+        assert job.status == 'cancelled'
+
+    asyncio.run(scenario())
+
+
+def test_many_concurrent_streams_see_every_event(model_gate):
+    async def scenario():
+        _, _, body = await request('POST', '/v1/evaluations', {'essay': ESSAY})
+        job_id = json.loads(body)['job_id']
+        streams = [asyncio.ensure_future(request('GET', f'/v1/evaluations/{job_id}/events')) for _ in range(400)]
+        while api._open_streams < len(streams):
+            await asyncio.sleep(0.01)
+        model_gate.set()
+
+        bodies = [body for _, _, body in await asyncio.gather(*streams)]
+        assert len(set(bodies)) == 1
+        assert [kind for kind, _ in parse_events(bodies[0])][-2:] == ['result', 'end']
+        assert api._open_streams == 0
+
+    asyncio.run(scenario())
@@ -0,0 +1,28 @@
+import asyncio
+import json
+from types import SimpleNamespace
+
+import batch
+from conftest import ESSAY
+
+
+def test_invalid_records_become_error_rows(tmp_path, stand_in_model):
+    source = tmp_path / "essays.jsonl"
+    source.write_text("\n".join([
+        json.dumps({'id': "good", 'essay': ESSAY}),
+        json.dumps({'id': "no-plan", 'essay': ESSAY, 'plan': "gold"}),
+        json.dumps({'id': "no-essay"}),
+        "{not json",
+    ]) + "\n", encoding='utf-8')
+    output = tmp_path / "results.jsonl"
+    args = SimpleNamespace(input=str(source), output=str(output), plan='free', concurrency=2,
+                           threshold=None, max_iterations=None)
+
+    failures = asyncio.run(batch.run_batch(args))
+
+    rows = {row['id']: row for row in map(json.loads, output.read_text(encoding='utf-8').splitlines())}
+    assert failures == 3
+    assert 'error' not in rows['good']
+    assert rows['no-plan']['error'] == "ValueError: unknown plan 'gold'"
+    assert rows['no-essay']['error'] == "ValueError: record has no essay text"
+    assert rows['line-4']['error'] == "ValueError: record has no essay text"
@@ -0,0 +1,66 @@
+import asyncio
+
+import pytest
+
+import Backend
+from conftest import ESSAY
+from edits import EditError, apply_edits, number_sentences, split_essay
+
+ESSAY_TEXT = "First point. Second point.\n\nA closing thought."
+
+
+def test_edits_apply_to_the_numbered_sentences():
+    edited = apply_edits(ESSAY_TEXT, [
+        {'op': 'replace', 'id': 'p1.s2', 'text': "A sharper second point."},
+        {'op': 'insert', 'after': 'p1.s1', 'text': "An example."},
+        {'op': 'insert', 'after': 'p0', 'text': "An opening paragraph."},
+        {'op': 'delete', 'id': 'p2.s1'},
+        {'op': 'insert', 'after': 'p2', 'text': "A new conclusion."},
+    ])
+    assert edited == ("An opening paragraph.\n\n"
+                      "First point. An example. A sharper second point.\n\n"
+                      "A new conclusion.")
+
+
+@pytest.mark.parametrize('edit', [
+    {'op': 'replace', 'id': 'p3.s1', 'text': "Nowhere."},
+    {'op': 'replace', 'id': 'p1.s3', 'text': "Nowhere."},
+    {'op': 'insert', 'after': 'the end', 'text': "Nowhere."},
+])
+def test_missing_anchor_is_rejected(edit):
+    with pytest.raises(EditError, match="Unknown edit anchor"):
+        apply_edits(ESSAY_TEXT, [edit])
+
+
+def test_missing_anchor_falls_back_to_a_rewrite(monkeypatch):
+    prompts = []
+
+    async def reply(prompt, tags=None):
+        prompts.append(prompt)
+        if '"edits"' in prompt:
+            return '{"edits":[{"op":"replace","id":"p9.s1","text":"Nowhere."}]}', "stand-in"
+        return "A full rewrite.", "stand-in"
+
+    monkeypatch.setattr(Backend, 'ask_model_reply', reply)
+    state = {'essay': ESSAY, 'plan': 'basic', 'improve_mode': 'edits', 'iteration_count': 0,
+             'language_feedback': "Tighten.", 'clarity_feedback': "Order.", 'analysis_feedback': "Evidence."}
+    update = asyncio.run(Backend.improve_essay(state))
+
+    assert update['essay'] == "A full rewrite."
+    assert len(prompts) == 2
+
+
+def test_abbreviations_and_initials_do_not_end_a_sentence():
+    essay = "Dr. Rao met Mr. A. P. J. Abdul Kalam in St. Louis. It cost Rs. 500 crore, e.g. for roads. Did it help?"
+    assert [sentence for sentence, _ in split_essay(essay)[0]] == [
+        "Dr. Rao met Mr. A. P. J. Abdul Kalam in St. Louis.",
+        "It cost Rs. 500 crore, e.g. for roads.",
+        "Did it help?",
+    ]
+    assert number_sentences("Dr. Rao agreed.\nThen he left.") == "[p1.s1] Dr. Rao agreed.\n[p1.s2] Then he left."
+
+
+def test_replacing_a_sentence_keeps_an_abbreviation_intact():
+    edited = apply_edits("Dr. Rao spoke first. The panel agreed.",
+                         [{'op': 'replace', 'id': 'p1.s2', 'text': "The panel disagreed."}])
+    assert edited == "Dr. Rao spoke first. The panel disagreed."
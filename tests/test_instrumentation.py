@@ -0,0 +1,18 @@
+import logging
+
+import instrumentation
+from model_setup import CHEAP_MODEL, STRONG_MODEL
+
+
+def test_cascade_models_are_priced():
+    for model in (CHEAP_MODEL, STRONG_MODEL):
+        assert instrumentation.estimate_cost(model, 1_000_000, 1_000_000) > 0
+
+
+def test_unpriced_model_warns_once(caplog):
+    with caplog.at_level(logging.WARNING, logger=instrumentation.__name__):
+        assert instrumentation.estimate_cost("acme/unknown-model", 1000, 1000) == 0.0
+        instrumentation.estimate_cost("acme/unknown-model", 1000, 1000)
+    assert [record.getMessage() for record in caplog.records] == [
+        "No price for model acme/unknown-model in MODEL_PRICES; its cost is reported as 0"
+    ]
@@ -0,0 +1,48 @@
+import asyncio
+
+import pytest
+
+import Backend
+from conftest import ESSAY
+
+
+@pytest.fixture
+def paragraph_calls(stand_in_model, monkeypatch):
+    calls = []
+    reply = Backend.ask_model_reply
+
+    async def counted(prompt, tags=None):
+        calls.append(Backend._workflow_model.get())
+        return await reply(prompt, tags)
+
+    monkeypatch.setattr(Backend, 'ask_model_reply', counted)
+    return calls
+
+
+def evaluate(essay, model_name, previous=None):
+    state = {'essay': essay, 'plan': 'premium', 'paragraph_results': previous or {}}
+    return asyncio.run(Backend.with_model(Backend.evaluate_paragraphs, model_name)(state))
+
+
+def test_only_changed_paragraphs_are_scored_again(paragraph_calls):
+    first = evaluate(ESSAY, Backend.CHEAP_MODEL)
+    assert first['paragraphs_reused'] == 0
+    assert len(paragraph_calls) == 5
+
+    revised = ESSAY.replace("honest measurement", "candid measurement")
+    second = evaluate(revised, Backend.CHEAP_MODEL, first['paragraph_results'])
+    assert second['paragraphs_reused'] == 4
+    assert len(paragraph_calls) == 6
+    assert len(second['paragraph_results']) == 5
+
+
+def test_paragraph_results_are_not_reused_across_models(paragraph_calls):
+    # An escalated iteration's strong-model scores must not stand in for the next cheap iteration's
+    strong = evaluate(ESSAY, Backend.STRONG_MODEL)
+    cheap = evaluate(ESSAY, Backend.CHEAP_MODEL, strong['paragraph_results'])
+    assert cheap['paragraphs_reused'] == 0
+    assert paragraph_calls == [Backend.STRONG_MODEL] * 5 + [Backend.CHEAP_MODEL] * 5
+
+    # ...and the cheap model's must not stand in for a cascade re-score
+    rescored = evaluate(ESSAY, Backend.STRONG_MODEL, cheap['paragraph_results'])
+    assert rescored['paragraphs_reused'] == 0
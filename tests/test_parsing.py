@@ -0,0 +1,65 @@
+import pytest
+
+from parsing import coerce_score, extract_json, scan_object
+
+
+def test_clean_object_needs_no_repairs():
+    assert extract_json('{"feedback":"Good.","score":7.5}') == ({'feedback': "Good.", 'score': 7.5}, [])
+
+
+def test_prose_around_the_object_is_ignored():
+    data, repairs = extract_json('Here you go:\n{"feedback":"Good.","score":7} Hope it helps {!}')
+    assert data == {'feedback': "Good.", 'score': 7}
+    assert repairs == ['surrounding_text']
+
+
+def test_unescaped_quotes_and_trailing_commas_are_repaired():
+    data, repairs = extract_json('{"feedback":"Use "active" voice.","score":6,}')
+    assert data == {'feedback': 'Use "active" voice.', 'score': 6}
+    assert repairs == ['syntax']
+
+
+def test_object_returned_as_a_json_string():
+    assert extract_json('"{\\"feedback\\":\\"Good.\\",\\"score\\":8}"') == ({'feedback': "Good.", 'score': 8}, [])
+
+
+def test_cut_off_reply_is_closed_and_tagged_truncated():
+    data, repairs = extract_json('{"feedback":"Sound argument but thin evid')
+    assert data == {'feedback': "Sound argument but thin evid"}
+    assert repairs == ['truncated']
+
+
+def test_fields_only_fallback_keeps_stray_quotes_and_the_score():
+    data, repairs = extract_json('{"feedback":"ok, "fine", good","score":6}')
+    assert data == {'feedback': 'ok, "fine", good', 'score': 6.0}
+    assert repairs == ['fields_only']
+
+
+def test_no_object_raises():
+    with pytest.raises(ValueError):
+        extract_json("I cannot evaluate this essay.")
+
+
+def test_scan_object_stops_at_the_balancing_brace():
+    text = '{"a":{"b":[1,2]}} trailing {"c":3}'
+    assert scan_object(text, 0) == ('{"a":{"b":[1,2]}}', 17, True)
+
+
+def test_scan_object_escapes_stray_quotes_and_closes_open_ones():
+    assert scan_object('{"k":"say "hi" now"}', 0) == ('{"k":"say \\"hi\\" now"}', 20, True)
+    assert scan_object('{"k":["x', 0) == ('{"k":["x"]}', 8, False)
+
+
+@pytest.mark.parametrize('value, expected', [
+    (8, 8.0),
+    ("8.5", 8.5),
+    ("8.5/10", 8.5),
+    ("Score: 7", 7.0),
+    (12, 10.0),
+    (-1, 0.0),
+    ("n/a", None),
+    (None, None),
+    (True, None),
+])
+def test_coerce_score(value, expected):
+    assert coerce_score(value) == expected
@@ -0,0 +1,106 @@
+import asyncio
+import json
+
+import pytest
+
+import Backend
+from conftest import ESSAY
+from prescreen import extract_features, gate_failures
+from similar_index import minhash
+
+
+async def no_model(prompt, tags=None):
+    raise AssertionError("an essay failing the pre-screen must not reach the model")
+
+
+@pytest.mark.parametrize("essay, reason", [
+    ("", "The essay is empty."),
+    ("Far too short to evaluate.", "at least"),
+    ("\n\n".join([ESSAY.split("\n\n")[0]] * 4), "repeats the same text"),
+])
+def test_failing_gate_ends_the_run_without_a_model_call(essay, reason, stand_in_model, monkeypatch):
+    monkeypatch.setattr(Backend, 'ask_model_reply', no_model)
+    state = Backend.initial_state(essay, 'premium')
+    workflow = Backend.get_workflow('premium', checkpointed=False)
+    output = asyncio.run(workflow.ainvoke(state, Backend.run_config(state)))
+
+    assert output['stop_reason'] == 'prescreen'
+    assert reason in output['overall_feedback']
+    assert output['avg_score'] == 0.0
+    assert output['iteration_count'] == 0
+    assert output['score_history'] == []
+
+
+def test_a_real_essay_passes_the_gates():
+    assert gate_failures(extract_features([ESSAY])[0]) == []
+
+
+OTHER_ESSAY = """Climate adaptation in coastal cities depends less on sea walls than on how land, water and housing are governed together.
+
+Mumbai's mangroves absorb storm surges more cheaply than concrete, yet they keep shrinking under pressure from real estate and weak enforcement.
+
+Insurance markets, early warning systems and relocation support all matter, but none of them works without accurate local flood maps.
+
+Adaptation finance should therefore reward municipalities that publish risk data, protect wetlands and plan housing away from the flood line."""
+
+
+def run_basic(essay, calls):
+    state = Backend.initial_state(essay, 'basic', max_iterations=0)
+    workflow = Backend.get_workflow('basic', checkpointed=False)
+    before = len(calls)
+    output = asyncio.run(workflow.ainvoke(state, Backend.run_config(state)))
+    return output, len(calls) - before
+
+
+@pytest.fixture
+def counted_calls(stand_in_model, monkeypatch):
+    calls = []
+    reply = Backend.ask_model_reply
+
+    async def counted(prompt, tags=None):
+        calls.append(prompt)
+        return await reply(prompt, tags)
+
+    monkeypatch.setattr(Backend, 'ask_model_reply', counted)
+    return calls
+
+
+def test_near_duplicate_reuses_the_evaluation(counted_calls):
+    first, first_calls = run_basic(ESSAY, counted_calls)
+    assert not first['similar_essay']
+
+    near_duplicate = ESSAY.replace("honest measurement", "candid measurement")
+    second, second_calls = run_basic(near_duplicate, counted_calls)
+    assert second['similar_essay']['similarity'] >= 0.9
+    assert second['score_history'][0] == first['score_history'][0]
+    assert second['language_feedback'] == first['language_feedback']
+    # The evaluators are skipped, and the summary of the same feedback is cached
+    assert first_calls > 0
+    assert second_calls == 0
+
+
+def test_different_essay_is_evaluated_afresh(counted_calls):
+    run_basic(ESSAY, counted_calls)
+    output, calls = run_basic(OTHER_ESSAY, counted_calls)
+    assert not output['similar_essay']
+    assert calls > 1
+
+
+def stored_scores(score):
+    return json.dumps({rubric: {'feedback': "Stored.", 'score': score} for rubric in Backend.RUBRICS})
+
+
+def test_cheap_model_scores_are_not_reused_where_the_cascade_would_escalate(stand_in_model):
+    signature = minhash(ESSAY)
+    basic = Backend.initial_state(ESSAY, 'basic')
+    free = Backend.initial_state(ESSAY, 'free')
+    # Free and basic evaluate in the same mode; 6.8 is within the cascade margin of basic's 7.0
+    assert Backend.eval_mode(basic) == Backend.eval_mode(free)
+    Backend.similar_essays.add(signature, Backend.similar_kind(free, Backend.CHEAP_MODEL), stored_scores(6.8))
+
+    assert Backend.find_similar(free, signature) is not None
+    assert Backend.find_similar(basic, signature) is None
+
+    Backend.similar_essays.add(signature, Backend.similar_kind(basic, Backend.STRONG_MODEL), stored_scores(6.9))
+    stored, _ = Backend.find_similar(basic, signature)
+    assert stored['language']['score'] == 6.9
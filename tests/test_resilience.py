@@ -0,0 +1,119 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+import Backend
+import instrumentation
+import resilience
+from eval_cache import EvalCache
+
+
+def run_call(send, admit, model_name):
+    return asyncio.run(resilience.call_resilient(send, SimpleNamespace(model_name=model_name), admit=admit))
+
+
+def test_queue_wait_is_not_part_of_the_call_timeout(monkeypatch):
+    monkeypatch.setattr(resilience, 'CALL_TIMEOUT', 0.2)
+    sends = []
+
+    async def admit():
+        await asyncio.sleep(0.3)
+
+    async def send(model, hedge):
+        sends.append(hedge)
+        return "reply"
+
+    response, _ = run_call(send, admit, "queued-model")
+    assert response == "reply"
+    assert sends == [False]
+    assert resilience.latencies._samples["queued-model"][-1] < 0.2
+
+
+def test_queue_wait_does_not_trigger_a_hedge(monkeypatch):
+    monkeypatch.setattr(resilience, 'HEDGING', True)
+    for _ in range(resilience.MIN_LATENCY_SAMPLES):
+        resilience.latencies.observe("hedged-model", 0.05)
+    sends = []
+
+    async def admit():
+        await asyncio.sleep(0.2)
+
+    async def send(model, hedge):
+        sends.append(hedge)
+        await asyncio.sleep(0.01)
+        return "reply"
+
+    run_call(send, admit, "hedged-model")
+    assert sends == [False]
+
+
+def test_fallback_answers_are_not_cached(monkeypatch):
+    monkeypatch.setattr(Backend, 'cache', EvalCache(":memory:"))
+    calls = []
+
+    async def fallback_reply(prompt, tags=None):
+        calls.append(prompt)
+        return '{"feedback": "ok", "score": 7}', "fallback-model"
+
+    monkeypatch.setattr(Backend, 'ask_model_reply', fallback_reply)
+    for _ in range(2):
+        asyncio.run(Backend.invoke_cached('evaluate_language', "prompt"))
+    assert len(calls) == 2
+
+
+def observe_latencies(model_name, seconds):
+    for _ in range(resilience.MIN_LATENCY_SAMPLES):
+        resilience.latencies.observe(model_name, seconds)
+
+
+def counter(name, **labels):
+    return sum(value for (metric, pairs), value in instrumentation.metrics._counters.items()
+               if metric == name and labels.items() <= dict(pairs).items())
+
+
+def test_hedging_is_off_by_default():
+    assert resilience.HEDGING is False
+    observe_latencies("unhedged-model", 0.01)
+    sends = []
+
+    async def send(model, hedge):
+        sends.append(hedge)
+        await asyncio.sleep(0.05)
+        return "reply"
+
+    run_call(send, None, "unhedged-model")
+    assert sends == [False]
+
+
+def test_losing_hedge_is_accounted(monkeypatch):
+    monkeypatch.setattr(resilience, 'HEDGING', True)
+    observe_latencies("slow-primary", 0.01)
+    before = counter('upse_llm_abandoned_calls_total', model="slow-primary")
+    tokens_before = counter('upse_llm_tokens_total', kind='prompt')
+
+    async def send(model, hedge):
+        # The primary stalls, so the hedge answers first and the primary is cancelled
+        await asyncio.sleep(0 if hedge else 5)
+        return "hedged reply"
+
+    async def call():
+        return await resilience.call_resilient(send, SimpleNamespace(model_name="slow-primary"), prompt_tokens=120)
+
+    response, _ = asyncio.run(call())
+    assert response == "hedged reply"
+    assert counter('upse_llm_abandoned_calls_total', model="slow-primary") == before + 1
+    assert counter('upse_llm_tokens_total', kind='prompt') == tokens_before + 120
+
+
+def test_timed_out_attempt_is_accounted(monkeypatch):
+    monkeypatch.setattr(resilience, 'CALL_TIMEOUT', 0.01)
+    monkeypatch.setattr(resilience, 'MAX_RETRIES', 0)
+    before = counter('upse_llm_abandoned_calls_total', model="stalled-model")
+
+    async def send(model, hedge):
+        await asyncio.sleep(1)
+
+    with pytest.raises(asyncio.TimeoutError):
+        asyncio.run(resilience.call_resilient(send, SimpleNamespace(model_name="stalled-model"), prompt_tokens=50))
+    assert counter('upse_llm_abandoned_calls_total', model="stalled-model") == before + 1
@@ -0,0 +1,65 @@
+import asyncio
+
+import pytest
+
+from scheduler import Scheduler, UpstreamBusy
+
+
+def drained(requests_per_minute, tier_limits=None):
+    """A scheduler whose request bucket is empty, so every call has to queue."""
+    scheduler = Scheduler(requests_per_minute, 0, tier_limits)
+    scheduler.requests.tokens = 0
+    return scheduler
+
+
+def test_premium_is_admitted_ahead_of_queued_free_calls():
+    # Ten requests a second: each call waits about 0.1s for the bucket
+    scheduler = drained(600, {'premium': (None, None), 'basic': (None, None), 'free': (None, None)})
+    admitted = []
+
+    async def call(name, plan):
+        await scheduler.acquire(plan, 10)
+        admitted.append(name)
+
+    async def run():
+        free = [asyncio.ensure_future(call(f"free{n}", 'free')) for n in (1, 2)]
+        await asyncio.sleep(0.01)
+        assert scheduler.stats()['free']['queued'] == 2
+        await asyncio.gather(*free, call("basic", 'basic'), call("premium", 'premium'))
+
+    asyncio.run(run())
+    assert admitted == ["premium", "basic", "free1", "free2"]
+
+
+def test_free_call_is_rejected_when_its_queue_is_full():
+    scheduler = drained(6, {'premium': (None, None), 'free': (1, None)})
+
+    async def run():
+        waiting = asyncio.ensure_future(scheduler.acquire('free', 10))
+        await asyncio.sleep(0.01)
+        with pytest.raises(UpstreamBusy, match="free queue is full"):
+            await scheduler.acquire('free', 10)
+        # Premium has no queue limit and is not affected by the free backlog
+        assert scheduler.stats()['premium']['rejected'] == 0
+        waiting.cancel()
+        await asyncio.gather(waiting, return_exceptions=True)
+
+    asyncio.run(run())
+    stats = scheduler.stats()['free']
+    assert stats['rejected'] == 1
+    assert stats['queued'] == 0
+
+
+def test_call_waiting_past_its_tier_max_wait_is_rejected():
+    # One request every ten seconds, and free calls may wait only 50ms
+    scheduler = drained(6, {'free': (None, 0.05)})
+
+    async def run():
+        with pytest.raises(UpstreamBusy, match="waited more than"):
+            await scheduler.acquire('free', 10)
+
+    asyncio.run(run())
+    stats = scheduler.stats()['free']
+    assert stats['rejected'] == 1
+    assert stats['admitted'] == 0
+    assert stats['queued'] == 0
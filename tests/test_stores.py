@@ -0,0 +1,29 @@
+import os
+
+from eval_cache import EvalCache
+from similar_index import SimilarityIndex, minhash
+
+
+def test_stores_open_their_files_on_first_use(tmp_path):
+    cache_path = tmp_path / "data" / "cache.sqlite3"
+    similar_path = tmp_path / "data" / "similar.sqlite3"
+    cache = EvalCache(str(cache_path))
+    index = SimilarityIndex(str(similar_path))
+    assert not os.path.exists(tmp_path / "data")
+
+    cache.set("key", "value")
+    assert cache.get("key") == "value"
+    index.add(minhash("an essay about rivers and the towns along them"), "essay", "{}")
+    assert cache_path.exists() and similar_path.exists()
+
+
+def test_cache_hits_are_written_in_batches():
+    cache = EvalCache(":memory:", max_entries=2, touch_batch=100)
+    cache.set("old", "1")
+    cache.set("new", "2")
+    # The hit is only recorded in memory, then written before the next insert evicts the LRU row
+    assert cache.get("old") == "1"
+    cache.set("newest", "3")
+    assert cache.get("new") is None
+    assert cache.get("old") == "1"
+    assert cache.stats()['entries'] == 2
@@ -0,0 +1,9 @@
+from token_budget import compress_feedback
+
+
+def test_compression_strips_paragraph_and_section_labels():
+    feedback = "Paragraph 2: Needs more evidence.\nSection 3: The conclusion is abrupt."
+    assert compress_feedback(feedback, 100).splitlines() == [
+        "- Needs more evidence.",
+        "- The conclusion is abrupt.",
+    ]
@@ -0,0 +1,106 @@
+import asyncio
+
+import UPSE
+from conftest import ESSAY
+from instrumentation import summarize_timings
+
+
+class CannedModel:
+    """In-process stand-in for the v1 model client."""
+    model_name = "canned"
+
+    class Message:
+        def __init__(self, content):
+            self.content = content
+
+    def __init__(self, evaluation='{"feedback":"Needs work.","score":5.0}', edit_script=None):
+        self.evaluation = evaluation
+        self.edit_script = edit_script
+
+    async def ainvoke(self, prompt, config=None):
+        if '{"edits":' in prompt:
+            return self.Message(self.edit_script)
+        if '"feedback"' in prompt:
+            return self.Message(self.evaluation)
+        return self.Message("Rewritten essay.")
+
+
+def initial_state(**overrides):
+    state = {
+        'essay': ESSAY, 'language_feedback': "", 'clarity_feedback': "", 'overall_feedback': "",
+        'analysis_feedback': "", 'score_history': [], 'improved_essay': "", 'max_iterations': 1,
+        'avg_score': 0.0, 'iteration_count': 0, 'threshold_score': 9.0,
+    }
+    state.update(overrides)
+    return state
+
+
+def test_v1_nodes_report_timings_and_model_calls(monkeypatch):
+    monkeypatch.setattr(UPSE, 'get_model', lambda: CannedModel())
+    output = asyncio.run(UPSE.get_workflow().ainvoke(initial_state()))
+
+    rows = {row['node']: row for row in summarize_timings(output['node_timings'])}
+    assert rows['evaluate_language']['runs'] == 2
+    assert rows['evaluate_language']['llm_calls'] == 2
+    assert rows['improve_essay']['llm_calls'] == 1
+    assert rows['check_quality']['llm_calls'] == 0
+    assert output['essay'] == "Rewritten essay."
+
+
+def test_v1_tolerates_malformed_evaluator_replies(monkeypatch):
+    # Prose around the object, an unescaped quote and a score given as text
+    reply = 'Here you go: {"feedback":"Use "active" voice.","score":"7/10"} Hope it helps'
+    monkeypatch.setattr(UPSE, 'get_model', lambda: CannedModel(reply))
+    output = asyncio.run(UPSE.get_workflow().ainvoke(initial_state(max_iterations=0)))
+
+    assert output['language_feedback'] == 'Use "active" voice.'
+    assert output['score_history'] == [[7.0, 7.0, 7.0]]
+    assert output['avg_score'] == 7.0
+
+
+def test_v1_reply_without_json_keeps_its_text_and_no_score(monkeypatch):
+    monkeypatch.setattr(UPSE, 'get_model', lambda: CannedModel("The essay is fine."))
+    output = asyncio.run(UPSE.get_workflow().ainvoke(initial_state(max_iterations=0)))
+
+    assert output['clarity_feedback'] == "The essay is fine."
+    assert output['score_history'] == [[None, None, None]]
+    assert output['avg_score'] == 0.0
+
+
+def test_v1_edit_script_is_read_from_the_first_object(monkeypatch):
+    # A trailing note with its own braces used to be swallowed into the script
+    script = ('{"edits":[{"op":"replace","id":"p1.s1","text":"A sharper opening."}]}'
+              ' Note: ids follow {pN.sM}.')
+    monkeypatch.setattr(UPSE, 'get_model', lambda: CannedModel(edit_script=script))
+    output = asyncio.run(UPSE.get_workflow().ainvoke(initial_state(improve_mode='edits')))
+
+    assert output['essay'].startswith("A sharper opening.")
+    assert output['essay'] != "Rewritten essay."
+
+
+def test_v1_edit_script_with_a_missing_id_falls_back_to_a_rewrite(monkeypatch):
+    script = '{"edits":[{"op":"replace","id":"p9.s1","text":"Nowhere."}]}'
+    monkeypatch.setattr(UPSE, 'get_model', lambda: CannedModel(edit_script=script))
+    output = asyncio.run(UPSE.get_workflow().ainvoke(initial_state(improve_mode='edits')))
+
+    assert output['essay'] == "Rewritten essay."
+
+
+def test_v1_uses_the_shared_model_registry_and_event_loop():
+    import model_setup
+
+    assert UPSE.get_model is model_setup.get_model
+    assert UPSE.run_async is model_setup.run_async
+    assert UPSE.run_async(asyncio.sleep(0, result="done")) == "done"
+
+
+def test_v1_streams_progress_through_the_shared_helper(monkeypatch):
+    monkeypatch.setattr(UPSE, 'get_model', lambda: CannedModel())
+    events = list(UPSE.stream_progress(initial_state()))
+
+    nodes = [node for kind, node, _ in events if kind == 'node']
+    assert nodes.count('improve_essay') == 1
+    assert nodes[-1] == 'check_quality'
+    kind, _, output = events[-1]
+    assert kind == 'done'
+    assert output['essay'] == "Rewritten essay."
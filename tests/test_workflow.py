@@ -0,0 +1,101 @@
+import asyncio
+import itertools
+import json
+
+import pytest
+from langgraph.errors import GraphRecursionError
+
+import Backend
+from conftest import ESSAY, slow_improver
+
+
+@pytest.mark.parametrize("plan, model_name, mode, checkpointed", list(itertools.product(
+    [None, *Backend.PLAN_EVAL_MODES],
+    [None, Backend.CHEAP_MODEL],
+    [None, *Backend.MODE_EVALUATORS],
+    [True, False],
+)))
+def test_every_workflow_variant_compiles(plan, model_name, mode, checkpointed):
+    workflow = Backend.get_workflow(plan, model_name=model_name, mode=mode, checkpointed=checkpointed)
+    nodes = set(workflow.get_graph().nodes)
+    assert {'prescreen', 'final_evaluation', 'check_quality', 'improve_essay'} <= nodes
+    assert ('cascade_check' in nodes) == (model_name is None)
+
+
+@pytest.mark.parametrize("plan", list(Backend.PLAN_EVAL_MODES))
+def test_longest_run_fits_recursion_limit(plan, stand_in_model):
+    state = Backend.initial_state(ESSAY, plan, min_improvement=0.0, patience=10)
+    workflow = Backend.get_workflow(plan, checkpointed=False)
+    output = asyncio.run(workflow.ainvoke(state, Backend.run_config(state)))
+    assert output['iteration_count'] == state['max_iterations']
+    if plan != 'free':
+        assert output['escalations'] == state['max_iterations'] + 1
+
+
+def test_default_recursion_limit_is_too_small_for_premium(stand_in_model):
+    state = Backend.initial_state(ESSAY, 'premium', min_improvement=0.0, patience=10)
+    workflow = Backend.get_workflow('premium', checkpointed=False)
+    with pytest.raises(GraphRecursionError):
+        asyncio.run(workflow.ainvoke(state, {'recursion_limit': 25}))
+
+
+def test_custom_threshold_stops_the_run_early(stand_in_model):
+    # The stand-in scores basic essays at 6.55, under the plan's 7.0 but over this run's 5.0
+    state = Backend.initial_state(ESSAY, 'basic', threshold_score=5.0)
+    workflow = Backend.get_workflow('basic', checkpointed=False)
+    output = asyncio.run(workflow.ainvoke(state, Backend.run_config(state)))
+    assert output['threshold_score'] == 5.0
+    assert output['stop_reason'] == 'threshold'
+    assert output['iteration_count'] == 0
+    assert not output['needs_improvements']
+    assert output['escalations'] == 0
+
+
+def test_checkpointer_keeps_only_recent_runs(stand_in_model, monkeypatch):
+    saver = Backend._bounded_saver(2)
+    monkeypatch.setattr(Backend, '_checkpointer', saver)
+    workflow = Backend.build_graph().compile(checkpointer=saver)
+
+    async def run(thread_id):
+        state = Backend.initial_state(ESSAY, 'basic')
+        await workflow.ainvoke(state, Backend.run_config(state, Backend.thread_config(thread_id)))
+
+    for thread_id in ("first", "second", "third"):
+        asyncio.run(run(thread_id))
+    assert set(saver.storage) == {"second", "third"}
+
+    Backend.forget_run("third")
+    assert set(saver.storage) == {"second"}
+    assert all(key[0] == "second" for key in [*saver.blobs, *saver.writes])
+
+
+def test_run_stops_when_scores_plateau(stand_in_model):
+    # The stand-in's scores rise by 0.08 an iteration, under premium's minimum improvement of 0.1
+    state = Backend.initial_state(ESSAY, 'premium')
+    workflow = Backend.get_workflow('premium', checkpointed=False)
+    output = asyncio.run(workflow.ainvoke(state, Backend.run_config(state)))
+    assert output['stop_reason'] == 'plateau'
+    assert output['iteration_count'] == state['patience'] < state['max_iterations']
+    assert output['avg_score'] == output['best_score']
+
+
+def test_best_version_is_returned_when_a_rewrite_scores_lower(stand_in_model, monkeypatch):
+    async def worse_after_rewrite(prompt, tags=None):
+        reply = await slow_improver(prompt)
+        if '"score"' in reply:
+            score = 5.0 if "revision" in prompt else 6.0
+            reply = json.dumps({rubric: {'feedback': "Needs work.", 'score': score} for rubric in Backend.RUBRICS})
+        return reply, Backend.CHEAP_MODEL
+
+    monkeypatch.setattr(Backend, 'ask_model_reply', worse_after_rewrite)
+    restores = Backend.metrics._counters.get(('upse_best_version_restores_total', (('plan', 'basic'),)), 0)
+    state = Backend.initial_state(ESSAY, 'basic')
+    workflow = Backend.get_workflow('basic', checkpointed=False)
+    output = asyncio.run(workflow.ainvoke(state, Backend.run_config(state)))
+
+    assert output['stop_reason'] == 'plateau'
+    assert output['iteration_count'] == 1
+    assert output['score_history'][1] == [5.0, 5.0, 5.0]
+    assert output['avg_score'] == output['best_score'] == 6.0
+    assert output['essay'] == ESSAY
+    assert Backend.metrics._counters[('upse_best_version_restores_total', (('plan', 'basic'),))] == restores + 1